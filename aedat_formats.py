@@ -0,0 +1,405 @@
+import numpy as np
+import os
+import re
+import struct
+
+try:
+    import lz4.frame # Only needed for LZ4-compressed AEDAT 4.0 files
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard # Only needed for ZSTD-compressed AEDAT 4.0 files
+except ImportError:
+    zstandard = None
+
+class AedatHeaderParser:
+
+    """
+    Methods for detecting the format version of .aedat files and choosing their decoder
+
+    Methods
+    -------
+    parse_header(aer_file)
+        Return the version, header length and format details of an open .aedat file
+    get_decoder(header)
+        Return the decoder of the format described by header
+    """
+
+    def __init__(self):
+
+        self._BLOCK = 1 << 16 # Bytes read at once while looking for the end of the header
+        self._VERSION_PATTERN = re.compile(rb"#!AER-DAT(\d+)\.(\d+)")
+        self._DECODERS = {"2.0": Aedat2Decoder, "3.0": Aedat31Decoder, "3.1": Aedat31Decoder, "4.0": Aedat4Decoder}
+
+    # ------------ PARSE HEADER METHOD ------------
+
+    def parse_header(self, aer_file) -> dict:
+
+        """
+        Return the version, header length and format details of an open .aedat file
+        """
+
+        aer_file.seek(0)
+        block = aer_file.read(self._BLOCK)
+
+        match = self._VERSION_PATTERN.match(block)
+        version = f"{int(match.group(1))}.{int(match.group(2))}" if match else "2.0" # jAER files without a version line are 2.0
+        if version not in self._DECODERS:
+            raise ValueError(f"Unsupported AEDAT version {version}. Choose one of {tuple(self._DECODERS)}")
+
+        if version == "4.0":
+            return self._parse_aedat4_header(aer_file, len(match.group(0)) + 2) # Version line ends with \r\n
+
+        header_length = self._find_end_of_ascii_header(aer_file, block, stop_line = b"#!END-HEADER" if version != "2.0" else None)
+
+        return {"version": version, "header_length": header_length}
+
+    def _find_end_of_ascii_header(self, aer_file, block:bytes, stop_line:bytes = None) -> int:
+
+        """
+        Return the length of the lines starting with # (up to stop_line, if given) without reading line by line
+        """
+
+        header_length = 0
+        while block[header_length:header_length+1] == b"#":
+            end_of_line = block.find(b"\n", header_length)
+            if end_of_line == -1: # Header continues after this block
+                more = aer_file.read(self._BLOCK)
+                if not more:
+                    return len(block)
+                block += more
+                continue
+
+            line = block[header_length:end_of_line]
+            header_length = end_of_line + 1
+            if stop_line is not None and line.startswith(stop_line):
+                break
+            if header_length >= len(block):
+                block += aer_file.read(self._BLOCK)
+
+        return header_length
+
+    def _parse_aedat4_header(self, aer_file, version_length:int) -> dict:
+
+        """
+        Read the IOHeader flatbuffer that follows the version line of an AEDAT 4.0 file
+        """
+
+        aer_file.seek(version_length)
+        header_size = struct.unpack("<i", aer_file.read(4))[0]
+        buffer = aer_file.read(header_size)
+
+        table = _Flatbuffer(buffer)
+        info = table.read_string(2) or ""
+
+        return {"version": "4.0",
+                "header_length": version_length + 4 + header_size,
+                "compression": table.read_scalar(0, "<i", 0), # 0 none, 1-2 LZ4, 3-4 ZSTD
+                "data_table_position": table.read_scalar(1, "<q", -1),
+                "event_stream_ids": self._find_event_streams(info)}
+
+    def _find_event_streams(self, info:str) -> list[int]:
+
+        """
+        Return the ids of the output streams of polarity events in the infoNode XML of an AEDAT 4.0 file
+        """
+
+        stream_ids = []
+        for stream_id, node in re.findall(r'<node name="(\d+)" path="/outInfo/\d+/">(.*?)</node>', info, flags = re.S):
+            if re.search(r'key="typeIdentifier"[^>]*>EVTS<', node):
+                stream_ids.append(int(stream_id))
+
+        return stream_ids
+
+    # ------------ GET DECODER METHOD ------------
+
+    def get_decoder(self, header:dict):
+
+        """
+        Return the decoder of the format described by header
+        """
+
+        return self._DECODERS[header["version"]](header)
+
+class Aedat2Decoder:
+
+    """
+    Methods for decoding AEDAT 2.0 files: big-endian (address, timestamp) pairs
+
+    Methods
+    -------
+    decode(aer_file, only_first_event)
+        Decode the polarity events of an open .aedat file into x,y,ts,pol without normalizing ts
+    count_events(payload_length)
+        Return the number of 8-byte events decoded from a payload of the given length
+    decode_buffer(aer_raw_data)
+        Decode a buffer of big-endian (address, timestamp) pairs into x,y,ts,pol
+    decode_raw_events(raw_events)
+        Decode an array of (address, timestamp) rows into x,y,ts,pol
+    """
+
+    def __init__(self, header):
+
+        self._HEADER_LENGTH = header["header_length"]
+        self._N_BYTES = 8
+        self._MASK = [0x003ff000,0x7fc00000,0x800,0]
+        self._SHIFT = [12,22,11,31]
+        self._FIRST_EVENT_BLOCK = 4096 # Events read per block when looking for the first event
+
+    def decode(self, aer_file, only_first_event:bool) -> list[np.ndarray]:
+
+        """
+        Decode the polarity events of an open .aedat file into x,y,ts,pol without normalizing ts
+        """
+
+        n_events = self.count_events(os.fstat(aer_file.fileno()).st_size - self._HEADER_LENGTH)
+        aer_file.seek(self._HEADER_LENGTH)
+
+        if not only_first_event:
+            return self.decode_buffer(aer_file.read(n_events * self._N_BYTES))
+
+        # Read small blocks until a non-special event shows up
+        while n_events > 0:
+            n_block = min(n_events, self._FIRST_EVENT_BLOCK)
+            x,y,ts,pol = self.decode_buffer(aer_file.read(n_block * self._N_BYTES))
+            if len(ts):
+                return x[:1],y[:1],ts[:1],pol[:1]
+            n_events -= n_block
+
+        return self.decode_buffer(b"")
+
+    def count_events(self, payload_length:int) -> int:
+
+        """
+        Return the number of 8-byte events decoded from a payload of the given length
+        """
+
+        # The reference loop only decodes events that end strictly before the end of the file,
+        # so the last event is skipped when the payload is an exact multiple of 8 bytes
+        return max(min((payload_length + self._N_BYTES - 1) // self._N_BYTES - 1, payload_length // self._N_BYTES), 0)
+
+    def decode_buffer(self, aer_raw_data:bytes) -> list[np.ndarray]:
+
+        """
+        Decode a buffer of big-endian (address, timestamp) pairs into x,y,ts,pol
+        """
+
+        n_events = len(aer_raw_data) // self._N_BYTES
+        raw_events = np.frombuffer(aer_raw_data, dtype = ">u4", count = 2*n_events).reshape(n_events, 2)
+
+        return self.decode_raw_events(raw_events)
+
+    def decode_raw_events(self, raw_events:np.ndarray) -> list[np.ndarray]:
+
+        """
+        Decode an array of (address, timestamp) rows into x,y,ts,pol
+        """
+
+        address = raw_events[:,0]
+        timestamp = raw_events[:,1]
+
+        is_polarity_event = (address >> self._SHIFT[3]) == self._MASK[3] # Filter special events
+        address = address[is_polarity_event]
+
+        x = ((address & self._MASK[0]) >> self._SHIFT[0]).astype(np.int64)
+        y = ((address & self._MASK[1]) >> self._SHIFT[1]).astype(np.int64)
+        ts = timestamp[is_polarity_event].astype(np.int64)
+        pol = ((address & self._MASK[2]) >> self._SHIFT[2]).astype(np.int64)
+
+        return x,y,ts,pol
+
+class Aedat31Decoder:
+
+    """
+    Methods for decoding AEDAT 3.x files: packets of little-endian events behind a 28-byte packet header
+
+    Methods
+    -------
+    decode(aer_file, only_first_event)
+        Decode the polarity events of an open .aedat file into x,y,ts,pol without normalizing ts
+    """
+
+    def __init__(self, header):
+
+        self._HEADER_LENGTH = header["header_length"]
+        self._PACKET_HEADER = struct.Struct("<hhiiiiii") # type, source, size, ts offset, ts overflow, capacity, number, valid
+        self._POLARITY_EVENT = 1
+        self._EVENT_DTYPE = np.dtype([("data","<u4"),("ts","<i4")])
+
+    def decode(self, aer_file, only_first_event:bool) -> list[np.ndarray]:
+
+        """
+        Decode the polarity events of an open .aedat file into x,y,ts,pol without normalizing ts
+        """
+
+        aer_file.seek(self._HEADER_LENGTH)
+        payload = aer_file.read()
+        list_data = []
+        list_ts = []
+
+        position = 0
+        while position + self._PACKET_HEADER.size <= len(payload):
+            event_type, _, event_size, _, ts_overflow, capacity, n_events, _ = self._PACKET_HEADER.unpack_from(payload, position)
+            position += self._PACKET_HEADER.size
+            if event_size <= 0 or capacity < 0:
+                raise OSError("Corrupted file: Invalid AEDAT 3.1 packet header.")
+
+            if event_type == self._POLARITY_EVENT and event_size == self._EVENT_DTYPE.itemsize:
+                n_events = min(n_events, (len(payload) - position) // event_size) # Truncated last packet
+                events = np.frombuffer(payload, dtype = self._EVENT_DTYPE, count = n_events, offset = position)
+                events = events[(events["data"] & 1).astype(bool)] # Valid events only
+                list_data.append(events["data"])
+                list_ts.append(events["ts"].astype(np.int64) | (np.int64(ts_overflow) << 31))
+                if only_first_event and len(events):
+                    break
+            position += capacity * event_size
+
+        data = np.concatenate(list_data) if list_data else np.empty(0, dtype = np.uint32)
+        ts = np.concatenate(list_ts) if list_ts else np.empty(0, dtype = np.int64)
+        if only_first_event:
+            data, ts = data[:1], ts[:1]
+
+        x = ((data >> 17) & 0x7fff).astype(np.int64)
+        y = ((data >> 2) & 0x7fff).astype(np.int64)
+        pol = ((data >> 1) & 1).astype(np.int64)
+
+        return x,y,ts,pol
+
+class Aedat4Decoder:
+
+    """
+    Methods for decoding AEDAT 4.0 files: framed, optionally compressed flatbuffer packets
+
+    Methods
+    -------
+    decode(aer_file, only_first_event)
+        Decode the polarity events of an open .aedat file into x,y,ts,pol without normalizing ts
+    """
+
+    def __init__(self, header):
+
+        self._HEADER_LENGTH = header["header_length"]
+        self._COMPRESSION = header["compression"]
+        self._DATA_TABLE_POSITION = header["data_table_position"] # Packets end where the data table starts
+        self._EVENT_STREAM_IDS = set(header["event_stream_ids"])
+        self._PACKET_HEADER = struct.Struct("<ii") # stream id, size
+        self._EVENT_DTYPE = np.dtype({"names": ["t","x","y","on"], "formats": ["<i8","<i2","<i2","u1"],
+                                      "offsets": [0,8,10,12], "itemsize": 16}) # Flatbuffer struct Event, aligned to 8 bytes
+
+    def decode(self, aer_file, only_first_event:bool) -> list[np.ndarray]:
+
+        """
+        Decode the polarity events of an open .aedat file into x,y,ts,pol without normalizing ts
+        """
+
+        aer_file.seek(self._HEADER_LENGTH)
+        payload = aer_file.read()
+        if self._DATA_TABLE_POSITION > self._HEADER_LENGTH:
+            payload = payload[:self._DATA_TABLE_POSITION - self._HEADER_LENGTH]
+        list_events = []
+
+        position = 0
+        while position + self._PACKET_HEADER.size <= len(payload):
+            stream_id, size = self._PACKET_HEADER.unpack_from(payload, position)
+            position += self._PACKET_HEADER.size
+            if size < 0 or position + size > len(payload):
+                break # Truncated last packet
+
+            if not self._EVENT_STREAM_IDS or stream_id in self._EVENT_STREAM_IDS:
+                buffer = self._decompress(payload[position:position + size])
+                if buffer[4:8] == b"EVTS":
+                    events = _Flatbuffer(buffer).read_struct_vector(0, self._EVENT_DTYPE)
+                    list_events.append(events)
+                    if only_first_event and len(events):
+                        break
+            position += size
+
+        events = np.concatenate(list_events) if list_events else np.empty(0, dtype = self._EVENT_DTYPE)
+        if only_first_event:
+            events = events[:1]
+
+        return events["x"].astype(np.int64), events["y"].astype(np.int64), events["t"].astype(np.int64), events["on"].astype(np.int64)
+
+    def _decompress(self, buffer:bytes) -> bytes:
+
+        """
+        Decompress one packet with the compression of the file
+        """
+
+        if self._COMPRESSION == 0:
+            return buffer
+
+        if self._COMPRESSION in (1, 2):
+            if lz4 is None:
+                raise OSError("LZ4-compressed AEDAT 4.0 files need the lz4 package (pip install lz4)")
+            return lz4.frame.decompress(buffer)
+
+        if self._COMPRESSION in (3, 4):
+            if zstandard is None:
+                raise OSError("ZSTD-compressed AEDAT 4.0 files need the zstandard package (pip install zstandard)")
+            return zstandard.ZstdDecompressor().decompressobj().decompress(buffer)
+
+        raise OSError(f"Corrupted file: Unknown AEDAT 4.0 compression {self._COMPRESSION}.")
+
+class _Flatbuffer:
+
+    """
+    Methods for reading the fields of the root table of a flatbuffer
+    """
+
+    def __init__(self, buffer):
+
+        self._buffer = buffer
+        self._table = struct.unpack_from("<I", buffer, 0)[0]
+        vtable = self._table - struct.unpack_from("<i", buffer, self._table)[0]
+        vtable_size = struct.unpack_from("<H", buffer, vtable)[0]
+        self._field_offsets = struct.unpack_from(f"<{(vtable_size - 4) // 2}H", buffer, vtable + 4)
+
+    def _get_field_position(self, field:int) -> int:
+
+        """
+        Return the position of a field in the buffer, or None if the field is not set
+        """
+
+        if field >= len(self._field_offsets) or self._field_offsets[field] == 0:
+            return None
+
+        return self._table + self._field_offsets[field]
+
+    def read_scalar(self, field:int, fmt:str, default):
+
+        """
+        Return a scalar field, or default if the field is not set
+        """
+
+        position = self._get_field_position(field)
+        return default if position is None else struct.unpack_from(fmt, self._buffer, position)[0]
+
+    def read_string(self, field:int) -> str:
+
+        """
+        Return a string field, or None if the field is not set
+        """
+
+        position = self._get_field_position(field)
+        if position is None:
+            return None
+        position += struct.unpack_from("<I", self._buffer, position)[0]
+        length = struct.unpack_from("<I", self._buffer, position)[0]
+
+        return bytes(self._buffer[position + 4:position + 4 + length]).decode(errors = "ignore")
+
+    def read_struct_vector(self, field:int, dtype:np.dtype) -> np.ndarray:
+
+        """
+        Return a vector of structs as a structured array view on the buffer
+        """
+
+        position = self._get_field_position(field)
+        if position is None:
+            return np.empty(0, dtype = dtype)
+        position += struct.unpack_from("<I", self._buffer, position)[0]
+        length = struct.unpack_from("<I", self._buffer, position)[0]
+
+        return np.frombuffer(self._buffer, dtype = dtype, count = length, offset = position + 4)
@@ -0,0 +1,101 @@
+import numpy as np
+
+class AedatGenerator:
+
+    """
+    Methods for writing synthetic .aedat files in the jAER AEDAT 2.0 format
+
+    Methods
+    -------
+    write_aedat_file(file_name_with_ext, duration, event_rate, special_ratio, n_wraps)
+        Write header and random events covering duration seconds to .aedat file
+    write_events(aer_file, n_events, duration_us, special_ratio, n_wraps, start_us)
+        Append n_events random events spread over duration_us to an open .aedat file
+    """
+
+    def __init__(self, width = 240, height = 180, seed = None):
+
+        self._MASK = [0x003ff000,0x7fc00000,0x800,0] # Same address layout as FileManager
+        self._SHIFT = [12,22,11,31]
+        self._WIDTH = width # DAVIS240C
+        self._HEIGHT = height
+        self._HEADER = b"#!AER-DAT2.0\r\n# This is a raw AE data file created by AedatGenerator\r\n#End Of ASCII Header\r\n"
+        self._CHUNK_EVENTS = 1 << 20 # Events generated and written at once (8 MB)
+        self._WRAP_US = 1 << 32
+        self._rng = np.random.default_rng(seed)
+
+    # ------------ WRITE AEDAT FILE METHOD ------------
+
+    def write_aedat_file(self, file_name_with_ext:str, duration:float, event_rate:float, special_ratio:float = 0.0, n_wraps:int = 0) -> int:
+
+        """
+        Write header and random events covering duration seconds to .aedat file
+
+        Returns the number of events written
+        """
+
+        n_events = int(duration * event_rate)
+        with open(file_name_with_ext, "wb") as aer_file:
+            aer_file.write(self._HEADER)
+            self.write_events(aer_file, n_events, max(int(duration * 1e6), 1), special_ratio, n_wraps)
+
+        return n_events
+
+    # ------------ WRITE EVENTS METHOD ------------
+
+    def write_events(self, aer_file, n_events:int, duration_us:int, special_ratio:float = 0.0, n_wraps:int = 0, start_us:int = 0) -> None:
+
+        """
+        Append n_events random events spread over duration_us to an open .aedat file
+
+        special_ratio is the fraction of special (non-polarity) events, n_wraps the number of
+        times the 32-bit timestamp overflows and start_us the time of the start of duration_us
+        """
+
+        if not 0 <= special_ratio <= 1:
+            raise ValueError("The special event ratio must be between 0 and 1")
+        if n_wraps < 0:
+            raise ValueError("The number of timestamp wraps must not be negative")
+
+        for start in range(0, n_events, self._CHUNK_EVENTS):
+            n_chunk = min(self._CHUNK_EVENTS, n_events - start)
+
+            # Sorted times inside the share of the duration that belongs to this chunk
+            t0 = start_us + start * duration_us // n_events
+            t1 = start_us + (start + n_chunk) * duration_us // n_events
+            times = np.sort(self._rng.integers(t0, max(t1, t0 + 1), n_chunk, dtype = np.uint64))
+
+            raw_events = np.empty((n_chunk, 2), dtype = ">u4")
+            raw_events[:,0] = self._get_addresses(n_chunk, special_ratio)
+            raw_events[:,1] = self._get_timestamps(times, duration_us, n_wraps, start_us)
+            aer_file.write(raw_events.tobytes())
+
+    def _get_addresses(self, n_events:int, special_ratio:float) -> np.ndarray:
+
+        """
+        Return random polarity event addresses, with a fraction marked as special events
+        """
+
+        addresses = ((self._rng.integers(0, self._WIDTH, n_events, dtype = np.uint32) << self._SHIFT[0]) & self._MASK[0]
+                     | (self._rng.integers(0, self._HEIGHT, n_events, dtype = np.uint32) << self._SHIFT[1]) & self._MASK[1]
+                     | (self._rng.integers(0, 2, n_events, dtype = np.uint32) << self._SHIFT[2]) & self._MASK[2])
+        if special_ratio > 0:
+            addresses[self._rng.random(n_events) < special_ratio] |= np.uint32(1 << self._SHIFT[3])
+
+        return addresses
+
+    def _get_timestamps(self, times:np.ndarray, duration_us:int, n_wraps:int, start_us:int) -> np.ndarray:
+
+        """
+        Map times to raw 32-bit timestamps that overflow n_wraps times
+        """
+
+        if n_wraps == 0:
+            return times & 0xFFFFFFFF
+
+        # Each of the n_wraps segments is moved to its own turn of the counter and centred on the overflow
+        segment_us = max(duration_us // n_wraps, 1)
+        segments = np.minimum((times - np.uint64(start_us)) // np.uint64(segment_us), np.uint64(n_wraps - 1))
+        unwrapped = times + segments * np.uint64(self._WRAP_US - segment_us) + np.uint64(self._WRAP_US - segment_us // 2)
+
+        return unwrapped & 0xFFFFFFFF
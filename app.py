@@ -1,10 +1,14 @@
+from batch_converter import BatchConverter
 from customtkinter import *
 from file_manager import FileManager
 from capture_system import CaptureSystem
+from event_filter import EventFilter
+from live_monitor import LiveMonitor
 
 import customtkinter as ctk
 import glob
 import numpy as np
+import queue
 import threading
 import time
 
@@ -16,13 +20,31 @@ class App(CTk):
 
         ARDUINO_BOARD = "Genuino Uno" #"USB-SERIAL CH340"
         TIME_PRESS_BUTTON = 0 # Time (sec) to offset recording after pressing button. Default: 0
+        N_WORKERS = None # Number of processes used to convert .aedat files. Default: None (one per CPU core)
+        OUTPUT_FORMAT = "matrix" # Layout of _events files: "matrix" (4xN int32 .npy), "structured" (ts,x,y,p records .npy) or "compressed" (.evz chunks)
+        WRITE_INDEX = False # Write _index.npz time index and label event ranges next to each _events.npy. Default: False
+        BACKGROUND_WINDOW_US = None # Remove events without a neighbour event in the last BACKGROUND_WINDOW_US (us). Default: None (disabled)
+        REFRACTORY_US = None # Remove events closer than REFRACTORY_US (us) to the previous event of their pixel. Default: None (disabled)
+        HOT_PIXEL_SIGMA = None # Remove pixels firing HOT_PIXEL_SIGMA standard deviations above the mean rate. Default: None (disabled)
+        N_CONVERSION_WORKERS = 0 # Threads converting each take to .npy while recording continues. Default: 0 (disabled)
+        LIVE_PREVIEW_PORT = None # Port of the jAER AE-over-UDP output (jAER default: 8991) shown while recording. Default: None (disabled)
         self.labels = tuple()
         self.is_confirmed = False
-        self._lock = threading.Lock()
+        self.ui_queue = queue.Queue() # Messages and progress from the worker threads, shown by drain_ui_queue()
+        self.capture_thread = None
+        self.process_thread = None
+        self.cancel_conversion = threading.Event()
 
         self.output_dir = os.path.join(os.path.abspath(""),"test_data")
         self.file_manager = FileManager(self.output_dir)
-        self.capture_system = CaptureSystem(ARDUINO_BOARD, self.output_dir, TIME_PRESS_BUTTON) 
+        event_filter = None
+        if (BACKGROUND_WINDOW_US, REFRACTORY_US, HOT_PIXEL_SIGMA) != (None, None, None):
+            event_filter = EventFilter(background_window_us = BACKGROUND_WINDOW_US, refractory_us = REFRACTORY_US, hot_pixel_sigma = HOT_PIXEL_SIGMA)
+        self.batch_converter = BatchConverter(self.output_dir, N_WORKERS, output_format = OUTPUT_FORMAT, write_index = WRITE_INDEX,
+                                              event_filter = event_filter)
+        live_monitor = LiveMonitor(port = LIVE_PREVIEW_PORT) if LIVE_PREVIEW_PORT else None
+        self.capture_system = CaptureSystem(ARDUINO_BOARD, self.output_dir, TIME_PRESS_BUTTON, N_CONVERSION_WORKERS, output_format = OUTPUT_FORMAT,
+                                            live_monitor = live_monitor, event_filter = event_filter) 
 
         self.title(title)
         self.geometry('720x480')
@@ -42,9 +64,9 @@ class App(CTk):
         self.input_task_frame = InputFrame(record_menu, "Task name:", 1, 1, False)
         self.record_mode_frame = RadioFrame(record_menu, "Choose recording mode:", ["Primitive","Continuous"], 1, 0)
         self.select_primitive = ComboFrame(record_menu, "Choose primitive:", folder_options, 2, 0)
-        run_button = CTkButton(record_menu, text = "Run")
-        run_button.grid(row = 3, column = 0, columnspan = 2, ipadx = 5, ipady = 5)
-        run_button._command = self.run_function
+        self.run_button = CTkButton(record_menu, text = "Run") # Becomes the Cancel button while capturing
+        self.run_button.grid(row = 3, column = 0, columnspan = 2, ipadx = 5, ipady = 5)
+        self.run_button._command = self.run_function
 
         # Processing menu setup
         process_menu = Menu(self, "Process event data", 0)
@@ -52,12 +74,20 @@ class App(CTk):
         # Add components to processing menu
         self.select_folder = ComboFrame(process_menu, "Choose folder:", folder_options, 2, 0)
         self.process_mode_frame = RadioFrame(process_menu, "Choose processing mode:", ["Folder", "All Files"], 1, 0)
-        process_button = Button(process_menu, "Process", 3, 0)
-        process_button._command = self.process_function
+        self.process_button = Button(process_menu, "Process", 3, 0) # Becomes the Cancel button while converting
+        self.process_button._command = self.process_function
+
+        # Live preview and conversion progress setup
+        self.live_label = CTkLabel(self, text = "Live preview: off" if live_monitor is None else "Live preview: waiting for events", font = ("Arial",12), anchor = "w")
+        self.live_label.place(relx = 0.02, rely = 0.74, relwidth = 0.56, relheight = 0.04)
+        if live_monitor is not None:
+            self.after(500, self.update_live_preview)
+        self.progress_label = CTkLabel(self, text = "Conversion: idle", font = ("Arial",12), anchor = "w")
+        self.progress_label.place(relx = 0.6, rely = 0.74, relwidth = 0.38, relheight = 0.04)
 
         # Output terminal setup
         self.output_text = CTkTextbox(self, font = ("Arial",12), state = "disabled")
-        self.output_text.place(relx = 0.02, rely = 0.75, relwidth = 0.96, relheight = 0.22)
+        self.output_text.place(relx = 0.02, rely = 0.79, relwidth = 0.96, relheight = 0.18)
         self.output_text.tag_config("error", foreground="red")
         self.output_text.tag_config("info", foreground="blue")
         self.output_text.tag_config("normal", foreground="black")
@@ -65,72 +95,147 @@ class App(CTk):
         self.print_message("INSTRUCTIONS: Click on the Run button and then press the Pedal to start recording\n", "normal")
         self.print_message("----------------------------------------------\n", "normal")
 
+        self.after(100, self.drain_ui_queue)
         self.mainloop()
 
     def print_message(self, message, tag):
         
-        with self._lock:
-            self.output_text.configure(state = "normal")
-            if tag == "error":
-                self.output_text.insert(ctk.END,message,"error")
-            elif tag == "info":
-                self.output_text.insert(ctk.END,message,"info")
-            elif tag == "normal":
-                self.output_text.insert(ctk.END,message,"normal")
-            self.output_text.see(ctk.END)
-            self.output_text.configure(state = "disabled")
+        # Safe from any thread: the message is inserted by drain_ui_queue() on the Tk thread
+        self.ui_queue.put(("message", message, tag))
+
+    def insert_message(self, message, tag):
+
+        self.output_text.configure(state = "normal")
+        if tag == "error":
+            self.output_text.insert(ctk.END,message,"error")
+        elif tag == "info":
+            self.output_text.insert(ctk.END,message,"info")
+        elif tag == "normal":
+            self.output_text.insert(ctk.END,message,"normal")
+        self.output_text.see(ctk.END)
+        self.output_text.configure(state = "disabled")
+
+    def update_live_preview(self):
+
+        statistics = self.capture_system.get_live_statistics()
+        if statistics is not None:
+            if statistics["on_ratio"] is None:
+                self.live_label.configure(text = "Live preview: no events received from jAER", text_color = "red")
+            else:
+                self.live_label.configure(text = f"Live preview: {statistics['event_rate']/1e3:.1f} kevents/s, {statistics['on_ratio']*100:.0f}% ON, "
+                                                 f"{statistics['n_events']} events this take, {statistics['lost_packets']} lost packet(s)",
+                                          text_color = ("black", "white"))
+        self.after(500, self.update_live_preview)
+
+    def print_summary(self, summary):
+
+        tag = "error" if summary["errors"] else "info"
+        self.print_message(self.batch_converter.summary_to_text(summary), tag)
+
+    def drain_ui_queue(self):
+
+        # Runs on the Tk thread, so only this method touches widgets for the worker threads
+        while True:
+            try:
+                item = self.ui_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if item[0] == "message":
+                self.insert_message(item[1], item[2])
+            elif item[0] == "progress":
+                self.show_progress(item[1])
+            elif item[0] == "process_done":
+                self.print_summary(item[1])
+                self.print_message(item[2], "info")
+                self.process_button.configure(text = "Process")
+                self.progress_label.configure(text = "Conversion: cancelled" if item[1]["n_cancelled"] else "Conversion: done")
+            elif item[0] == "capture_done":
+                self.run_button.configure(text = "Run")
+
+        self.after(100, self.drain_ui_queue)
+
+    def show_progress(self, progress):
+
+        eta = "-" if progress["eta"] is None else f"{progress['eta']:.0f} s"
+        self.progress_label.configure(text = f"Conversion: {progress['n_done']}/{progress['n_total']} file(s), "
+                                             f"{progress['events_per_s']/1e6:.2f} Mevents/s, ETA {eta}")
 
     def process_function(self):
+
+        if self.process_thread is not None and self.process_thread.is_alive():
+            self.cancel_conversion.set()
+            self.print_message("Cancelling conversion after the files being converted...\n", "error")
+            return
         
         if self.process_mode_frame.radio_button1_enabled:
-            
             folder = self.select_folder.get_current_value()
-
             list_all_files = glob.glob(os.path.join(self.output_dir,folder,"*.aedat"))
-            for file in list_all_files:
-                file_dir_no_ext = file[:len(file)-6] # Remove .aedat from file name
-                self.file_manager.aedat_to_npy(file_dir_no_ext)
-
-            self.print_message(f"Finished processing {len(list_all_files)} file(s) in the {folder} folder\n", "info")
-
+            done_message = f"Finished processing {len(list_all_files)} file(s) in the {folder} folder\n"
         else:
-
             list_all_files = glob.glob(os.path.join(self.output_dir,"**","*.aedat"),recursive=True)
-            
-            for file in list_all_files:
-                file_dir_no_ext = file[:len(file)-6] # Remove .aedat from file name
-                self.file_manager.aedat_to_npy(file_dir_no_ext)
+            done_message = f"Finished processing all {len(list_all_files)} available .aedat files\n"
+
+        self.cancel_conversion.clear()
+        self.process_thread = threading.Thread(target = self.convert_files, args = (list_all_files, done_message), daemon = True)
+        self.process_thread.start()
+        self.process_button.configure(text = "Cancel")
+        self.progress_label.configure(text = f"Conversion: checking {len(list_all_files)} file(s)...")
+
+    def convert_files(self, list_all_files, done_message):
 
-            self.print_message(f"Finished processing all {len(list_all_files)} available .aedat files\n", "info")
+        # Runs in self.process_thread
+        try:
+            summary = self.batch_converter.convert(list_all_files, lambda progress: self.ui_queue.put(("progress", progress)), self.cancel_conversion)
+        except Exception as e:
+            self.print_message(f"{e}\n", "error")
+            summary = {"n_files": len(list_all_files), "n_converted": 0, "n_skipped": 0, "n_cancelled": 0, "n_events": 0,
+                       "n_bytes": 0, "elapsed": 0.0, "errors": {"": f"{type(e).__name__}: {e}"}}
+        self.ui_queue.put(("process_done", summary, done_message))
 
     def run_function(self):
+
+        if self.capture_thread is not None and self.capture_thread.is_alive():
+            self.capture_system.cancel()
+            self.print_message("Cancelling capture...\n", "error")
+            return
         
         task_name = self.input_task_frame.get_current_value()
-        paralel_thread = threading.Thread(target = self.capture_system._read_serial)
 
         if task_name == "":
             self.print_message(f"Insert the task name\n", "error")
             return
 
+        if self.record_mode_frame.radio_button1_enabled: # Primitive
+            with_labels = False
+            primitive = self.select_primitive.get_current_value()
+        else: # Continuous
+            with_labels = True
+            primitive = None
+
+        self.capture_thread = threading.Thread(target = self.capture_takes, args = (task_name, with_labels, primitive), daemon = True)
+        self.capture_thread.start()
+        self.run_button.configure(text = "Cancel")
+
+    def capture_takes(self, task_name, with_labels, primitive):
+
+        # Runs in self.capture_thread, so waiting for the buttons does not block the window
+        paralel_thread = threading.Thread(target = self.capture_system._read_serial)
+
         try:
             self.capture_system._start_paralel_thread(paralel_thread)
         except OSError as e:
             self.print_message(f"{e}\n", "error")
+            self.ui_queue.put(("capture_done",))
             return
 
         self.capture_system._file_name = task_name.encode()
 
-        if self.record_mode_frame.radio_button1_enabled: # Primitive
-            with_labels = False
-            primitive = self.select_primitive.get_current_value()
+        if primitive:
             list_existing_files = glob.glob(os.path.join(self.output_dir,primitive,f"{task_name}_*.aedat"))
-            current_attempt = len(list_existing_files) + 1
-    
-        else: # Continuous
-            with_labels = True
+        else:
             list_existing_files = glob.glob(os.path.join(self.output_dir,f"{task_name}_*.aedat"))
-            current_attempt = len(list_existing_files) + 1
-            primitive = None
+        current_attempt = len(list_existing_files) + 1
 
         while True:
             try: 
@@ -138,7 +243,7 @@ class App(CTk):
             except Exception as e:
                 self.terminate_thread(paralel_thread)
                 self.print_message(f"{e}\n", "error")
-                return
+                break
             else:
                 current_attempt += 1
                 self.file_manager.write_csv_file(final_times_list, first_ts, csv_file_dir, with_labels)
@@ -151,7 +256,9 @@ class App(CTk):
                 except Exception as e:
                     self.print_message("Capture closed\n", "error")
                     self.print_message("----------------------------------------------\n", "normal")
-                    return
+                    break
+
+        self.ui_queue.put(("capture_done",))
 
     def terminate_thread(self, paralel_thread):
         self.capture_system._close_capture_system(paralel_thread)
@@ -8,8 +8,23 @@ int readingRed = 0, readingPedal = 0, readingWhite = 0;
 int debounceCountRed = 10, debounceCountPedal = 10, debounceCountWhite  = 10;
 int counterRed = 0, counterPedal = 0, counterWhite = 0;
 
+// Time (us) of the first reading of a change, sent as the time of the debounced edge
+unsigned long edgeTimeRed = 0, edgeTimePedal = 0, edgeTimeWhite = 0;
+unsigned long sequenceNumber = 0;
+unsigned long syncTime = 0;
+unsigned long syncPeriod = 1000; // Time (ms) between two clock synchronization messages
+
 long reading_time = 0;
 
+// Send "<name>,<sequence number>,<micros() of the edge>"
+void sendEdge(const char* name, unsigned long edgeTime){
+  Serial.print(name);
+  Serial.print(",");
+  Serial.print(sequenceNumber++);
+  Serial.print(",");
+  Serial.println(edgeTime);
+}
+
 void setup() {
   // put your setup code here, to run once:
 
@@ -27,6 +42,7 @@ void loop() {
 // If we have gone on to the next millisecond
   if(millis() != reading_time)
   {
+    unsigned long now = micros();
     readingRed = digitalRead(pinRed);
     readingPedal = digitalRead(pinPedal);
     readingWhite = digitalRead(pinWhite);
@@ -35,6 +51,9 @@ void loop() {
       counterRed--;
     }
     else if(readingRed != currentStateRed){
+      if(counterRed == 0){
+        edgeTimeRed = now;
+      }
       counterRed++;
     }
 
@@ -42,14 +61,20 @@ void loop() {
       counterPedal--;
     }
     else if(readingPedal != currentStatePedal){
-       counterPedal++;
+      if(counterPedal == 0){
+        edgeTimePedal = now;
+      }
+      counterPedal++;
     }
 
     if(readingWhite == currentStateWhite && counterWhite > 0){
       counterWhite--;
     }
     else if(readingWhite != currentStateWhite){
-       counterWhite++;
+      if(counterWhite == 0){
+        edgeTimeWhite = now;
+      }
+      counterWhite++;
     }
 
     // If any input has shown the same value for long enough, switch it
@@ -57,7 +82,7 @@ void loop() {
       counterRed = 0;
       currentStateRed = readingRed;
       if (currentStateRed == HIGH){
-        Serial.println("red");
+        sendEdge("red", edgeTimeRed);
       }
     }
       
@@ -65,10 +90,10 @@ void loop() {
       counterPedal = 0;
       currentStatePedal = readingPedal;
       if (currentStatePedal == HIGH){
-        Serial.println("pedal_high");
+        sendEdge("pedal_high", edgeTimePedal);
       }
       else{
-        Serial.println("pedal_low");
+        sendEdge("pedal_low", edgeTimePedal);
       } 
     }
 
@@ -76,9 +101,15 @@ void loop() {
       counterWhite = 0;
       currentStateWhite = readingWhite;
       if (currentStateWhite == HIGH){
-        Serial.println("white");
+        sendEdge("white", edgeTimeWhite);
       }
     }
+
+    // Periodic message so the host can estimate clock offset and drift between button presses
+    if(millis() - syncTime >= syncPeriod){
+      syncTime = millis();
+      sendEdge("sync", micros());
+    }
         
     reading_time = millis();}
 }
@@ -0,0 +1,127 @@
+from event_filter import EventFilter
+from file_manager import FileManager
+from safe_io import SafeIO
+
+import queue
+import threading
+
+class BackgroundConverter:
+
+    """
+    Methods for converting recorded .aedat files into .npy files while recording continues
+
+    Methods
+    -------
+    submit(file_name_with_ext)
+        Queue .aedat file for conversion, waiting while the queue is full
+    drain()
+        Wait until every queued file is converted and stop the workers
+    """
+
+    def __init__(self, output_dir, n_workers, max_queue = 8, output_format = "matrix", event_filter = None):
+
+        self._safe_io = SafeIO()
+        self._file_manager = FileManager(output_dir)
+        self._lock = threading.Lock()
+        self._N_WORKERS = n_workers
+        self._OUTPUT_FORMAT = output_format
+        self._FILTER_PARAMETERS = event_filter.get_parameters() if event_filter is not None else None # None: events are not filtered
+        self._queue = queue.Queue(maxsize = max_queue) # Bounded, so submit() blocks when conversion falls behind
+        self._workers = []
+        self._n_converted = 0
+        self._errors = {}
+
+    # ------------ SUBMIT FILE METHOD ------------
+
+    def submit(self, file_name_with_ext:str) -> None:
+
+        """
+        Queue .aedat file for conversion, waiting while the queue is full
+        """
+
+        self._start_workers()
+
+        try:
+            self._queue.put(file_name_with_ext, block = False)
+        except queue.Full:
+            self._safe_io.print_warning(f"Conversion queue is full. Waiting for {self._queue.qsize()} file(s) to be converted...")
+            self._queue.put(file_name_with_ext)
+
+    # ------------ DRAIN QUEUE METHOD ------------
+
+    def drain(self) -> dict:
+
+        """
+        Wait until every queued file is converted and stop the workers
+        """
+
+        if not self._workers:
+            return self._get_summary()
+
+        n_pending = self._queue.qsize()
+        if n_pending:
+            self._safe_io.print_info(f"Waiting for {n_pending} queued file(s) to be converted...")
+        self._queue.join()
+
+        for _ in self._workers:
+            self._queue.put(None) # Stop signal
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+        summary = self._get_summary()
+        self._safe_io.print_success(f"Converted {summary['n_converted']} file(s) in background, {len(summary['errors'])} failed")
+
+        return summary
+
+    # ------------ WORKER METHODS ------------
+
+    def _start_workers(self) -> None:
+
+        """
+        Start the worker threads if they are not running
+        """
+
+        if self._workers:
+            return
+
+        for _ in range(self._N_WORKERS):
+            worker = threading.Thread(target = self._convert_queued_files, daemon = True)
+            worker.start()
+            self._workers.append(worker)
+
+    def _convert_queued_files(self) -> None:
+
+        """
+        Convert queued files until the stop signal arrives
+        """
+
+        while True:
+            file_name_with_ext = self._queue.get()
+            if file_name_with_ext is None:
+                self._queue.task_done()
+                return
+
+            try:
+                # Streaming keeps memory bounded and the NumPy decoder releases the GIL on large arrays
+                event_filter = EventFilter(**self._FILTER_PARAMETERS) if self._FILTER_PARAMETERS is not None else None # One per file, it keeps state
+                self._file_manager.aedat_to_npy(file_name_with_ext[:len(file_name_with_ext)-6], streaming = True,
+                                                output_format = self._OUTPUT_FORMAT, event_filter = event_filter)
+            except Exception as e:
+                with self._lock:
+                    self._errors[file_name_with_ext] = f"{type(e).__name__}: {e}"
+                self._safe_io.print_error(f"Unable to convert {file_name_with_ext}: {e}")
+            else:
+                with self._lock:
+                    self._n_converted += 1
+            finally:
+                self._queue.task_done()
+
+    def _get_summary(self) -> dict:
+
+        """
+        Return the number of converted files and the errors of failed files
+        """
+
+        with self._lock:
+            return {"n_converted": self._n_converted, "errors": dict(self._errors)}
@@ -0,0 +1,224 @@
+from conversion_manifest import ConversionManifest, fast_file_hash
+from event_codec import CompressedEventReader
+from event_filter import EventFilter
+from file_manager import FileManager
+from safe_io import SafeIO
+
+import concurrent.futures
+import numpy as np
+import os
+import time
+
+# ------------ CONVERSION WORKER ------------
+
+def _convert_file(file_name_with_ext:str, output_dir:str, engine:str, streaming:bool, output_format:str, write_index:bool,
+                  filter_parameters:dict = None) -> list:
+
+    """
+    Convert one .aedat file inside a worker process and return its statistics
+    """
+
+    file_name_no_ext = file_name_with_ext[:len(file_name_with_ext)-6] # Remove .aedat from file name
+    file_manager = FileManager(output_dir)
+    events_file_dir = file_manager._get_events_file_dir(file_name_no_ext, output_format)
+    n_bytes = os.stat(file_name_with_ext).st_size
+    was_converted = not os.path.exists(events_file_dir)
+    event_filter = EventFilter(**filter_parameters) if filter_parameters is not None else None # Rebuilt in the worker process
+
+    start_time = time.perf_counter()
+    file_manager.aedat_to_npy(file_name_no_ext, engine, streaming, output_format = output_format, write_index = write_index,
+                              event_filter = event_filter, manifest = ConversionManifest(output_dir)) # Saved by the main process
+    elapsed = time.perf_counter() - start_time
+
+    if output_format == "compressed":
+        n_events = CompressedEventReader(events_file_dir).get_info()["n_events"]
+    else:
+        n_events = np.load(events_file_dir, mmap_mode = "r").shape[-1] # (4,N) matrix or (N,) structured array
+
+    return [n_events, n_bytes, elapsed, was_converted, fast_file_hash(file_name_with_ext)]
+
+class BatchConverter:
+
+    """
+    Methods for converting many .aedat files into .npy files in parallel, optionally through an EventFilter
+
+    Methods
+    -------
+    convert(list_all_files, progress_function, cancel_event)
+        Convert new or changed .aedat files with a process pool and return a summary
+    summary_to_text(summary)
+        Format the summary of a batch conversion as text
+    """
+
+    def __init__(self, output_dir, max_workers = None, engine = "numpy", streaming = False, output_format = "matrix", write_index = False,
+                 event_filter = None):
+
+        self._safe_io = SafeIO()
+        self._OUTPUT_DIR = output_dir
+        self._MAX_WORKERS = max_workers or os.cpu_count() or 1
+        self._ENGINE = engine
+        self._STREAMING = streaming
+        self._OUTPUT_FORMAT = output_format
+        self._WRITE_INDEX = write_index
+        self._FILTER_PARAMETERS = event_filter.get_parameters() if event_filter is not None else None # None: events are not filtered
+        self._file_manager = FileManager(output_dir)
+
+    # ------------ BATCH CONVERSION METHOD ------------
+
+    def convert(self, list_all_files:list[str], progress_function = None, cancel_event = None) -> dict:
+
+        """
+        Convert new or changed .aedat files with a process pool and return a summary
+
+        progress_function, if given, is called with the progress after every file. Setting
+        cancel_event (threading.Event) skips the files that did not start converting yet.
+        """
+
+        summary = {"n_files": len(list_all_files), "n_converted": 0, "n_skipped": 0, "n_cancelled": 0, "n_events": 0,
+                   "n_bytes": 0, "elapsed": 0.0, "errors": {}}
+        start_time = time.perf_counter()
+
+        manifest = ConversionManifest(self._OUTPUT_DIR)
+        list_changed_files = []
+        for file in list_all_files:
+            try:
+                needs_conversion = self._needs_conversion(file, manifest)
+            except Exception as e:
+                self._add_error(summary, file, e)
+                continue
+            if needs_conversion:
+                list_changed_files.append(file)
+            else:
+                summary["n_skipped"] += 1
+
+        # Largest files first so that no worker is left with a big file at the end
+        list_changed_files = sorted(list_changed_files, key = os.path.getsize, reverse = True)
+        progress = {"n_done": 0, "n_total": len(list_changed_files), "n_done_bytes": 0,
+                    "n_total_bytes": sum(os.path.getsize(file) for file in list_changed_files), "start_time": start_time}
+
+        try:
+            if self._MAX_WORKERS == 1 or len(list_changed_files) <= 1:
+                for file in list_changed_files:
+                    if cancel_event is not None and cancel_event.is_set():
+                        summary["n_cancelled"] += 1
+                        continue
+                    try:
+                        result = _convert_file(file, self._OUTPUT_DIR, self._ENGINE, self._STREAMING, self._OUTPUT_FORMAT, self._WRITE_INDEX, self._FILTER_PARAMETERS)
+                    except Exception as e:
+                        self._add_error(summary, file, e)
+                    else:
+                        self._add_result(summary, result, file, manifest)
+                    self._report_progress(progress_function, progress, summary, file)
+
+            else:
+                with concurrent.futures.ProcessPoolExecutor(max_workers = self._MAX_WORKERS) as executor:
+                    # One file per worker in flight, so a cancel skips every file that did not start yet
+                    list_queued_files = list(list_changed_files)
+                    futures = {}
+                    while list_queued_files or futures:
+                        if cancel_event is not None and cancel_event.is_set():
+                            summary["n_cancelled"] += len(list_queued_files)
+                            list_queued_files = []
+                        while list_queued_files and len(futures) < self._MAX_WORKERS:
+                            file = list_queued_files.pop(0)
+                            futures[executor.submit(_convert_file, file, self._OUTPUT_DIR, self._ENGINE, self._STREAMING, self._OUTPUT_FORMAT, self._WRITE_INDEX, self._FILTER_PARAMETERS)] = file
+                        if not futures:
+                            break
+
+                        done, _ = concurrent.futures.wait(futures, return_when = concurrent.futures.FIRST_COMPLETED)
+                        for future in done:
+                            file = futures.pop(future)
+                            try:
+                                result = future.result()
+                            except Exception as e:
+                                self._add_error(summary, file, e)
+                            else:
+                                self._add_result(summary, result, file, manifest)
+                            self._report_progress(progress_function, progress, summary, file)
+        finally:
+            manifest.save()
+
+        summary["elapsed"] = time.perf_counter() - start_time
+
+        return summary
+
+    def _report_progress(self, progress_function, progress:dict, summary:dict, file_name_with_ext:str) -> None:
+
+        """
+        Update the progress with a finished file and pass it to progress_function
+        """
+
+        progress["n_done"] += 1
+        progress["n_done_bytes"] += os.path.getsize(file_name_with_ext)
+        if progress_function is None:
+            return
+
+        elapsed = time.perf_counter() - progress["start_time"]
+        bytes_per_s = progress["n_done_bytes"] / elapsed if elapsed > 0 else 0.0
+        progress_function({"n_done": progress["n_done"],
+                           "n_total": progress["n_total"],
+                           "file": file_name_with_ext,
+                           "n_events": summary["n_events"],
+                           "events_per_s": summary["n_events"] / elapsed if elapsed > 0 else 0.0,
+                           "eta": (progress["n_total_bytes"] - progress["n_done_bytes"]) / bytes_per_s if bytes_per_s > 0 else None})
+
+    # ------------ CONVERSION CHECK METHOD ------------
+
+    def _needs_conversion(self, file_name_with_ext:str, manifest:ConversionManifest) -> bool:
+
+        """
+        Check the manifest and remove outdated outputs of .aedat file that must be converted again
+
+        Up-to-date files still go to a worker if write_index is set and their _index.npz file is missing. aedat_to_npy
+        then only writes the index, and the file counts as skipped
+        """
+
+        file_name_no_ext = file_name_with_ext[:len(file_name_with_ext)-6] # Remove .aedat from file name
+        if not self._file_manager._is_conversion_up_to_date(file_name_with_ext, self._OUTPUT_FORMAT, self._FILTER_PARAMETERS, manifest):
+            return True
+
+        return self._WRITE_INDEX and not os.path.exists(f"{file_name_no_ext}_index.npz")
+
+    # ------------ SUMMARY TO TEXT METHOD ------------
+
+    def summary_to_text(self, summary:dict) -> str:
+
+        """
+        Format the summary of a batch conversion as text
+        """
+
+        elapsed = max(summary["elapsed"], 1e-9)
+        text = (f"Converted {summary['n_converted']} of {summary['n_files']} file(s) "
+                f"({summary['n_skipped']} already converted, {summary['n_cancelled']} cancelled, {len(summary['errors'])} failed)\n"
+                f"{summary['n_events']} events, {summary['n_bytes']/1e6:.1f} MB in {summary['elapsed']:.2f} s "
+                f"({summary['n_events']/elapsed/1e6:.2f} Mevents/s, {summary['n_bytes']/elapsed/1e6:.1f} MB/s)\n")
+        for file, error in summary["errors"].items():
+            text += f"Failed {file}: {error}\n"
+
+        return text
+
+    # ------------ SUMMARY HELPER METHODS ------------
+
+    def _add_result(self, summary:dict, result:list, file:str, manifest:ConversionManifest) -> None:
+
+        """
+        Add the statistics of one converted file to the summary and the manifest
+        """
+
+        n_events, n_bytes, _, was_converted, content_hash = result
+        manifest.set_entry(file, self._file_manager._new_manifest_entry(file, self._OUTPUT_FORMAT, content_hash))
+        if was_converted:
+            summary["n_converted"] += 1
+            summary["n_events"] += n_events
+            summary["n_bytes"] += n_bytes
+        else:
+            summary["n_skipped"] += 1
+
+    def _add_error(self, summary:dict, file:str, error:Exception) -> None:
+
+        """
+        Register the error of one file without stopping the batch
+        """
+
+        summary["errors"][file] = f"{type(error).__name__}: {error}"
+        self._safe_io.print_error(f"Unable to convert {file}: {error}")
@@ -0,0 +1,246 @@
+from aedat_generator import AedatGenerator
+from file_manager import FileManager
+from safe_io import SafeIO
+
+import concurrent.futures
+import json
+import multiprocessing
+import numpy as np
+import os
+import platform
+import sys
+import tempfile
+import time
+
+try:
+    import resource # Not available on Windows, where peak RSS is not reported
+except ImportError:
+    resource = None
+
+class FileManagerBenchmark:
+
+    """
+    Methods for measuring FileManager throughput and memory on synthetic .aedat files
+
+    Methods
+    -------
+    run(sizes, cases)
+        Time every case on one generated .aedat file per size and return the results
+    save_results(results, json_file_dir)
+        Write results to .json file
+    load_results(json_file_dir)
+        Read results from .json file
+    results_to_text(results)
+        Format results as a table
+    compare_results(old_results, new_results)
+        Format the speed and memory ratios between two runs as a table
+    """
+
+    def __init__(self, work_dir = None, n_repeats = 3, event_rate = 1e6, special_ratio = 0.0, seed = 0):
+
+        self._safe_io = SafeIO()
+        self._WORK_DIR = work_dir or tempfile.mkdtemp(prefix = "benchmark_") # Generated .aedat and .npy files
+        self._N_REPEATS = n_repeats # The fastest repeat is reported
+        self._EVENT_RATE = event_rate # Events per second of the generated files
+        self._SPECIAL_RATIO = special_ratio
+        self._SEED = seed
+        self._CASES = ("decode_aedat_file", "decode_aedat_file_reference", "aedat_to_npy", "aedat_to_npy_streaming",
+                       "aedat_to_npy_structured", "aedat_to_npy_compressed", "read_npy_file", "read_compressed_file")
+
+    # ------------ RUN BENCHMARK METHOD ------------
+
+    def run(self, sizes:list[int], cases:tuple = ("decode_aedat_file", "aedat_to_npy", "aedat_to_npy_streaming", "aedat_to_npy_compressed",
+                                                  "read_npy_file", "read_compressed_file")) -> dict:
+
+        """
+        Time every case on one generated .aedat file per size and return the results
+        """
+
+        for case in cases:
+            if case not in self._CASES:
+                raise ValueError(f"Unknown benchmark case {case}. Choose one of {self._CASES}")
+
+        results = {"metadata": self._get_metadata(), "results": []}
+        aedat_generator = AedatGenerator(seed = self._SEED)
+        context = multiprocessing.get_context("spawn") # A fresh process per case, so peak RSS is not inherited
+
+        for n_events in sizes:
+            file_name_no_ext = os.path.join(self._WORK_DIR, f"benchmark_{n_events}")
+            if not os.path.exists(f"{file_name_no_ext}.aedat"):
+                aedat_generator.write_aedat_file(f"{file_name_no_ext}.aedat", n_events / self._EVENT_RATE, self._EVENT_RATE,
+                                                 self._SPECIAL_RATIO)
+
+            for case in cases:
+                with concurrent.futures.ProcessPoolExecutor(max_workers = 1, mp_context = context) as executor:
+                    measurement = executor.submit(_run_case, case, file_name_no_ext, self._N_REPEATS).result()
+
+                elapsed = max(measurement["elapsed"], 1e-9)
+                results["results"].append({"case": case,
+                                           "n_events": n_events,
+                                           "n_bytes": measurement["n_bytes"], # Bytes read by the case
+                                           "elapsed": measurement["elapsed"],
+                                           "events_per_s": n_events / elapsed,
+                                           "mb_per_s": measurement["n_bytes"] / elapsed / 1e6,
+                                           "peak_rss_mb": measurement["peak_rss_mb"],
+                                           "baseline_rss_mb": measurement["baseline_rss_mb"]}) # Peak RSS before the case ran
+                self._safe_io.print_info(f"{case} ({n_events} events): {measurement['elapsed']:.3f} s")
+
+        return results
+
+    def _get_metadata(self) -> dict:
+
+        """
+        Return the machine and library versions the results were measured on
+        """
+
+        return {"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "platform": platform.platform(),
+                "processor": platform.processor(),
+                "cpu_count": os.cpu_count(),
+                "python": sys.version.split()[0],
+                "numpy": np.__version__,
+                "n_repeats": self._N_REPEATS,
+                "event_rate": self._EVENT_RATE,
+                "special_ratio": self._SPECIAL_RATIO,
+                "seed": self._SEED}
+
+    # ------------ SAVE AND LOAD RESULTS METHODS ------------
+
+    def save_results(self, results:dict, json_file_dir:str) -> None:
+
+        """
+        Write results to .json file
+        """
+
+        with open(json_file_dir, "w") as json_file:
+            json.dump(results, json_file, indent = 1)
+
+    def load_results(self, json_file_dir:str) -> dict:
+
+        """
+        Read results from .json file
+        """
+
+        try:
+            with open(json_file_dir) as json_file:
+                return json.load(json_file)
+        except OSError:
+            raise OSError("File not found.")
+
+    # ------------ FORMAT RESULTS METHODS ------------
+
+    def results_to_text(self, results:dict) -> str:
+
+        """
+        Format results as a table
+        """
+
+        text = f"{'case':<28}{'events':>12}{'time (s)':>11}{'Mevents/s':>11}{'MB/s':>9}{'peak RSS (MB)':>15}\n"
+        for result in results["results"]:
+            peak_rss = "-" if result["peak_rss_mb"] is None else f"{result['peak_rss_mb']:.1f}"
+            text += (f"{result['case']:<28}{result['n_events']:>12}{result['elapsed']:>11.3f}{result['events_per_s']/1e6:>11.2f}"
+                     f"{result['mb_per_s']:>9.1f}{peak_rss:>15}\n")
+
+        return text
+
+    def compare_results(self, old_results:dict, new_results:dict) -> str:
+
+        """
+        Format the speed and memory ratios between two runs as a table
+        """
+
+        old_by_key = {(result["case"], result["n_events"]): result for result in old_results["results"]}
+
+        text = f"{'case':<28}{'events':>12}{'speedup':>9}{'RSS ratio':>11}\n"
+        for result in new_results["results"]:
+            old_result = old_by_key.get((result["case"], result["n_events"]))
+            if old_result is None:
+                continue
+            speedup = result["events_per_s"] / max(old_result["events_per_s"], 1e-9)
+            rss_ratio = "-"
+            if result["peak_rss_mb"] and old_result["peak_rss_mb"]:
+                rss_ratio = f"{result['peak_rss_mb'] / old_result['peak_rss_mb']:.2f}"
+            text += f"{result['case']:<28}{result['n_events']:>12}{speedup:>9.2f}{rss_ratio:>11}\n"
+
+        return text
+
+# ------------ BENCHMARK WORKERS ------------
+
+def _run_case(case: str, file_name_no_ext: str, n_repeats: int) -> dict:
+
+    """
+    Time one case in the current process and return its fastest repeat and peak RSS
+    """
+
+    baseline_rss_mb = _get_peak_rss_mb()
+    file_manager = FileManager(os.path.dirname(file_name_no_ext))
+    npy_file_dir = f"{file_name_no_ext}_events.npy"
+    evz_file_dir = f"{file_name_no_ext}_events.evz"
+    output_file_dir = evz_file_dir if case in ("aedat_to_npy_compressed", "read_compressed_file") else npy_file_dir
+
+    if case == "read_npy_file" and not os.path.exists(npy_file_dir):
+        file_manager.aedat_to_npy(file_name_no_ext, streaming = True)
+    if case == "read_compressed_file" and not os.path.exists(evz_file_dir):
+        file_manager.aedat_to_npy(file_name_no_ext, streaming = True, output_format = "compressed")
+    if case == "read_compressed_file" and os.path.exists(npy_file_dir):
+        os.remove(npy_file_dir) # FileManager reads the .npy file when both exist
+
+    elapsed = []
+    for _ in range(n_repeats):
+        if case.startswith("aedat_to_npy") and os.path.exists(output_file_dir):
+            os.remove(output_file_dir) # aedat_to_npy skips files that were already converted
+
+        start_time = time.perf_counter()
+        if case == "decode_aedat_file":
+            file_manager.decode_aedat_file(f"{file_name_no_ext}.aedat", False)
+        elif case == "decode_aedat_file_reference":
+            file_manager.decode_aedat_file(f"{file_name_no_ext}.aedat", False, "reference")
+        elif case == "aedat_to_npy":
+            file_manager.aedat_to_npy(file_name_no_ext)
+        elif case == "aedat_to_npy_streaming":
+            file_manager.aedat_to_npy(file_name_no_ext, streaming = True)
+        elif case == "aedat_to_npy_structured":
+            file_manager.aedat_to_npy(file_name_no_ext, streaming = True, output_format = "structured")
+        elif case == "aedat_to_npy_compressed":
+            file_manager.aedat_to_npy(file_name_no_ext, streaming = True, output_format = "compressed")
+        elif case in ("read_npy_file", "read_compressed_file"): # np.load of the .npy file or decoding of every .evz chunk
+            file_manager.read_npy_file(file_name_no_ext)
+        elapsed.append(time.perf_counter() - start_time)
+
+    if case.startswith("aedat_to_npy"):
+        os.remove(output_file_dir) # Leave the .npy file of read_npy_file in the matrix format
+
+    n_bytes = os.stat(output_file_dir if case.startswith("read") else f"{file_name_no_ext}.aedat").st_size
+
+    return {"elapsed": min(elapsed), "n_bytes": n_bytes, "peak_rss_mb": _get_peak_rss_mb(), "baseline_rss_mb": baseline_rss_mb}
+
+def _get_peak_rss_mb() -> float:
+
+    """
+    Return the peak resident memory of the current process (MB), or None where it is not available
+    """
+
+    if resource is None:
+        return None
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / 1e6 if sys.platform == "darwin" else peak_rss / 1e3 # Bytes on macOS, kB on Linux
+
+# ------------ RUN BENCHMARK ------------
+
+if __name__ == "__main__":
+
+    SIZES = [100_000, 1_000_000, 10_000_000] # Events per generated .aedat file
+    N_REPEATS = 3
+    RESULTS_FILE = "benchmark_results.json"
+    COMPARE_WITH = None # .json file of a previous run. Default: None (no comparison)
+
+    safe_io = SafeIO()
+    benchmark = FileManagerBenchmark(n_repeats = N_REPEATS)
+    results = benchmark.run(SIZES)
+    benchmark.save_results(results, RESULTS_FILE)
+
+    safe_io.print_info(benchmark.results_to_text(results))
+    if COMPARE_WITH is not None:
+        safe_io.print_info(benchmark.compare_results(benchmark.load_results(COMPARE_WITH), results))
+    safe_io.print_success(f"Results were written to {RESULTS_FILE}")
@@ -0,0 +1,179 @@
+from safe_io import SafeIO
+
+import random
+import serial
+import serial.tools.list_ports
+import time
+
+class SerialButtonSource:
+
+    """
+    Methods for reading button lines from the Arduino over a serial port
+
+    Methods
+    -------
+    open()
+        Find the board and connect to it
+    readline()
+        Return the next line, or b"" if none arrived before the timeout
+    close()
+        Close the serial connection
+    """
+
+    def __init__(self, board_type, baudrate = 9600, timeout = 0.1):
+
+        self._safe_io = SafeIO()
+        self._BOARD_TYPE = board_type
+        self._BAUDRATE = baudrate
+        self._TIMEOUT = timeout # Maximum time (s) readline() blocks
+        self._arduino = None
+
+    # ------------ OPEN AND CLOSE METHODS ------------
+
+    def open(self) -> None:
+
+        """
+        Find the board and connect to it
+        """
+
+        all_ports = serial.tools.list_ports.comports()
+        com_port = None
+        for port, desc, _ in all_ports:
+            if self._BOARD_TYPE in desc:
+                com_port = port
+                self._safe_io.print_success(f"{self._BOARD_TYPE} board was found at {com_port}")
+        if com_port is None:
+            raise OSError(f"Board {self._BOARD_TYPE} was not found")
+
+        try:
+            self._arduino = serial.Serial(port = com_port, baudrate = self._BAUDRATE, timeout = self._TIMEOUT)
+        except Exception:
+            raise OSError(f"Unable to connect to {self._BOARD_TYPE}")
+
+    def close(self) -> None:
+
+        """
+        Close the serial connection
+        """
+
+        if self._arduino is not None:
+            self._arduino.close()
+
+    # ------------ READ LINE METHOD ------------
+
+    def readline(self) -> bytes:
+
+        """
+        Return the next line, or b"" if none arrived before the timeout
+        """
+
+        return self._arduino.readline()
+
+class SimulatedButtonSource:
+
+    """
+    Methods for replaying a scripted sequence of button presses as Arduino lines
+
+    Methods
+    -------
+    open()
+        Start the script clock
+    readline()
+        Return the next line when it is due, or b"" if none is due before the timeout
+    close()
+        Stop replaying the script
+    get_press_log()
+        Return the host times of the replayed presses
+    """
+
+    def __init__(self, script, baudrate = 9600, delivery_delay = 0.0, delivery_jitter = 0.0, sync_period = 1.0, timeout = 0.1):
+
+        self._SCRIPT = list(script) # (delay (s) after the previous press, button name) pairs
+        self._BAUDRATE = baudrate # Used to add the transfer time of every line
+        self._DELIVERY_DELAY = delivery_delay # Constant delay (s) between the edge and the start of the line
+        self._DELIVERY_JITTER = delivery_jitter # Maximum random extra delay (s), removed by the clock synchronization
+        self._SYNC_PERIOD = sync_period # Time (s) between two "sync" lines, like the sketch
+        self._TIMEOUT = timeout
+        self._next_press = 0
+        self._next_press_ns = 0
+        self._next_sync_ns = 0
+        self._sequence_number = 0
+        self._press_log = []
+        self._is_open = False
+
+    # ------------ OPEN AND CLOSE METHODS ------------
+
+    def open(self) -> None:
+
+        """
+        Start the script clock
+        """
+
+        open_ns = time.monotonic_ns()
+        self._next_press = 0
+        self._next_press_ns = open_ns + int(self._SCRIPT[0][0] * 1e9) if self._SCRIPT else None
+        self._next_sync_ns = open_ns
+        self._sequence_number = 0
+        self._press_log = []
+        self._is_open = True
+
+    def close(self) -> None:
+
+        """
+        Stop replaying the script
+        """
+
+        self._is_open = False
+
+    # ------------ READ LINE METHOD ------------
+
+    def readline(self) -> bytes:
+
+        """
+        Return the next line when it is due, or b"" if none is due before the timeout
+        """
+
+        if not self._is_open:
+            return b""
+
+        # The next line is the earliest of the next press and the next sync
+        if self._next_press_ns is not None and self._next_press_ns <= self._next_sync_ns:
+            button, edge_ns = self._SCRIPT[self._next_press][1], self._next_press_ns
+        else:
+            button, edge_ns = "sync", self._next_sync_ns
+
+        line = f"{button},{self._sequence_number},{(edge_ns // 1000) & 0xFFFFFFFF}\r\n".encode() # micros() wraps at 32 bits
+        transfer_ns = len(line) * 10 * 10**9 // self._BAUDRATE
+        due_ns = edge_ns + transfer_ns + int((self._DELIVERY_DELAY + random.uniform(0, self._DELIVERY_JITTER)) * 1e9)
+
+        wait_s = (due_ns - time.monotonic_ns()) / 1e9
+        if wait_s > self._TIMEOUT:
+            time.sleep(self._TIMEOUT)
+            return b""
+        if wait_s > 0:
+            time.sleep(wait_s)
+
+        self._sequence_number += 1
+        if button == "sync":
+            self._next_sync_ns += int(self._SYNC_PERIOD * 1e9)
+        else:
+            self._press_log.append({"button": button,
+                                    "edge_ns": edge_ns, # Host monotonic time of the press
+                                    "edge_time": time.time() - (time.monotonic_ns() - edge_ns) / 1e9}) # Host wall-clock time of the press
+            self._next_press += 1
+            if self._next_press < len(self._SCRIPT):
+                self._next_press_ns = edge_ns + int(self._SCRIPT[self._next_press][0] * 1e9)
+            else:
+                self._next_press_ns = None
+
+        return line
+
+    # ------------ PRESS LOG METHOD ------------
+
+    def get_press_log(self) -> list[dict]:
+
+        """
+        Return the host times of the replayed presses
+        """
+
+        return [dict(press) for press in self._press_log]
@@ -1,11 +1,13 @@
+from background_converter import BackgroundConverter
+from button_source import SerialButtonSource
+from clock_sync import ClockSync
 from file_manager import FileManager
+from jaer_client import JaerClient
+from recording_state import RecordingState, RecordingStateMachine, TimesBuffer
 from safe_io import SafeIO
 
 import glob
 import os
-import serial
-import serial.tools.list_ports
-import socket
 import threading
 import time
 
@@ -18,31 +20,50 @@ class CaptureSystem:
     -------
     capture(recording_mode)
         Record and save event data as .aedat and timestamps in .csv
+    get_live_statistics()
+        Return the live event statistics of the current take, or None without live preview
+    cancel()
+        Stop the capture at the next wait for a button, from any thread
     """
     
-    def __init__(self, arduino_board, output_dir, buffer_time):
+    def __init__(self, arduino_board, output_dir, buffer_time, n_conversion_workers = 0, max_conversion_queue = 8, output_format = "matrix",
+                 jaer_client = None, button_source = None, safe_io = None, live_monitor = None, event_filter = None):
         
-        self._lock = threading.Lock()
-        self._safe_io = SafeIO()
-        self._file_manager = FileManager(output_dir)
+        self._state = RecordingStateMachine() # idle -> armed -> recording -> stopped -> awaiting_continue
+        self._is_cancelled = threading.Event()
+        self._safe_io = safe_io or SafeIO()
+        self._file_manager = FileManager(output_dir, self._safe_io)
+
+        # Background conversion of recorded files (disabled if n_conversion_workers is 0)
+        self._background_converter = None
+        if n_conversion_workers > 0:
+            self._background_converter = BackgroundConverter(output_dir, n_conversion_workers, max_conversion_queue, output_format, event_filter)
 
         # jAER variables
-        self._is_recording = False
-        self._keep_recording = False
-        self._exit_cue = False
-        self._jaer_is_ready = False
-        self._s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self._data = b""
+        self._jaer_client = jaer_client or JaerClient() # localhost:8997, 1 s deadline, 3 retries
+        self._jaer_reply = {"text": "", "file": None} # Last reply of jAER, split by JaerClient.parse_reply
         self._file_name = b"a"
+        self._live_monitor = live_monitor # LiveMonitor of the jAER event stream. Default: None (no live preview)
+        self._live_statistics = None # Live statistics when the take stopped
 
         # Arduino variables
         self._BOARD_TYPE = arduino_board
-        self._is_reading_serial = False
+        self._is_reading_serial = threading.Event()
+        self._last_button_ns = 0 # time.monotonic_ns() of the last button edge
+        self._BAUDRATE = 9600
+        self._button_source = button_source or SerialButtonSource(arduino_board, self._BAUDRATE) # Or a SimulatedButtonSource
+        self._clock_sync = ClockSync()
+        self._last_sequence_number = None
         
         # Other variables
+        self.start_time = 0.0
         self._stop_time = 0.0
-        self._times_list = []
+        self._pedal_start_time = 0.0 # Corrected wall-clock time of the pedal edge that started the take
+        self._pedal_stop_time = 0.0 # Corrected wall-clock time of the pedal edge that stopped the take
+        self._times_list = TimesBuffer()
         self._TIME_PRESS_BUTTON = buffer_time
+        self._MAX_CLOCK_SCALE_ERROR = 1e-3 # Larger event/host duration mismatches are missing events, not clock drift
+        self._MIN_CLOCK_SCALE_DURATION = 30.0 # Shorter takes (s) are not rescaled: a few ms of ack jitter outweighs the drift
         self._OUTPUT_DIR = output_dir
 
     # ------------ MAIN RECORDING METHOD ------------
@@ -110,30 +131,85 @@ class CaptureSystem:
         Main looping function of capture()
         """
 
-        self._set_keep_recording(False)
-        self._set_start_time(self._TIME_PRESS_BUTTON)
-        self._empty_times_list()
+        self.start_time = self._TIME_PRESS_BUTTON
+        self._times_list.clear()
+        self._jaer_client.reset_metrics()
+        self._live_statistics = None
 
         # Record data using jAER
-        self._set_jaer_is_ready(True)
+        self._state.reset()
+        if self._is_cancelled.is_set(): # cancel() was called while the previous take was saved
+            self._state.transition((RecordingState.IDLE,), RecordingState.EXITING)
+        else:
+            self._state.transition((RecordingState.IDLE,), RecordingState.ARMED)
         self._record_with_jaer(paralel_thread)
-        self._set_jaer_is_ready(False)
 
-        aedat_file_dir = self._file_manager.move_aedat_file(self._data, task_name, current_attempt, primitive)
+        aedat_file_dir = self._file_manager.move_aedat_file(self._jaer_reply["file"], task_name, current_attempt, primitive)
+        if self._background_converter is not None:
+            self._background_converter.submit(aedat_file_dir)
 
-        # Get first timestamp of .aedat file
-        first_ts_us = self._file_manager.decode_aedat_file(aedat_file_dir,True)[2]
-        try:
-            first_ts = first_ts_us[0] # in us
-        except IndexError:
+        # Get first and last timestamps of .aedat file
+        aedat_info = self._file_manager.probe_aedat_file(aedat_file_dir)
+        first_ts = aedat_info["first_ts"] # in us
+        if first_ts is None:
             self._close_capture_system(paralel_thread)
             raise IndexError("The .aedat file is empty")
 
+        if self._live_statistics is not None and self._live_statistics["n_events"] == 0:
+            self._safe_io.print_warning("jAER did not stream any event during the take")
+
         csv_file_dir = aedat_file_dir.replace(".aedat","_labels.csv")
-        final_times_list = self._get_times_list()
+        final_times_list, alignment = self._align_times_list(self._times_list.snapshot(), first_ts, aedat_info["last_ts"])
+
+        # Keep the jAER command timing, the label alignment and the state transitions of this take next to its data
+        report = {"jaer_commands": self._jaer_client.get_metrics(), "alignment": alignment, "state_transitions": self._state.get_transitions()}
+        if self._live_statistics is not None:
+            report["live_preview"] = self._live_statistics
+        self._file_manager.write_take_report(report, aedat_file_dir.replace(".aedat","_take.json"))
 
         return [final_times_list,first_ts,csv_file_dir]
 
+    # ------------ ALIGN TIMES LIST METHOD ------------
+
+    def _align_times_list(self, times_list: tuple, first_ts: int, last_ts: int) -> tuple[list, dict]:
+
+        """
+        Move label times from the host clock to the event clock using the jAER acknowledgement times
+        """
+
+        metrics = {metric["command"]: metric for metric in self._jaer_client.get_metrics()}
+        if "startlogging" not in metrics or "stoplogging" not in metrics:
+            return list(times_list), {"is_aligned": False}
+
+        # jAER replies right after it starts or stops logging, so the reply left it half a round trip before the ack
+        logging_start = metrics["startlogging"]["ack_time"] - metrics["startlogging"]["rtt_ms"] / 2e3
+        logging_stop = metrics["stoplogging"]["ack_time"] - metrics["stoplogging"]["rtt_ms"] / 2e3
+        host_duration = logging_stop - logging_start
+        event_duration = (last_ts - first_ts) / 1e6
+
+        clock_scale = event_duration / host_duration if host_duration > 0 else 1.0
+        is_drift = host_duration >= self._MIN_CLOCK_SCALE_DURATION and abs(clock_scale - 1.0) <= self._MAX_CLOCK_SCALE_ERROR
+        if not is_drift:
+            clock_scale = 1.0
+
+        # write_csv_file computes time*10**6 + first_ts, so shift each time to the first event
+        start_time = self.start_time
+        aligned_times_list = [(start_time + time_value - logging_start) * clock_scale for time_value in times_list]
+
+        alignment = {"is_aligned": True,
+                     "logging_start_time": logging_start, # Host wall-clock estimate of the first event (s)
+                     "logging_stop_time": logging_stop, # Host wall-clock estimate of the last event (s)
+                     "start_offset_ms": (logging_start - start_time) * 1e3, # Correction applied to every label
+                     "first_ts": first_ts,
+                     "last_ts": last_ts,
+                     "host_duration_s": host_duration,
+                     "event_duration_s": event_duration,
+                     "duration_mismatch_ms": (event_duration - host_duration) * 1e3,
+                     "clock_scale": clock_scale,
+                     "is_clock_scale_used": is_drift}
+
+        return aligned_times_list, alignment
+
     # ------------ RECORD WITH JAER METHOD ------------
             
     def _record_with_jaer(self, paralel_thread) -> None:
@@ -149,13 +225,16 @@ class CaptureSystem:
             raise
 
         # Start logging        
-        self._add_to_times_list(self._get_start_time()) 
-        self._set_start_time(time.time()+self._TIME_PRESS_BUTTON)
+        self._times_list.append(self.start_time) 
+        self.start_time = self._pedal_start_time+self._TIME_PRESS_BUTTON
         try: 
             self._send_command_to_jaer((b"startlogging " + self._file_name),paralel_thread) 
         except OSError:
             self._close_capture_system(paralel_thread)
             raise     
+        self._print_button_latency("startlogging")
+        if self._live_monitor is not None:
+            self._live_monitor.reset() # Live statistics of this take only
 
         try:
             self._wait_for_button_input("pedal","Press the Pedal to stop recording...", 3000, 10, False, paralel_thread)
@@ -164,13 +243,25 @@ class CaptureSystem:
             raise
 
         # Stop logging
-        self._set_stop_time(time.time())
-        self._add_to_times_list(self._get_stop_time()-self._get_start_time())
+        self._stop_time = self._pedal_stop_time
+        self._times_list.append(self._stop_time-self.start_time)
         try:
             self._send_command_to_jaer(b"stoplogging", paralel_thread)
         except OSError:
             self._close_capture_system(paralel_thread)
             raise 
+        self._print_button_latency("stoplogging")
+        if self._live_monitor is not None:
+            self._live_statistics = self._live_monitor.get_statistics()
+
+    def _print_button_latency(self, command: str) -> None:
+
+        """
+        Print time between the arrival of the last button line and the jAER command reply
+        """
+
+        latency_ms = (time.monotonic_ns() - self._last_button_ns) / 1e6
+        self._safe_io.print_info(f"Button-to-{command} latency: {latency_ms:.2f} ms")
 
     # ------------ START SERIAL THREAD METHOD ------------
         
@@ -180,26 +271,65 @@ class CaptureSystem:
         Connect to arduino and start serial thread
         """
 
-        all_ports = serial.tools.list_ports.comports()
-        com_port = None
-        for port, desc, _ in all_ports:
-            if self._BOARD_TYPE in desc: 
-                com_port = port 
-                self._safe_io.print_success(f"{self._BOARD_TYPE} board was found at {com_port}")
-        if com_port is None:
-            raise OSError(f"Board {self._BOARD_TYPE} was not found")
-
-        # Connect to Arduino
-        try:
-            self.arduino = serial.Serial(port = com_port, baudrate = 9600, timeout = .1)
-        except Exception:
-            self._close_capture_system(paralel_thread)
-            raise OSError(f"Unable to connect to {self._BOARD_TYPE}")
+        # Connect to Arduino. Opening the port resets it, so micros() and the sequence numbers start again
+        self._is_cancelled.clear()
+        self._clock_sync = ClockSync()
+        self._last_sequence_number = None
+        self._button_source.open()
+
+        # Listen to the jAER event stream (the preview is optional, so recording goes on without it)
+        if self._live_monitor is not None:
+            try:
+                self._live_monitor.start(self._print_live_statistics)
+            except OSError as e:
+                self._safe_io.print_warning(f"{e}. Live preview is disabled.")
+                self._live_monitor = None
         
         # Start serial thread
-        self._set_is_reading_serial(True)
+        self._is_reading_serial.set()
         paralel_thread.start()
 
+    # ------------ CANCEL CAPTURE METHOD ------------
+
+    def cancel(self) -> None:
+
+        """
+        Stop the capture at the next wait for a button, from any thread
+        """
+
+        self._is_cancelled.set() # Set first, so a take starting now sees it
+        self._state.transition((RecordingState.IDLE, RecordingState.ARMED, RecordingState.RECORDING, RecordingState.STOPPED,
+                                RecordingState.AWAITING_CONTINUE), RecordingState.EXITING)
+
+    # ------------ LIVE PREVIEW METHODS ------------
+
+    def get_live_statistics(self) -> dict:
+
+        """
+        Return the live event statistics of the current take, or None without live preview
+        """
+
+        if self._live_monitor is None:
+            return None
+
+        return self._live_monitor.get_statistics()
+
+    def _print_live_statistics(self, statistics: dict) -> None:
+
+        """
+        Print the live event rate and polarity balance while recording
+        """
+
+        if self._state.get_state() != RecordingState.RECORDING:
+            return
+
+        if statistics["event_rate"] == 0:
+            self._safe_io.print_warning("No events received from jAER. Check the camera and the jAER AE-over-UDP output.")
+            return
+
+        self._safe_io.print_info(f"Live: {statistics['event_rate']/1e3:.1f} kevents/s, {statistics['on_ratio']*100:.0f}% ON, "
+                                 f"{statistics['lost_packets']} lost packet(s)")
+
     # ------------ READ SERIAL (THREAD) METHOD ------------
         
     def _read_serial(self) -> None:
@@ -208,36 +338,96 @@ class CaptureSystem:
         Get and process button inputs detected by the Arduino
         """
         
-        while self._get_is_reading_serial():
-            time.sleep(0.01)
-            value = self.arduino.readline()
-
-            if value == b'pedal_high\r\n' and self._get_jaer_is_ready():
-                # If pressed, start or stop recording
-                if not self._get_is_recording():
-                    self._set_is_recording(True)
+        while self._is_reading_serial.is_set():
+            value = self._button_source.readline() # Blocks until a line arrives or the serial timeout ends
+            if not value:
+                continue
+
+            # Timestamp the line as soon as it arrives
+            arrival_ns = time.monotonic_ns()
+            current_time = time.time()
+
+            button, sequence_number, device_us = self._parse_serial_line(value)
+            if device_us is not None:
+                # Move the time back from the host arrival to the edge detected by the Arduino
+                edge_ns = min(self._get_edge_ns(value, button, sequence_number, device_us, arrival_ns), arrival_ns)
+                current_time -= (arrival_ns - edge_ns) / 1e9
+            else: # Plain line from an older sketch
+                edge_ns = arrival_ns
+
+            if button == "sync":
+                continue
+            self._last_button_ns = edge_ns
+
+            if button == "pedal_high":
+                # If pressed, start or stop recording at the time of the edge, not when capture() wakes up
+                state = self._state.get_state()
+                if state == RecordingState.ARMED:
+                    self._pedal_start_time = current_time
+                elif state == RecordingState.RECORDING:
+                    self._pedal_stop_time = current_time
+                if self._state.transition((RecordingState.ARMED,), RecordingState.RECORDING):
                     self._safe_io.print_info("Started recording")
-                else:
-                    self._set_is_recording(False)
-                    self._set_exit_cue(False)
+                elif self._state.transition((RecordingState.RECORDING,), RecordingState.STOPPED):
                     self._safe_io.print_info("Stopped recording")
 
-            elif value == b'white\r\n':
-                # If pressed, register time to times_list
-                if self._get_is_recording() is True:
-                    current_time = time.time()        
-                    self._add_to_times_list(current_time - self._get_start_time())
-                    self._add_to_times_list(current_time - self._get_start_time() + 2*self._TIME_PRESS_BUTTON)
+            elif button == "white":
+                # If pressed, register time to times_list, or quit after a take
+                if self._state.get_state() == RecordingState.RECORDING:
+                    self._times_list.append(current_time - self.start_time)
+                    self._times_list.append(current_time - self.start_time + 2*self._TIME_PRESS_BUTTON)
                     self._safe_io.print_info("Time was registered")
                 else:
-                    self._set_exit_cue(True)
+                    self._state.transition((RecordingState.STOPPED, RecordingState.AWAITING_CONTINUE), RecordingState.EXITING)
 
-            elif value == b'red\r\n':
+            elif button == "red":
                 #If pressed, keep recording
-                if not self._get_is_recording():
-                    self._set_keep_recording(True)
+                if self._state.transition((RecordingState.STOPPED, RecordingState.AWAITING_CONTINUE), RecordingState.IDLE):
                     self._safe_io.print_success("Ready for next recording.")
 
+    # ------------ PARSE SERIAL LINE METHODS ------------
+
+    def _parse_serial_line(self, value: bytes) -> tuple:
+
+        """
+        Split "<button>,<sequence number>,<micros>" lines, or plain "<button>" lines, into their fields
+        """
+
+        fields = value.decode(errors = "ignore").strip().split(",")
+        if len(fields) == 3:
+            try:
+                return fields[0], int(fields[1]), int(fields[2])
+            except ValueError:
+                pass
+
+        return fields[0], None, None
+
+    def _get_edge_ns(self, value: bytes, button: str, sequence_number: int, device_us: int, arrival_ns: int) -> int:
+
+        """
+        Update the clock synchronization with a timestamped line and return its edge time in host monotonic ns
+        """
+
+        if self._last_sequence_number is not None and sequence_number <= self._last_sequence_number: # The Arduino restarted
+            self._safe_io.print_warning(f"The {self._BOARD_TYPE} restarted. Synchronizing the clocks again.")
+            self._clock_sync = ClockSync()
+        elif self._last_sequence_number is not None and sequence_number != self._last_sequence_number + 1:
+            self._safe_io.print_warning(f"Lost {sequence_number - self._last_sequence_number - 1} message(s) from the {self._BOARD_TYPE}")
+        self._last_sequence_number = sequence_number
+
+        # Only sync lines carry the micros() of the moment they are sent. Button lines carry the start of the
+        # debouncing, about 10 ms earlier, so pairing them with their arrival would bias the drift fit
+        if button == "sync":
+            # The last byte arrives after the whole line was sent (10 bits per byte)
+            transfer_ns = len(value) * 10 * 10**9 // self._BAUDRATE
+            device_us = self._clock_sync.add_sample(device_us, arrival_ns - transfer_ns)
+        elif self._clock_sync.is_synchronized():
+            device_us = self._clock_sync.unwrap(device_us)
+        else: # No sync line yet since the port was opened
+            return arrival_ns
+
+        return self._clock_sync.to_host_ns(device_us)
+
     # ------------ WAIT FOR BUTTON INPUT METHOD ------------
                     
     def _wait_for_button_input(self, button:str, text: str, n_cycles: int, max_wait: int, condition: bool, paralel_thread) -> None:   
@@ -246,40 +436,33 @@ class CaptureSystem:
         Wait for specific button input until max_wait
         """
         
-        counter = 0
-        counter_wait = 0
-
-        if button == "pedal":
-            while self._get_is_recording() is not condition:
-                
-                time.sleep(0.01) # n_cycles = 100 -> approx. 1 second
-                if counter > n_cycles:
-                    counter = 0
-                    self._safe_io.print_warning(text) # Warn that capture() is waiting for button prompt
-                    counter_wait += 1
-                elif counter_wait == max_wait: # Timeout condition
-                    self._close_capture_system(paralel_thread)
-                    raise RuntimeError(f"No input detected. Function timed out.")
-                else:
-                    counter += 1
-
+        if button == "pedal" and condition:
+            target_states = (RecordingState.RECORDING, RecordingState.STOPPED, RecordingState.EXITING)
+        elif button == "pedal":
+            target_states = (RecordingState.STOPPED, RecordingState.EXITING)
         elif button == "red":
-            while self._get_keep_recording() is not condition:
-                
-                if self._get_exit_cue():
-                    self._close_capture_system(paralel_thread)
-                    raise OSError(f"Exit program.")
-                
-                time.sleep(0.01) # n_cycles = 100 -> approx. 1 second
-                if counter > n_cycles:
-                    counter = 0
-                    self._safe_io.print_warning(text) # Warn that capture() is waiting for button prompt
-                    counter_wait += 1
-                elif counter_wait == max_wait: # Timeout condition
-                    self._close_capture_system(paralel_thread)
-                    raise RuntimeError(f"No input detected. Function timed out.")
-                else:
-                    counter += 1
+            self._state.transition((RecordingState.STOPPED,), RecordingState.AWAITING_CONTINUE)
+            target_states = (RecordingState.IDLE, RecordingState.EXITING)
+        else:
+            return
+
+        counter_wait = 0
+        # Sleep until the serial thread changes the state, waking every n_cycles*10 ms to warn
+        while not self._state.wait_for_state(target_states, timeout = n_cycles * 0.01):
+            if counter_wait == max_wait: # Timeout condition
+                self._close_capture_system(paralel_thread)
+                raise RuntimeError(f"No input detected. Function timed out.")
+            self._safe_io.print_warning(text) # Warn that capture() is waiting for button prompt
+            counter_wait += 1
+
+        if self._state.get_state() == RecordingState.EXITING:
+            if button == "pedal" and not condition: # Cancelled while jAER is logging
+                try:
+                    self._jaer_client.send_command(b"stoplogging")
+                except OSError:
+                    pass
+            self._close_capture_system(paralel_thread)
+            raise OSError(f"Exit program." if button == "red" else "Capture was cancelled.")
 
     # ------------ SEND COMMAND TO JAER METHOD ------------
         
@@ -289,12 +472,16 @@ class CaptureSystem:
         Send given command to jAER
         """
         
-        self._s.sendto(command, ("localhost", 8997)) 
         try:
-            self._data = self._s.recvfrom(3000)
-        except Exception:
+            self._jaer_reply = self._jaer_client.parse_reply(self._jaer_client.send_command(command)[0])
+        except Exception as e:
             self._close_capture_system(paralel_thread)
-            raise OSError(f"Unable to connect to jAER") 
+            raise OSError(f"Unable to connect to jAER: {e}")
+
+        # jAER names the .aedat file it logs to in the replies to startlogging and stoplogging
+        if self._jaer_reply["file"] is None:
+            self._close_capture_system(paralel_thread)
+            raise OSError(f"Unexpected reply from jAER to {command.decode(errors = 'ignore')}: {self._jaer_reply['text']}") 
 
     # ------------ CLOSE CAPTURE SYSTEM METHOD ------------
     
@@ -304,85 +491,12 @@ class CaptureSystem:
         Terminate thread and serial connection
         """
     
-        self._set_is_reading_serial(False)
-        paralel_thread.join()
-        self.arduino.close()
-
-    # ------------ SETTER AND GETTER METHODS ------------
-
-    # - Set and get for variable is_recording -
-    def _set_is_recording(self, val: bool) -> None:
-        with self._lock:
-            self._is_recording = val
-
-    def _get_is_recording(self) -> bool:
-        with self._lock:
-            return self._is_recording is True
-    
-    # - Set and get for variable exit_cue -
-    def _set_exit_cue(self, val: bool) -> None:
-        with self._lock:
-            self._exit_cue = val
-
-    def _get_exit_cue(self) -> bool:
-        with self._lock:
-            return self._exit_cue is True
-
-    # - Set and get for variable exit_cue -
-    def _set_jaer_is_ready(self, val: bool) -> None:
-        with self._lock:
-            self._jaer_is_ready = val
-
-    def _get_jaer_is_ready(self) -> bool:
-        with self._lock:
-            return self._jaer_is_ready is True
-
-    # - Set and get for variable keep_recording -
-    def _set_keep_recording(self, val: bool) -> None:
-        with self._lock:
-            self._keep_recording = val
-
-    def _get_keep_recording(self) -> bool:
-        with self._lock:
-            return self._keep_recording is True
-
-    # - Set and get for variable is_reading_serial -
-    def _set_is_reading_serial(self, val: bool) -> None:
-        with self._lock:
-            self._is_reading_serial = val
-
-    def _get_is_reading_serial(self) -> bool:
-        with self._lock:
-            return self._is_reading_serial is True
-
-    # - Set and get for variable start_time -
-    def _set_start_time(self, val: float) -> None:
-        with self._lock:
-            self.start_time = val
-
-    def _get_start_time(self) -> float:
-        with self._lock:
-            return self.start_time
-
-    # - Set and get for variable stop_time -
-    def _set_stop_time(self, val: float) -> None:
-        with self._lock:
-            self._stop_time = val
-
-    def _get_stop_time(self) -> float:
-        with self._lock:
-            return self._stop_time
-
-    # - Methods for variable times_list -
-    
-    def _empty_times_list(self) -> None:
-        with self._lock:
-            self._times_list = []
-    
-    def _add_to_times_list(self, val: float) -> None:
-        with self._lock:
-            self._times_list.append(val)
-
-    def _get_times_list(self) -> list:
-        with self._lock:
-            return self._times_list
\ No newline at end of file
+        self._is_reading_serial.clear()
+        if paralel_thread.is_alive():
+            paralel_thread.join()
+        self._button_source.close()
+        if self._live_monitor is not None:
+            self._live_monitor.stop()
+
+        if self._background_converter is not None:
+            self._background_converter.drain()
@@ -0,0 +1,114 @@
+from collections import deque
+
+import numpy as np
+
+class ClockSync:
+
+    """
+    Methods for mapping Arduino micros() timestamps to the host monotonic clock
+
+    Methods
+    -------
+    add_sample(device_us, host_ns)
+        Register the host arrival time of a timestamped line and return the unwrapped device time
+    unwrap(device_us)
+        Return the unwrapped device time closest to the last sample, without registering it
+    is_synchronized()
+        Return whether there is at least one sample to convert times with
+    to_host_ns(device_us)
+        Convert an unwrapped device time into host monotonic time (ns)
+    """
+
+    def __init__(self, max_samples = 64, min_drift_span_us = 10_000_000):
+
+        self._samples = deque(maxlen = max_samples) # (unwrapped device time in us, host time in ns)
+        self._MIN_DRIFT_SPAN_US = min_drift_span_us # Samples must cover this time span before estimating drift
+        self._WRAP_US = 1 << 32 # micros() overflows every ~71.6 minutes
+        self._last_device_us = None
+        self._n_wraps = 0
+        self._drift = 1.0 # Host ns per device ns
+        self._offset_ns = None
+
+    # ------------ ADD SAMPLE METHOD ------------
+
+    def add_sample(self, device_us:int, host_ns:int) -> int:
+
+        """
+        Register the host arrival time of a timestamped line and return the unwrapped device time
+        """
+
+        device_us = self._unwrap(device_us)
+        self._samples.append((device_us, host_ns))
+        self._update_estimate()
+
+        return device_us
+
+    # ------------ CONVERT TIME METHODS ------------
+
+    def unwrap(self, device_us:int) -> int:
+
+        """
+        Return the unwrapped device time closest to the last sample, without registering it
+        """
+
+        if self._last_device_us is None:
+            return device_us
+
+        # Times taken before the last sample, or after an overflow the samples did not see yet, may be a wrap away
+        last_device_us = self._last_device_us + self._n_wraps * self._WRAP_US
+        device_us += self._n_wraps * self._WRAP_US
+        if device_us - last_device_us > self._WRAP_US // 2:
+            device_us -= self._WRAP_US
+        elif last_device_us - device_us > self._WRAP_US // 2:
+            device_us += self._WRAP_US
+
+        return device_us
+
+    def is_synchronized(self) -> bool:
+
+        """
+        Return whether there is at least one sample to convert times with
+        """
+
+        return self._offset_ns is not None
+
+    def to_host_ns(self, device_us:int) -> int:
+
+        """
+        Convert an unwrapped device time into host monotonic time (ns)
+        """
+
+        if self._offset_ns is None:
+            raise ValueError("No samples to synchronize the clocks")
+
+        return int(self._offset_ns + self._drift * device_us * 1000)
+
+    # ------------ ESTIMATION METHODS ------------
+
+    def _unwrap(self, device_us:int) -> int:
+
+        """
+        Add the overflows of micros() seen so far to a device time
+        """
+
+        if self._last_device_us is not None and device_us < self._last_device_us - self._WRAP_US // 2:
+            self._n_wraps += 1
+        self._last_device_us = device_us
+
+        return device_us + self._n_wraps * self._WRAP_US
+
+    def _update_estimate(self) -> None:
+
+        """
+        Fit drift with least squares and offset as the lower envelope of host - device times
+        """
+
+        samples = np.array(self._samples, dtype = np.float64)
+        device_ns = samples[:,0] * 1000
+        host_ns = samples[:,1]
+
+        if device_ns[-1] - device_ns[0] >= self._MIN_DRIFT_SPAN_US * 1000:
+            self._drift = np.polyfit(device_ns - device_ns[0], host_ns - host_ns[0], 1)[0]
+
+        # Arrival delays are always positive, so the line through the earliest arrival is the best estimate
+        self._offset_ns = np.min(host_ns - self._drift * device_ns)
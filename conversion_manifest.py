@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import threading
+
+# ------------ FAST CONTENT HASH ------------
+
+def fast_file_hash(file_dir:str, block_size:int = 1 << 20) -> str:
+
+    """
+    Hash the size and the first, middle and last blocks of a file
+    """
+
+    file_size = os.stat(file_dir).st_size
+    file_hash = hashlib.blake2b(str(file_size).encode(), digest_size = 16)
+
+    with open(file_dir, "rb") as file:
+        for position in sorted({0, max(file_size//2 - block_size//2, 0), max(file_size - block_size, 0)}):
+            file.seek(position)
+            file_hash.update(file.read(block_size))
+
+    return file_hash.hexdigest()
+
+_SAVE_LOCK = threading.Lock() # Converter threads of one process save their manifests one at a time
+
+class ConversionManifest:
+
+    """
+    Methods for recording which .aedat files were converted and how
+
+    Methods
+    -------
+    get_entry(file_name_with_ext)
+        Return the manifest entry of .aedat file, or None if it was never recorded
+    set_entry(file_name_with_ext, entry)
+        Record the manifest entry of .aedat file
+    save()
+        Write the entries set since loading to the manifest .json file
+    """
+
+    def __init__(self, output_dir):
+
+        self._OUTPUT_DIR = output_dir
+        self._MANIFEST_DIR = os.path.join(output_dir, "conversion_manifest.json")
+
+        self._entries = self._load()
+        self._changed_keys = set()
+
+    def _load(self) -> dict:
+
+        """
+        Read the manifest .json file, or start an empty one
+        """
+
+        if not os.path.exists(self._MANIFEST_DIR):
+            return {}
+        try:
+            with open(self._MANIFEST_DIR, "r") as manifest_file:
+                return json.load(manifest_file)
+        except ValueError:
+            return {} # Corrupted manifest: every file is checked again
+
+    # ------------ ENTRY METHODS ------------
+
+    def get_entry(self, file_name_with_ext:str) -> dict:
+
+        """
+        Return the manifest entry of .aedat file, or None if it was never recorded
+        """
+
+        return self._entries.get(self._get_key(file_name_with_ext))
+
+    def set_entry(self, file_name_with_ext:str, entry:dict) -> None:
+
+        """
+        Record the manifest entry of .aedat file
+        """
+
+        key = self._get_key(file_name_with_ext)
+        self._entries[key] = entry
+        self._changed_keys.add(key)
+
+    def _get_key(self, file_name_with_ext:str) -> str:
+
+        """
+        Key files by their path relative to the output folder, so the dataset can be moved
+        """
+
+        return os.path.relpath(file_name_with_ext, self._OUTPUT_DIR).replace(os.sep, "/")
+
+    # ------------ SAVE MANIFEST METHOD ------------
+
+    def save(self) -> None:
+
+        """
+        Write the entries set since loading to the manifest .json file
+        """
+
+        if not self._changed_keys:
+            return
+
+        # Other converters may have saved since this manifest was loaded, so only its own entries are written over theirs
+        tmp_file_dir = f"{self._MANIFEST_DIR}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with _SAVE_LOCK:
+            entries = self._load()
+            entries.update({key: self._entries[key] for key in self._changed_keys})
+            try:
+                with open(tmp_file_dir, "w") as manifest_file:
+                    json.dump(entries, manifest_file, indent = 1, sort_keys = True)
+                os.replace(tmp_file_dir, self._MANIFEST_DIR)
+            except Exception:
+                if os.path.exists(tmp_file_dir):
+                    os.remove(tmp_file_dir)
+                raise OSError(f"Unable to save data to {self._MANIFEST_DIR}")
+            self._entries = entries
+            self._changed_keys = set()
@@ -0,0 +1,287 @@
+from file_manager import FileManager
+from safe_io import SafeIO
+
+import glob
+import numpy as np
+import os
+import time
+
+class DatasetPacker:
+
+    """
+    Methods for packing the _events.npy and _labels.csv files of many takes into a few shard files
+
+    Methods
+    -------
+    pack(list_all_files)
+        Append new or changed takes to the shards and update the pack index
+    get_takes()
+        Return the names of the packed takes
+    get_unaligned_takes()
+        Return the names of the packed takes whose labels could not be aligned to their events
+    get_segments()
+        Return the take,label,start,end rows of every packed label
+    read_take(take_name)
+        Read the events of one packed take as x,y,ts,pol
+    read_segment(segment)
+        Read the events of one row of get_segments() as x,y,ts,pol
+    summary_to_text(summary)
+        Format the summary of a packing run as text
+    """
+
+    def __init__(self, output_dir, pack_dir = None, shard_size_mb = 1024):
+
+        self._safe_io = SafeIO()
+        self._file_manager = FileManager(output_dir)
+        self._OUTPUT_DIR = output_dir
+        self._PACK_DIR = pack_dir or os.path.join(output_dir, "packed")
+        self._INDEX_DIR = os.path.join(self._PACK_DIR, "pack_index.npz")
+        self._EVENT_DTYPE = self._file_manager._EVENT_DTYPE # Same records as structured _events.npy files
+        self._SHARD_EVENTS = max(int(shard_size_mb * 1e6) // self._EVENT_DTYPE.itemsize, 1) # A take never spans two shards
+        self._CHUNK_EVENTS = 1 << 20 # Events copied at once
+        self._TAKE_COLUMNS = 6 # shard, offset, n_events, events size, events mtime_ns, labels mtime_ns
+        self._index = self._load_index()
+
+    # ------------ PACK METHOD ------------
+
+    def pack(self, list_all_files:list[str] = None) -> dict:
+
+        """
+        Append new or changed takes to the shards and update the pack index
+
+        list_all_files holds _events.npy files. Default: every _events.npy file under the output folder
+        """
+
+        if list_all_files is None:
+            list_all_files = sorted(glob.glob(os.path.join(self._OUTPUT_DIR, "**", "*_events.npy"), recursive = True))
+
+        os.makedirs(self._PACK_DIR, exist_ok = True)
+        summary = {"n_packed": 0, "n_replaced": 0, "n_skipped": 0, "n_unaligned": 0, "n_events": 0, "errors": {}}
+        start_time = time.perf_counter()
+
+        names = list(self._index["names"])
+        take_rows = {name: i for i, name in enumerate(names)}
+        for npy_file_dir in list_all_files:
+            file_name_no_ext = npy_file_dir[:len(npy_file_dir)-11] # Remove _events.npy from file name
+            name = os.path.relpath(file_name_no_ext, self._OUTPUT_DIR).replace(os.sep, "/")
+            file_stats = self._get_file_stats(file_name_no_ext)
+
+            row = take_rows.get(name)
+            if row is not None and np.array_equal(self._index["takes"][row, 3:], file_stats) and \
+               (self._index["is_aligned"][row] or self._file_manager._get_first_raw_ts(file_name_no_ext) is None): # Until the origin shows up
+                summary["n_skipped"] += 1
+                continue
+
+            try:
+                take, label_ranges, is_aligned = self._append_take(file_name_no_ext, file_stats)
+            except Exception as e:
+                summary["errors"][npy_file_dir] = f"{type(e).__name__}: {e}"
+                self._safe_io.print_error(f"Unable to pack {npy_file_dir}: {e}")
+                continue
+
+            if not is_aligned:
+                self._safe_io.print_warning(f"First timestamp of {npy_file_dir} not found. Its events are packed without label segments.")
+                summary["n_unaligned"] += 1
+
+            if row is None: # New take
+                row = len(names)
+                names.append(name)
+                take_rows[name] = row
+                self._index["takes"] = np.vstack((self._index["takes"], take))
+                self._index["is_aligned"] = np.append(self._index["is_aligned"], is_aligned)
+                summary["n_packed"] += 1
+            else: # Changed take: the old events stay in their shard, but nothing points to them anymore
+                self._index["takes"][row] = take
+                self._index["is_aligned"][row] = is_aligned
+                self._index["labels"] = self._index["labels"][self._index["labels"][:,0] != row]
+                summary["n_replaced"] += 1
+            self._index["names"] = np.array(names, dtype = str)
+            self._index["labels"] = np.vstack((self._index["labels"],
+                                               np.column_stack((np.full(len(label_ranges), row, dtype = np.int64), label_ranges))))
+            summary["n_events"] += int(take[2])
+
+            self._save_index() # After every take, so an interrupted run keeps what it packed
+
+        summary["n_shards"] = len(self._index["shard_events"])
+        summary["elapsed"] = time.perf_counter() - start_time
+
+        return summary
+
+    def _append_take(self, file_name_no_ext:str, file_stats:np.ndarray) -> tuple[np.ndarray,np.ndarray,bool]:
+
+        """
+        Copy the events of one take to the end of the current shard and return its take row, label ranges and
+        whether its labels are aligned (False if the first raw timestamp is unknown, then there are no label ranges)
+        """
+
+        x,y,ts,pol = self._file_manager.read_npy_file(file_name_no_ext, True)
+        n_events = len(ts)
+        label_ranges, first_ts = self._file_manager._get_label_ranges(file_name_no_ext, ts)
+
+        shard_events = self._index["shard_events"]
+        if len(shard_events) == 0 or (shard_events[-1] > 0 and shard_events[-1] + n_events > self._SHARD_EVENTS):
+            shard_events = np.append(shard_events, 0) # Start a new shard
+        shard = len(shard_events) - 1
+        offset = int(shard_events[-1])
+
+        shard_file_dir = self._get_shard_file_dir(shard)
+        with open(shard_file_dir, "r+b" if os.path.exists(shard_file_dir) else "wb") as shard_file:
+            shard_file.truncate(offset * self._EVENT_DTYPE.itemsize) # Drop events of an interrupted run that were never indexed
+            shard_file.seek(offset * self._EVENT_DTYPE.itemsize)
+            for start in range(0, n_events, self._CHUNK_EVENTS):
+                end = min(start + self._CHUNK_EVENTS, n_events)
+                events = np.empty(end - start, dtype = self._EVENT_DTYPE)
+                events["x"], events["y"], events["ts"], events["p"] = x[start:end], y[start:end], ts[start:end], pol[start:end]
+                shard_file.write(events.tobytes())
+
+        shard_events[-1] = offset + n_events
+        self._index["shard_events"] = shard_events
+
+        return np.concatenate(([shard, offset, n_events], file_stats)).astype(np.int64), label_ranges, first_ts is not None
+
+    def _get_file_stats(self, file_name_no_ext:str) -> np.ndarray:
+
+        """
+        Return the size and mtime_ns of the _events.npy file and the mtime_ns of the _labels.csv file (-1 if there is none)
+        """
+
+        npy_stat = os.stat(f"{file_name_no_ext}_events.npy")
+        csv_file_dir = f"{file_name_no_ext}_labels.csv"
+        csv_mtime_ns = os.stat(csv_file_dir).st_mtime_ns if os.path.exists(csv_file_dir) else -1
+
+        return np.array([npy_stat.st_size, npy_stat.st_mtime_ns, csv_mtime_ns], dtype = np.int64)
+
+    # ------------ INDEX METHODS ------------
+
+    def _load_index(self) -> dict:
+
+        """
+        Load the pack index, or start an empty one
+        """
+
+        if not os.path.exists(self._INDEX_DIR):
+            return {"names": np.zeros(0, dtype = str),
+                    "takes": np.zeros((0, self._TAKE_COLUMNS), dtype = np.int64),
+                    "labels": np.zeros((0, 4), dtype = np.int64), # take, label, start, end (events from the start of the take)
+                    "shard_events": np.zeros(0, dtype = np.int64), # Indexed events of every shard
+                    "is_aligned": np.zeros(0, dtype = bool)} # False for takes packed without label segments
+
+        with np.load(self._INDEX_DIR) as index_file:
+            index = {key: index_file[key] for key in index_file.files}
+        if "is_aligned" not in index: # Packed before unaligned takes were kept
+            index["is_aligned"] = np.ones(len(index["names"]), dtype = bool)
+
+        return index
+
+    def _save_index(self) -> None:
+
+        """
+        Write the pack index through a temporary file that is renamed
+        """
+
+        self._file_manager._save_atomically(self._INDEX_DIR, lambda index_file: np.savez(index_file, **self._index))
+
+    def _get_shard_file_dir(self, shard:int) -> str:
+
+        """
+        Return the file of one shard
+        """
+
+        return os.path.join(self._PACK_DIR, f"shard_{shard:05d}.bin")
+
+    # ------------ READ METHODS ------------
+
+    def get_takes(self) -> list[str]:
+
+        """
+        Return the names of the packed takes
+        """
+
+        return self._index["names"].tolist()
+
+    def get_unaligned_takes(self) -> list[str]:
+
+        """
+        Return the names of the packed takes whose labels could not be aligned to their events
+        """
+
+        return self._index["names"][~self._index["is_aligned"]].tolist()
+
+    def get_segments(self) -> np.ndarray:
+
+        """
+        Return the take,label,start,end rows of every packed label
+
+        take is a position in get_takes() and start,end count events from the start of the take
+        """
+
+        return self._index["labels"]
+
+    def read_take(self, take_name:str) -> list[np.ndarray]:
+
+        """
+        Read the events of one packed take as x,y,ts,pol
+        """
+
+        rows = np.flatnonzero(self._index["names"] == take_name)
+        if len(rows) == 0:
+            raise OSError(f"Take {take_name} is not packed.")
+        shard, offset, n_events = self._index["takes"][rows[0], :3]
+
+        return self._read_events(int(shard), int(offset), int(n_events))
+
+    def read_segment(self, segment:int) -> list[np.ndarray]:
+
+        """
+        Read the events of one row of get_segments() as x,y,ts,pol
+        """
+
+        if not -len(self._index["labels"]) <= segment < len(self._index["labels"]):
+            raise IndexError(f"Segment {segment} out of range for {len(self._index['labels'])} segment(s)")
+
+        take, _, start, end = self._index["labels"][segment]
+        shard, offset = self._index["takes"][take, :2]
+
+        return self._read_events(int(shard), int(offset + start), int(end - start))
+
+    def _read_events(self, shard:int, offset:int, n_events:int) -> list[np.ndarray]:
+
+        """
+        Read n_events events of one shard with a single seek
+        """
+
+        with open(self._get_shard_file_dir(shard), "rb") as shard_file:
+            shard_file.seek(offset * self._EVENT_DTYPE.itemsize)
+            events = np.fromfile(shard_file, dtype = self._EVENT_DTYPE, count = n_events)
+
+        return events["x"], events["y"], events["ts"], events["p"]
+
+    # ------------ SUMMARY METHOD ------------
+
+    def summary_to_text(self, summary:dict) -> str:
+
+        """
+        Format the summary of a packing run as text
+        """
+
+        text = (f"Packed {summary['n_packed']} new and {summary['n_replaced']} changed take(s) ({summary['n_events']} events) "
+                f"into {summary['n_shards']} shard(s) in {summary['elapsed']:.2f} s, {summary['n_skipped']} take(s) were already packed\n")
+        if summary["n_unaligned"]:
+            text += f"{summary['n_unaligned']} take(s) were packed without label segments, their first timestamp is unknown\n"
+        for file, error in summary["errors"].items():
+            text += f"Failed {file}: {error}\n"
+
+        return text
+
+# ------------ PACK DATASET ------------
+
+if __name__ == "__main__":
+
+    OUTPUT_DIR = "test_data"
+    SHARD_SIZE_MB = 1024 # Shards are closed once the next take would pass this size
+
+    safe_io = SafeIO()
+    packer = DatasetPacker(OUTPUT_DIR, shard_size_mb = SHARD_SIZE_MB)
+    summary = packer.pack()
+    safe_io.print_info(packer.summary_to_text(summary))
+    safe_io.print_success(f"{len(packer.get_takes())} take(s) and {len(packer.get_segments())} labeled segment(s) are packed")
@@ -0,0 +1,341 @@
+import json
+import lzma
+import numpy as np
+import os
+import struct
+import zlib
+
+try:
+    import lz4.frame # Only needed for the lz4 codec
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard # Only needed for the zstd codec
+except ImportError:
+    zstandard = None
+
+_MAGIC = b"EVZ1"
+_FOOTER = "<QQI" # Index position, number of chunks, metadata length. Followed by the magic bytes
+_CODECS = ("none", "zlib", "lzma", "lz4", "zstd")
+_CHUNK_DTYPE = np.dtype([("offset","<u8"),("length","<u4"),("n_events","<u4"),("t0","<i8"),("t1","<i8"), # t1: last ts of the chunk
+                         ("ts_width","u1"),("x_width","u1"),("y_width","u1")])
+
+class CompressedEventWriter:
+
+    """
+    Methods for writing events to a chunked, compressed _events.evz file
+
+    Every chunk stores zigzag-encoded ts deltas, x and y in the fewest bytes that fit the chunk and
+    polarities packed 8 per byte, compressed as one block. The chunk index at the end of the file
+    holds the time range of every chunk
+
+    Methods
+    -------
+    append(x, y, ts, pol)
+        Add events in time order, writing every full chunk
+    close()
+        Write the last chunk and the chunk index, then move the file into place
+    abort()
+        Remove the unfinished file
+    """
+
+    def __init__(self, evz_file_dir, codec = "zlib", level = None, chunk_events = 1 << 16):
+
+        if codec not in _CODECS:
+            raise ValueError(f"Unknown codec {codec}. Choose one of {_CODECS}")
+        if codec == "lz4" and lz4 is None:
+            raise OSError("The lz4 codec needs the lz4 package (pip install lz4)")
+        if codec == "zstd" and zstandard is None:
+            raise OSError("The zstd codec needs the zstandard package (pip install zstandard)")
+        if chunk_events < 1:
+            raise ValueError("The chunk size must be at least 1 event")
+
+        self._EVZ_FILE_DIR = evz_file_dir
+        self._TMP_FILE_DIR = f"{evz_file_dir}.tmp" # Renamed to evz_file_dir once the index is written
+        self._CODEC = codec
+        self._LEVEL = level # Codec default if None
+        self._CHUNK_EVENTS = chunk_events # Smallest unit a reader decodes
+        self._pending = [] # Appended columns that do not fill a chunk yet
+        self._n_pending = 0
+        self._chunks = []
+        self._n_events = 0
+        self._last_ts = None
+        self._file = open(self._TMP_FILE_DIR, "wb")
+        self._file.write(_MAGIC)
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    # ------------ APPEND METHOD ------------
+
+    def append(self, x:np.ndarray, y:np.ndarray, ts:np.ndarray, pol:np.ndarray) -> None:
+
+        """
+        Add events in time order, writing every full chunk
+        """
+
+        if len(ts) == 0:
+            return
+
+        self._pending.append((np.asarray(x), np.asarray(y), np.asarray(ts, dtype = np.int64), np.asarray(pol)))
+        self._n_pending += len(ts)
+        if self._n_pending < self._CHUNK_EVENTS:
+            return
+
+        x,y,ts,pol = [np.concatenate(column) for column in zip(*self._pending)]
+        n_full = (len(ts) // self._CHUNK_EVENTS) * self._CHUNK_EVENTS
+        for start in range(0, n_full, self._CHUNK_EVENTS):
+            end = start + self._CHUNK_EVENTS
+            self._write_chunk(x[start:end], y[start:end], ts[start:end], pol[start:end])
+        self._pending = [(x[n_full:], y[n_full:], ts[n_full:], pol[n_full:])] if n_full < len(ts) else []
+        self._n_pending = len(ts) - n_full
+
+    def _write_chunk(self, x:np.ndarray, y:np.ndarray, ts:np.ndarray, pol:np.ndarray) -> None:
+
+        """
+        Encode, compress and write one chunk and add it to the chunk index
+        """
+
+        # Sorted ts gives small non-negative deltas. Zigzag keeps the rare negative step small as well
+        # Columns stay byte-aligned instead of bit-packed: x,y of 240x180 sensors already fit 1 byte, and for wider
+        # sensors the compressor shrinks aligned 2-byte columns as well as 9-bit packed ones
+        deltas = np.diff(ts, prepend = ts[:1])
+        zigzag = ((deltas << 1) ^ (deltas >> 63)).astype(np.uint64)
+        ts_width = self._get_width(int(zigzag.max()))
+        x_width = self._get_width(int(x.max()))
+        y_width = self._get_width(int(y.max()))
+        if x.min() < 0 or y.min() < 0 or max(x_width, y_width) > 2:
+            raise ValueError("Event coordinates must be between 0 and 65535")
+
+        payload = b"".join((zigzag.astype(f"<u{ts_width}").tobytes(), x.astype(f"<u{x_width}").tobytes(),
+                            y.astype(f"<u{y_width}").tobytes(), np.packbits(pol.astype(bool)).tobytes()))
+        block = _compress(self._CODEC, payload, self._LEVEL)
+
+        self._chunks.append((self._file.tell(), len(block), len(ts), int(ts[0]), int(ts[-1]), ts_width, x_width, y_width))
+        self._file.write(block)
+        self._n_events += len(ts)
+        self._last_ts = int(ts[-1])
+
+    def _get_width(self, max_value:int) -> int:
+
+        """
+        Return the number of bytes (1, 2, 4 or 8) that holds every value up to max_value
+        """
+
+        return next(width for width in (1, 2, 4, 8) if max_value < 1 << (8 * width))
+
+    # ------------ CLOSE METHODS ------------
+
+    def close(self) -> None:
+
+        """
+        Write the last chunk and the chunk index, then move the file into place
+        """
+
+        if self._n_pending:
+            x,y,ts,pol = [np.concatenate(column) for column in zip(*self._pending)]
+            self._write_chunk(x, y, ts, pol)
+            self._pending, self._n_pending = [], 0
+
+        index_position = self._file.tell()
+        self._file.write(np.array(self._chunks, dtype = _CHUNK_DTYPE).tobytes())
+        metadata = json.dumps({"codec": self._CODEC, "chunk_events": self._CHUNK_EVENTS, "n_events": self._n_events,
+                               "last_ts": self._last_ts}).encode()
+        self._file.write(metadata)
+        self._file.write(struct.pack(_FOOTER, index_position, len(self._chunks), len(metadata)) + _MAGIC)
+        self._file.close()
+        os.replace(self._TMP_FILE_DIR, self._EVZ_FILE_DIR)
+
+    def abort(self) -> None:
+
+        """
+        Remove the unfinished file
+        """
+
+        self._file.close()
+        if os.path.exists(self._TMP_FILE_DIR):
+            os.remove(self._TMP_FILE_DIR)
+
+class CompressedEventReader:
+
+    """
+    Methods for reading a chunked, compressed _events.evz file
+
+    Methods
+    -------
+    get_info()
+        Return the codec, chunk size, number of events and number of chunks
+    read_events()
+        Decode every chunk and output event data as x,y,ts,pol
+    read_window(t0, t1)
+        Decode only the chunks that overlap [t0, t1) and output the events with t0 <= ts < t1 as x,y,ts,pol
+    iter_events(chunk_events)
+        Decode groups of whole chunks of about chunk_events events and yield them as x,y,ts,pol
+    """
+
+    def __init__(self, evz_file_dir):
+
+        self._EVZ_FILE_DIR = evz_file_dir
+        footer_length = struct.calcsize(_FOOTER) + len(_MAGIC)
+
+        try:
+            evz_file = open(evz_file_dir, "rb")
+        except OSError:
+            raise OSError("File not found.")
+
+        with evz_file:
+            file_length = evz_file.seek(0, os.SEEK_END)
+            evz_file.seek(max(file_length - footer_length, 0))
+            footer = evz_file.read(footer_length)
+            if file_length < len(_MAGIC) + footer_length or footer[-len(_MAGIC):] != _MAGIC:
+                raise OSError(f"Corrupted file: {evz_file_dir} is not a complete .evz file.")
+            index_position, n_chunks, metadata_length = struct.unpack(_FOOTER, footer[:-len(_MAGIC)])
+            evz_file.seek(index_position)
+            self._chunks = np.frombuffer(evz_file.read(n_chunks * _CHUNK_DTYPE.itemsize), dtype = _CHUNK_DTYPE)
+            self._metadata = json.loads(evz_file.read(metadata_length))
+
+    # ------------ INFO METHOD ------------
+
+    def get_info(self) -> dict:
+
+        """
+        Return the codec, chunk size, number of events and number of chunks
+        """
+
+        return dict(self._metadata, n_chunks = len(self._chunks))
+
+    # ------------ READ METHODS ------------
+
+    def read_events(self) -> list[np.ndarray]:
+
+        """
+        Decode every chunk and output event data as x,y,ts,pol
+        """
+
+        return self._read_chunks(0, len(self._chunks))
+
+    def read_window(self, t0:int, t1:int) -> list[np.ndarray]:
+
+        """
+        Decode only the chunks that overlap [t0, t1) and output the events with t0 <= ts < t1 as x,y,ts,pol
+        """
+
+        # Chunks are in time order, so their first and last timestamps are both sorted
+        first_chunk = int(np.searchsorted(self._chunks["t1"], t0, "left"))
+        end_chunk = int(np.searchsorted(self._chunks["t0"], t1, "left"))
+        x,y,ts,pol = self._read_chunks(first_chunk, max(first_chunk, end_chunk))
+
+        start, end = np.searchsorted(ts, [t0, t1], "left")
+
+        return x[start:end], y[start:end], ts[start:end], pol[start:end]
+
+    def iter_events(self, chunk_events:int):
+
+        """
+        Decode groups of whole chunks of about chunk_events events and yield them as x,y,ts,pol
+        """
+
+        n_chunks = max(chunk_events // max(int(self._metadata["chunk_events"]), 1), 1)
+        for first_chunk in range(0, len(self._chunks), n_chunks):
+            yield self._read_chunks(first_chunk, min(first_chunk + n_chunks, len(self._chunks)))
+
+    def _read_chunks(self, first_chunk:int, end_chunk:int) -> list[np.ndarray]:
+
+        """
+        Read the chunks first_chunk to end_chunk - 1 with one seek and decode them into x,y,ts,pol
+        """
+
+        chunks = self._chunks[first_chunk:end_chunk]
+        n_events = int(chunks["n_events"].sum())
+        x = np.empty(n_events, dtype = np.uint16)
+        y = np.empty(n_events, dtype = np.uint16)
+        ts = np.empty(n_events, dtype = np.int32) # Same limit as the .npy formats
+        pol = np.empty(n_events, dtype = np.uint8)
+        if n_events == 0:
+            return x, y, ts, pol
+
+        with open(self._EVZ_FILE_DIR, "rb") as evz_file:
+            evz_file.seek(int(chunks["offset"][0]))
+            blocks = evz_file.read(int(chunks["offset"][-1] + chunks["length"][-1] - chunks["offset"][0]))
+
+        out_pos = 0
+        for chunk in chunks:
+            block_start = int(chunk["offset"] - chunks["offset"][0])
+            payload = _decompress(self._metadata["codec"], blocks[block_start:block_start + int(chunk["length"])])
+            out_pos = self._decode_chunk(payload, chunk, x, y, ts, pol, out_pos)
+
+        return x, y, ts, pol
+
+    def _decode_chunk(self, payload:bytes, chunk:np.void, x:np.ndarray, y:np.ndarray, ts:np.ndarray, pol:np.ndarray, out_pos:int) -> int:
+
+        """
+        Decode the columns of one chunk into x,y,ts,pol starting at out_pos and return the next position
+        """
+
+        n_events = int(chunk["n_events"])
+        end_pos = out_pos + n_events
+
+        position = 0
+        columns = []
+        for width in (int(chunk["ts_width"]), int(chunk["x_width"]), int(chunk["y_width"])):
+            columns.append(np.frombuffer(payload, dtype = f"<u{width}", count = n_events, offset = position))
+            position += n_events * width
+        zigzag, x[out_pos:end_pos], y[out_pos:end_pos] = columns
+        pol[out_pos:end_pos] = np.unpackbits(np.frombuffer(payload, dtype = np.uint8, offset = position), count = n_events)
+
+        zigzag = zigzag.astype(np.int64)
+        deltas = (zigzag >> 1) ^ -(zigzag & 1)
+        ts[out_pos:end_pos] = int(chunk["t0"]) + np.cumsum(deltas)
+
+        return end_pos
+
+# ------------ CODECS ------------
+
+def _compress(codec:str, data:bytes, level:int) -> bytes:
+
+    """
+    Compress data with codec at level, or the codec default if level is None
+    """
+
+    if codec == "zlib":
+        return zlib.compress(data, 6 if level is None else level)
+    if codec == "lzma":
+        return lzma.compress(data, preset = 6 if level is None else level)
+    if codec == "lz4":
+        return lz4.frame.compress(data, compression_level = 0 if level is None else level)
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level = 3 if level is None else level).compress(data)
+
+    return data
+
+def _decompress(codec:str, data:bytes) -> bytes:
+
+    """
+    Decompress data written with codec
+    """
+
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "lzma":
+        return lzma.decompress(data)
+    if codec == "lz4":
+        if lz4 is None:
+            raise OSError("The lz4 codec needs the lz4 package (pip install lz4)")
+        return lz4.frame.decompress(data)
+    if codec == "zstd":
+        if zstandard is None:
+            raise OSError("The zstd codec needs the zstandard package (pip install zstandard)")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "none":
+        return data
+
+    raise OSError(f"Corrupted file: Unknown codec {codec}.")
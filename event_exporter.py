@@ -0,0 +1,353 @@
+from file_manager import FileManager
+from safe_io import SafeIO
+
+import concurrent.futures
+import glob
+import json
+import numpy as np
+import os
+import time
+
+try:
+    import h5py # Only needed for HDF5 export
+except ImportError:
+    h5py = None
+
+try:
+    import pyarrow # Only needed for Parquet export (pyarrow >= 13)
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# ------------ EXPORT WORKER ------------
+
+def _export_file(file_name_no_ext:str, output_dir:str, export_dir:str, export_format:str, chunk_events:int, compression:str) -> list:
+
+    """
+    Export one take inside a worker process and return its number of events and whether it was written
+    """
+
+    return EventExporter(output_dir, export_dir, 1, chunk_events, compression).export_file(file_name_no_ext, export_format)
+
+class EventExporter:
+
+    """
+    Methods for exporting _events files to HDF5 or Parquet files in bounded chunks
+
+    HDF5 files hold events/x, events/y, events/t and events/p, the ms_to_idx table, t_offset and a
+    labels group. Parquet files hold x, y, t and p columns with ms_to_idx, t_offset and labels in
+    the file metadata. Takes whose first raw timestamp is unknown are exported without labels, and
+    without t_offset in HDF5 files or with a null t_offset in Parquet files
+
+    Methods
+    -------
+    export_file(file_name_no_ext, export_format)
+        Write the events, ms_to_idx table and labels of one take to .h5 or .parquet file
+    export_folder(list_all_files, export_format, progress_function, cancel_event)
+        Export many takes with a process pool and return a summary
+    summary_to_text(summary)
+        Format the summary of an export as text
+    """
+
+    def __init__(self, output_dir, export_dir = None, max_workers = None, chunk_events = 1 << 20, compression = "gzip"):
+
+        self._safe_io = SafeIO()
+        self._file_manager = FileManager(output_dir)
+        self._OUTPUT_DIR = output_dir
+        self._EXPORT_DIR = export_dir or os.path.join(output_dir, "exported") # Keeps the task folders of output_dir
+        self._MAX_WORKERS = max_workers or os.cpu_count() or 1
+        self._CHUNK_EVENTS = chunk_events # Events held in memory by each worker
+        self._COMPRESSION = compression # "gzip" works for both formats. Default: "gzip". None: no compression
+        self._EXPORT_FORMATS = {"hdf5": ".h5", "parquet": ".parquet"}
+        self._LABEL_COLUMNS = ("label", "t_start", "t_end", "idx_start", "idx_end") # Times on the t column clock
+
+    # ------------ EXPORT FILE METHOD ------------
+
+    def export_file(self, file_name_no_ext:str, export_format:str = "hdf5") -> list:
+
+        """
+        Write the events, ms_to_idx table and labels of one take to .h5 or .parquet file
+
+        Returns the number of exported events and False if the take was already exported
+        """
+
+        self._check_export_format(export_format)
+
+        export_file_dir = os.path.join(self._EXPORT_DIR, os.path.relpath(file_name_no_ext, self._OUTPUT_DIR) + self._EXPORT_FORMATS[export_format])
+        if os.path.exists(export_file_dir):
+            return [0, False]
+        os.makedirs(os.path.dirname(export_file_dir), exist_ok = True)
+
+        tmp_file_dir = f"{export_file_dir}.tmp" # Renamed to export_file_dir once the tables and labels are written
+        try:
+            if export_format == "hdf5":
+                n_events = self._write_hdf5(file_name_no_ext, tmp_file_dir)
+            else:
+                n_events = self._write_parquet(file_name_no_ext, tmp_file_dir)
+            os.replace(tmp_file_dir, export_file_dir)
+        except Exception:
+            if os.path.exists(tmp_file_dir):
+                os.remove(tmp_file_dir)
+            raise
+
+        return [n_events, True]
+
+    def _check_export_format(self, export_format:str) -> None:
+
+        """
+        Check that the export format is known and its package is installed
+        """
+
+        if export_format not in self._EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format {export_format}. Choose one of {tuple(self._EXPORT_FORMATS)}")
+        if export_format == "hdf5" and h5py is None:
+            raise OSError("HDF5 export needs the h5py package (pip install h5py)")
+        if export_format == "parquet" and pyarrow is None:
+            raise OSError("Parquet export needs the pyarrow package (pip install pyarrow)")
+
+    def _write_hdf5(self, file_name_no_ext:str, h5_file_dir:str) -> int:
+
+        """
+        Append the event chunks to resizable HDF5 datasets, then write the ms_to_idx table and labels
+        """
+
+        take_index = self._new_take_index(file_name_no_ext)
+        with h5py.File(h5_file_dir, "w") as h5_file:
+            datasets = {name: h5_file.create_dataset(f"events/{name}", shape = (0,), maxshape = (None,), dtype = dtype, chunks = True,
+                                                     compression = self._COMPRESSION)
+                        for name, dtype in (("x", "u2"), ("y", "u2"), ("t", "i8"), ("p", "u1"))}
+
+            n_events = 0
+            for x,y,ts,pol in self._file_manager.iter_npy_file(file_name_no_ext, self._CHUNK_EVENTS):
+                for name, column in (("x", x), ("y", y), ("t", ts), ("p", pol)):
+                    datasets[name].resize((n_events + len(ts),))
+                    datasets[name][n_events:] = column
+                n_events += len(ts)
+                self._add_to_take_index(take_index, ts)
+
+            h5_file.create_dataset("ms_to_idx", data = self._get_ms_to_idx(take_index), compression = self._COMPRESSION)
+            if take_index["first_ts"] is not None:
+                h5_file.create_dataset("t_offset", data = take_index["first_ts"]) # Raw .aedat timestamp of t = 0
+                for name, column in zip(self._LABEL_COLUMNS, self._get_label_table(take_index).T):
+                    h5_file.create_dataset(f"labels/{name}", data = column)
+
+        return n_events
+
+    def _write_parquet(self, file_name_no_ext:str, parquet_file_dir:str) -> int:
+
+        """
+        Write every event chunk as a Parquet row group, then add the ms_to_idx table and labels to the file metadata
+        """
+
+        take_index = self._new_take_index(file_name_no_ext)
+        schema = pyarrow.schema([("x", pyarrow.uint16()), ("y", pyarrow.uint16()), ("t", pyarrow.int64()), ("p", pyarrow.uint8())])
+        writer = pyarrow.parquet.ParquetWriter(parquet_file_dir, schema, compression = self._COMPRESSION or "none")
+
+        n_events = 0
+        try:
+            for x,y,ts,pol in self._file_manager.iter_npy_file(file_name_no_ext, self._CHUNK_EVENTS):
+                writer.write_table(pyarrow.Table.from_arrays([x.astype(np.uint16), y.astype(np.uint16), ts.astype(np.int64),
+                                                               pol.astype(np.uint8)], schema = schema))
+                n_events += len(ts)
+                self._add_to_take_index(take_index, ts)
+
+            metadata = {"ms_to_idx": json.dumps(self._get_ms_to_idx(take_index).tolist()),
+                        "t_offset": json.dumps(take_index["first_ts"])} # null if unknown
+            if take_index["first_ts"] is not None:
+                metadata["labels"] = json.dumps(self._get_label_table(take_index).tolist())
+                metadata["labels_columns"] = ",".join(self._LABEL_COLUMNS)
+            writer.add_key_value_metadata(metadata)
+        finally:
+            writer.close()
+
+        return n_events
+
+    # ------------ TAKE INDEX METHODS ------------
+
+    def _new_take_index(self, file_name_no_ext:str) -> dict:
+
+        """
+        Read the labels of a take and prepare the counters that are filled chunk by chunk
+        """
+
+        first_ts = self._file_manager._get_first_raw_ts(file_name_no_ext)
+        if first_ts is None:
+            self._safe_io.print_warning(f"First timestamp of {file_name_no_ext} not found. It is exported without labels.")
+            labels = np.zeros((0, 3), dtype = np.int64)
+        else:
+            labels = np.array(self._file_manager._read_labels(file_name_no_ext), dtype = np.int64).reshape(-1, 3)
+            labels[:,1:] -= first_ts # Label times are raw .aedat timestamps, while the t column starts from 0
+
+        return {"first_ts": first_ts,
+                "labels": labels,
+                "label_idx": np.zeros((len(labels), 2), dtype = np.int64), # Events before the start and end of every label
+                "ms_counts": np.zeros(0, dtype = np.int64)} # Events of every millisecond
+
+    def _add_to_take_index(self, take_index:dict, ts:np.ndarray) -> None:
+
+        """
+        Count the events of one chunk per millisecond and before every label bound
+        """
+
+        ms_counts = np.bincount(np.clip(ts, 0, None) // 1000)
+        if len(ms_counts) > len(take_index["ms_counts"]):
+            take_index["ms_counts"] = np.pad(take_index["ms_counts"], (0, len(ms_counts) - len(take_index["ms_counts"])))
+        take_index["ms_counts"][:len(ms_counts)] += ms_counts
+
+        # Chunks are in time order, so the events before a bound add up over the chunks
+        take_index["label_idx"] += np.searchsorted(ts, take_index["labels"][:,1:], "left")
+
+    def _get_ms_to_idx(self, take_index:dict) -> np.ndarray:
+
+        """
+        Return ms_to_idx, where ms_to_idx[ms] is the index of the first event with t >= ms * 1000
+        """
+
+        return np.concatenate(([0], np.cumsum(take_index["ms_counts"]))).astype(np.uint64)
+
+    def _get_label_table(self, take_index:dict) -> np.ndarray:
+
+        """
+        Return the label,t_start,t_end,idx_start,idx_end rows of the take
+        """
+
+        idx_start = take_index["label_idx"][:,0]
+        idx_end = np.maximum(idx_start, take_index["label_idx"][:,1])
+
+        return np.column_stack((take_index["labels"], idx_start, idx_end)).reshape(-1, len(self._LABEL_COLUMNS))
+
+    # ------------ EXPORT FOLDER METHOD ------------
+
+    def export_folder(self, list_all_files:list[str] = None, export_format:str = "hdf5", progress_function = None, cancel_event = None) -> dict:
+
+        """
+        Export many takes with a process pool and return a summary
+
+        list_all_files holds _events.npy or _events.evz files. Default: every one under the output folder.
+        progress_function, if given, is called with the progress after every take. Setting
+        cancel_event (threading.Event) skips the takes that did not start exporting yet.
+        """
+
+        self._check_export_format(export_format)
+        if list_all_files is None:
+            list_all_files = sorted(glob.glob(os.path.join(self._OUTPUT_DIR, "**", "*_events.npy"), recursive = True)
+                                    + glob.glob(os.path.join(self._OUTPUT_DIR, "**", "*_events.evz"), recursive = True))
+
+        # A take converted to both formats is exported once. Largest takes first so that no worker is left with a big take at the end
+        takes = {file[:len(file)-11]: os.path.getsize(file) for file in list_all_files} # Remove _events.npy or _events.evz from file name
+        list_queued_takes = sorted(takes, key = takes.get, reverse = True)
+
+        summary = {"n_files": len(list_queued_takes), "n_exported": 0, "n_skipped": 0, "n_cancelled": 0, "n_events": 0,
+                   "elapsed": 0.0, "errors": {}}
+        start_time = time.perf_counter()
+        arguments = (self._OUTPUT_DIR, self._EXPORT_DIR, export_format, self._CHUNK_EVENTS, self._COMPRESSION)
+
+        if self._MAX_WORKERS == 1 or len(list_queued_takes) <= 1:
+            for take in list_queued_takes:
+                if cancel_event is not None and cancel_event.is_set():
+                    summary["n_cancelled"] += 1
+                    continue
+                try:
+                    result = _export_file(take, *arguments)
+                except Exception as e:
+                    self._add_error(summary, take, e)
+                else:
+                    self._add_result(summary, result)
+                self._report_progress(progress_function, summary, take, start_time)
+
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers = self._MAX_WORKERS) as executor:
+                # One take per worker in flight, so a cancel skips every take that did not start yet
+                futures = {}
+                while list_queued_takes or futures:
+                    if cancel_event is not None and cancel_event.is_set():
+                        summary["n_cancelled"] += len(list_queued_takes)
+                        list_queued_takes = []
+                    while list_queued_takes and len(futures) < self._MAX_WORKERS:
+                        take = list_queued_takes.pop(0)
+                        futures[executor.submit(_export_file, take, *arguments)] = take
+                    if not futures:
+                        break
+
+                    done, _ = concurrent.futures.wait(futures, return_when = concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        take = futures.pop(future)
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            self._add_error(summary, take, e)
+                        else:
+                            self._add_result(summary, result)
+                        self._report_progress(progress_function, summary, take, start_time)
+
+        summary["elapsed"] = time.perf_counter() - start_time
+
+        return summary
+
+    # ------------ SUMMARY METHODS ------------
+
+    def _add_result(self, summary:dict, result:list) -> None:
+
+        """
+        Add the statistics of one exported take to the summary
+        """
+
+        n_events, was_exported = result
+        if was_exported:
+            summary["n_exported"] += 1
+            summary["n_events"] += n_events
+        else:
+            summary["n_skipped"] += 1
+
+    def _add_error(self, summary:dict, take:str, error:Exception) -> None:
+
+        """
+        Register the error of one take without stopping the export
+        """
+
+        summary["errors"][take] = f"{type(error).__name__}: {error}"
+        self._safe_io.print_error(f"Unable to export {take}: {error}")
+
+    def _report_progress(self, progress_function, summary:dict, take:str, start_time:float) -> None:
+
+        """
+        Pass the progress after a finished take to progress_function
+        """
+
+        if progress_function is None:
+            return
+
+        elapsed = time.perf_counter() - start_time
+        progress_function({"n_done": summary["n_exported"] + summary["n_skipped"] + len(summary["errors"]),
+                           "n_total": summary["n_files"] - summary["n_cancelled"],
+                           "file": take,
+                           "n_events": summary["n_events"],
+                           "events_per_s": summary["n_events"] / elapsed if elapsed > 0 else 0.0})
+
+    def summary_to_text(self, summary:dict) -> str:
+
+        """
+        Format the summary of an export as text
+        """
+
+        elapsed = max(summary["elapsed"], 1e-9)
+        text = (f"Exported {summary['n_exported']} of {summary['n_files']} take(s) "
+                f"({summary['n_skipped']} already exported, {summary['n_cancelled']} cancelled, {len(summary['errors'])} failed)\n"
+                f"{summary['n_events']} events in {summary['elapsed']:.2f} s ({summary['n_events']/elapsed/1e6:.2f} Mevents/s)\n")
+        for take, error in summary["errors"].items():
+            text += f"Failed {take}: {error}\n"
+
+        return text
+
+# ------------ EXPORT DATASET ------------
+
+if __name__ == "__main__":
+
+    OUTPUT_DIR = "test_data"
+    EXPORT_FORMAT = "hdf5" # "hdf5" (events/x,y,t,p and ms_to_idx) or "parquet" (x,y,t,p columns)
+    N_WORKERS = None # Default: one per CPU
+
+    safe_io = SafeIO()
+    exporter = EventExporter(OUTPUT_DIR, max_workers = N_WORKERS)
+    summary = exporter.export_folder(export_format = EXPORT_FORMAT)
+    safe_io.print_info(exporter.summary_to_text(summary))
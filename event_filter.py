@@ -0,0 +1,211 @@
+import numpy as np
+
+class EventFilter:
+
+    """
+    Methods for removing hot pixel, refractory and background activity events with array operations
+
+    Chunks must be passed in time order. Every chunk is filtered at once against a per-pixel table
+    of the last timestamps of the previous chunks, so results do not depend on the chunk size
+
+    Methods
+    -------
+    get_parameters()
+        Return the constructor arguments, to rebuild the filter or record it next to the output
+    reset()
+        Forget the hot pixels, pixel timestamps and counters of the previous file
+    add_to_pixel_counts(x, y, ts)
+        Count the events of every pixel, the statistics of the hot pixel filter (first pass)
+    find_hot_pixels()
+        Mark the pixels whose event rate is an outlier of the pixel rates as hot
+    filter_events(x, y, ts, pol)
+        Return the events of one chunk that pass every enabled filter as x,y,ts,pol (second pass)
+    get_report()
+        Return the parameters, hot pixels and number of events removed by every filter
+    """
+
+    def __init__(self, width = 240, height = 180, background_window_us = None, refractory_us = None, hot_pixel_sigma = None):
+
+        self._WIDTH = width # DAVIS240C
+        self._HEIGHT = height
+        self._BACKGROUND_WINDOW_US = background_window_us # Events without a neighbour event this recent are noise. None: off
+        self._REFRACTORY_US = refractory_us # Events closer than this to the previous event of their pixel are removed. None: off
+        self._HOT_PIXEL_SIGMA = hot_pixel_sigma # Pixels this many standard deviations above the mean rate are hot. None: off
+        self._MAX_HOT_PIXEL_ITERATIONS = 10 # Hot pixels inflate the statistics, so they are recomputed without them
+        self._NEVER = -(1 << 62) # Timestamp of pixels without events
+        self._PADDED_WIDTH = width + 2 # One pixel border without events, so every neighbour is inside the grid
+        self._NEIGHBOUR_OFFSETS = [dy * self._PADDED_WIDTH + dx for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dx or dy]
+        self._PIXEL_DTYPE = np.uint16 if (width + 2) * (height + 2) <= 1 << 16 else np.int64
+        self.reset()
+
+    # ------------ PARAMETERS METHODS ------------
+
+    def get_parameters(self) -> dict:
+
+        """
+        Return the constructor arguments, to rebuild the filter or record it next to the output
+        """
+
+        return {"width": self._WIDTH,
+                "height": self._HEIGHT,
+                "background_window_us": self._BACKGROUND_WINDOW_US,
+                "refractory_us": self._REFRACTORY_US,
+                "hot_pixel_sigma": self._HOT_PIXEL_SIGMA}
+
+    def reset(self) -> None:
+
+        """
+        Forget the hot pixels, pixel timestamps and counters of the previous file
+        """
+
+        self._pixel_counts = np.zeros(self._WIDTH * self._HEIGHT, dtype = np.int64)
+        self._first_ts = None
+        self._last_ts = None
+        self._is_hot = np.zeros(self._WIDTH * self._HEIGHT, dtype = bool)
+        self._pixel_last_ts = np.full(self._PADDED_WIDTH * (self._HEIGHT + 2), self._NEVER, dtype = np.int64)
+        self._n_events = 0
+        self._n_removed = {"hot_pixel": 0, "refractory": 0, "background_activity": 0}
+
+    # ------------ HOT PIXEL METHODS ------------
+
+    def add_to_pixel_counts(self, x:np.ndarray, y:np.ndarray, ts:np.ndarray) -> None:
+
+        """
+        Count the events of every pixel, the statistics of the hot pixel filter (first pass)
+        """
+
+        if len(ts) == 0:
+            return
+
+        self._pixel_counts += np.bincount(self._get_pixels(x, y), minlength = len(self._pixel_counts))
+        self._first_ts = int(ts[0]) if self._first_ts is None else self._first_ts
+        self._last_ts = int(ts[-1])
+
+    def find_hot_pixels(self) -> None:
+
+        """
+        Mark the pixels whose event rate is an outlier of the pixel rates as hot
+        """
+
+        if self._HOT_PIXEL_SIGMA is None:
+            return
+
+        counts = self._pixel_counts
+        is_hot = np.zeros(len(counts), dtype = bool)
+        for _ in range(self._MAX_HOT_PIXEL_ITERATIONS):
+            normal_counts = counts[(counts > 0) & ~is_hot]
+            if len(normal_counts) < 2:
+                break
+            threshold = normal_counts.mean() + self._HOT_PIXEL_SIGMA * normal_counts.std()
+            new_is_hot = is_hot | (counts > threshold)
+            if np.array_equal(new_is_hot, is_hot):
+                break
+            is_hot = new_is_hot
+
+        self._is_hot = is_hot
+
+    # ------------ FILTER EVENTS METHOD ------------
+
+    def filter_events(self, x:np.ndarray, y:np.ndarray, ts:np.ndarray, pol:np.ndarray) -> list[np.ndarray]:
+
+        """
+        Return the events of one chunk that pass every enabled filter as x,y,ts,pol (second pass)
+        """
+
+        n_events = len(ts)
+        self._n_events += n_events
+        if n_events == 0:
+            return x, y, ts, pol
+
+        pixels = self._get_pixels(x, y)
+        ts_int = np.asarray(ts, dtype = np.int64)
+
+        # Events of hot pixels are removed and do not support their neighbours either
+        is_hot = self._is_hot[pixels]
+        self._n_removed["hot_pixel"] += int(np.count_nonzero(is_hot))
+        keep = ~is_hot
+
+        if self._REFRACTORY_US is not None or self._BACKGROUND_WINDOW_US is not None:
+            candidates = np.flatnonzero(keep)
+            padded_pixels = pixels[candidates] + 2 * (pixels[candidates] // self._WIDTH) + self._PADDED_WIDTH + 1
+            keep[candidates] = self._filter_candidates(padded_pixels, ts_int[candidates])
+
+        return x[keep], y[keep], ts[keep], pol[keep]
+
+    def _filter_candidates(self, padded_pixels:np.ndarray, ts:np.ndarray) -> np.ndarray:
+
+        """
+        Apply the refractory and background activity filters to the events that are not hot and return which pass
+        """
+
+        n_events = len(padded_pixels)
+        if n_events == 0:
+            return np.ones(0, dtype = bool)
+
+        # Every pixel of the padded grid starts with a virtual event that holds its last timestamp of the previous
+        # chunks. Sorted by pixel and then by time, the previous event of any pixel before an event is one search away,
+        # and shifting the keys by a neighbour offset keeps them sorted, which keeps the searches cache friendly
+        n_pixels = len(self._pixel_last_ts)
+        all_pixels = np.concatenate((np.arange(n_pixels), padded_pixels))
+        order = np.argsort(all_pixels.astype(self._PIXEL_DTYPE), kind = "stable") # Radix sort for 16-bit pixel numbers
+        sorted_ts = np.concatenate((self._pixel_last_ts, ts))[order]
+        sorted_indices = np.maximum(order - (n_pixels - 1), 0) # 0 for virtual events, 1 + position in the chunk for real ones
+        sorted_keys = all_pixels[order] * (n_events + 1) + sorted_indices
+        event_positions = np.flatnonzero(sorted_indices) # Sorted positions of the real events
+        event_keys = sorted_keys[event_positions]
+        event_ts = sorted_ts[event_positions]
+        passes = np.ones(n_events, dtype = bool)
+
+        if self._REFRACTORY_US is not None:
+            is_refractory = event_ts - sorted_ts[event_positions - 1] < self._REFRACTORY_US # The previous entry has the same pixel
+            self._n_removed["refractory"] += int(np.count_nonzero(is_refractory))
+            passes &= ~is_refractory
+
+        if self._BACKGROUND_WINDOW_US is not None:
+            support_ts = np.full(n_events, self._NEVER, dtype = np.int64)
+            for offset in self._NEIGHBOUR_OFFSETS:
+                previous = np.searchsorted(sorted_keys, event_keys + offset * (n_events + 1), "left") - 1
+                np.maximum(support_ts, sorted_ts[previous], out = support_ts)
+            is_background = passes & (event_ts - support_ts > self._BACKGROUND_WINDOW_US)
+            self._n_removed["background_activity"] += int(np.count_nonzero(is_background))
+            passes &= ~is_background
+
+        # Every event that is not hot updates the table, also the removed ones, as in jAER
+        is_last = np.append(sorted_keys[1:] // (n_events + 1) != sorted_keys[:-1] // (n_events + 1), True)
+        self._pixel_last_ts = sorted_ts[is_last]
+
+        unsorted_passes = np.empty(n_events, dtype = bool)
+        unsorted_passes[sorted_indices[event_positions] - 1] = passes
+
+        return unsorted_passes
+
+    def _get_pixels(self, x:np.ndarray, y:np.ndarray) -> np.ndarray:
+
+        """
+        Return the flat pixel index of every event and check the coordinates fit the sensor
+        """
+
+        x = np.asarray(x, dtype = np.int64)
+        y = np.asarray(y, dtype = np.int64)
+        if len(x) and (x.min() < 0 or x.max() >= self._WIDTH or y.min() < 0 or y.max() >= self._HEIGHT):
+            raise ValueError(f"Event coordinates outside the {self._WIDTH}x{self._HEIGHT} sensor")
+
+        return y * self._WIDTH + x
+
+    # ------------ REPORT METHOD ------------
+
+    def get_report(self) -> dict:
+
+        """
+        Return the parameters, hot pixels and number of events removed by every filter
+        """
+
+        duration = (self._last_ts - self._first_ts) * 1e-6 if self._first_ts is not None else 0.0
+        hot_pixels = np.flatnonzero(self._is_hot)
+        rates = self._pixel_counts[hot_pixels] / duration if duration > 0 else np.zeros(len(hot_pixels))
+
+        return {"parameters": self.get_parameters(),
+                "n_events": self._n_events,
+                "n_kept": self._n_events - sum(self._n_removed.values()),
+                "n_removed": dict(self._n_removed),
+                "hot_pixels": [[int(pixel % self._WIDTH), int(pixel // self._WIDTH), float(rate)] for pixel, rate in zip(hot_pixels, rates)]} # x, y, events/s
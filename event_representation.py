@@ -0,0 +1,271 @@
+from conversion_manifest import fast_file_hash
+from file_manager import FileManager
+from safe_io import SafeIO
+
+import glob
+import hashlib
+import json
+import numpy as np
+import os
+import time
+
+class RepresentationEngine:
+
+    """
+    Methods for turning the events of .npy files into frames, voxel grids and time surfaces
+
+    Methods
+    -------
+    count_frames(file_name_no_ext, window_us, window_events)
+        Count the OFF and ON events of every pixel in each window as (windows,2,height,width)
+    voxel_grids(file_name_no_ext, n_bins, window_us, window_events)
+        Sum the polarities (+1 ON, -1 OFF) of every pixel in n_bins time bins of each window as (windows,n_bins,height,width)
+    time_surfaces(file_name_no_ext, tau_us, window_us, window_events)
+        Decay the last OFF and ON timestamp of every pixel at the end of each window as (windows,2,height,width)
+    get_window_bounds(file_name_no_ext, window_us, window_events)
+        Return the first event, start time and end time of each window
+    """
+
+    def __init__(self, output_dir, width = 240, height = 180, cache_dir = None, chunk_events = None):
+
+        self._file_manager = FileManager(output_dir)
+        self._WIDTH = width # DAVIS240C
+        self._HEIGHT = height
+        self._CACHE_DIR = cache_dir # Representations are saved here and reused. Default: None (no cache)
+        self._CHUNK_EVENTS = chunk_events or 1 << 20 # Events scattered at once
+        self._CHUNK_WINDOWS = 64 # Windows scattered at once, so short windows do not inflate the scatter buffer
+        self._REPRESENTATION_VERSION = 1 # Increase when a change alters the content of cached representations
+
+    # ------------ REPRESENTATION METHODS ------------
+
+    def count_frames(self, file_name_no_ext:str, window_us:int = None, window_events:int = None) -> np.ndarray:
+
+        """
+        Count the OFF and ON events of every pixel in each window as (windows,2,height,width)
+        """
+
+        return self._build(file_name_no_ext, "count_frames", {"window_us": window_us, "window_events": window_events})
+
+    def voxel_grids(self, file_name_no_ext:str, n_bins:int, window_us:int = None, window_events:int = None) -> np.ndarray:
+
+        """
+        Sum the polarities (+1 ON, -1 OFF) of every pixel in n_bins time bins of each window as (windows,n_bins,height,width)
+        """
+
+        if n_bins < 1:
+            raise ValueError("The number of voxel bins must be at least 1")
+
+        return self._build(file_name_no_ext, "voxel_grids", {"window_us": window_us, "window_events": window_events, "n_bins": n_bins})
+
+    def time_surfaces(self, file_name_no_ext:str, tau_us:float, window_us:int = None, window_events:int = None) -> np.ndarray:
+
+        """
+        Decay the last OFF and ON timestamp of every pixel at the end of each window as (windows,2,height,width)
+
+        Each value is exp(-(window end - last ts) / tau_us), or 0 for pixels that never fired
+        """
+
+        if tau_us <= 0:
+            raise ValueError("The time surface decay must be greater than 0 us")
+
+        return self._build(file_name_no_ext, "time_surfaces", {"window_us": window_us, "window_events": window_events, "tau_us": tau_us})
+
+    def get_window_bounds(self, file_name_no_ext:str, window_us:int = None, window_events:int = None) -> list[np.ndarray]:
+
+        """
+        Return the first event, start time and end time of each window
+
+        The first events hold one more entry than there are windows, the end of the last window
+        """
+
+        ts = self._file_manager.read_npy_file(file_name_no_ext, True)[2]
+
+        return self._get_windows(ts, window_us, window_events)
+
+    # ------------ BUILD AND CACHE METHODS ------------
+
+    def _build(self, file_name_no_ext:str, representation:str, parameters:dict) -> np.ndarray:
+
+        """
+        Load the representation from the cache, or compute it chunk by chunk
+        """
+
+        x,y,ts,pol = self._file_manager.read_npy_file(file_name_no_ext, True)
+        starts, t_start, t_end = self._get_windows(ts, parameters["window_us"], parameters["window_events"])
+        n_windows = len(t_start)
+
+        n_channels = parameters["n_bins"] if representation == "voxel_grids" else 2
+        dtype = np.int32 if representation == "count_frames" else np.float32
+        shape = (n_windows, n_channels, self._HEIGHT, self._WIDTH)
+
+        cache_file_dir = None
+        if self._CACHE_DIR is not None:
+            cache_file_dir = self._get_cache_file_dir(file_name_no_ext, representation, parameters)
+            if os.path.exists(cache_file_dir):
+                return np.load(cache_file_dir, mmap_mode = "r")
+            os.makedirs(self._CACHE_DIR, exist_ok = True)
+            tmp_file_dir = f"{cache_file_dir}.tmp"
+            representations = np.lib.format.open_memmap(tmp_file_dir, mode = "w+", dtype = dtype, shape = shape) # Zero-filled
+        else:
+            representations = np.zeros(shape, dtype = dtype)
+
+        try:
+            if representation == "time_surfaces":
+                self._add_time_surfaces(representations, x, y, ts, pol, starts, t_end, parameters["tau_us"])
+            else:
+                for start, end, first_window, last_window in self._iter_chunks(starts):
+                    window = np.repeat(np.arange(last_window - first_window + 1),
+                                       np.diff(np.clip(starts[first_window:last_window+2], start, end)))
+                    x_chunk, y_chunk, ts_chunk, pol_chunk = self._read_chunk(x, y, ts, pol, start, end)
+                    if representation == "count_frames":
+                        channel, weights = pol_chunk, None
+                    else:
+                        channel = self._get_voxel_bins(ts_chunk, window + first_window, t_start, t_end, n_channels)
+                        weights = np.where(pol_chunk, 1.0, -1.0)
+                    self._scatter(representations, first_window, last_window, window, channel, y_chunk, x_chunk, weights)
+        except Exception:
+            if cache_file_dir is not None:
+                del representations
+                os.remove(tmp_file_dir)
+            raise
+
+        if cache_file_dir is None:
+            return representations
+
+        representations.flush()
+        del representations # Close the memory map before the rename
+        os.replace(tmp_file_dir, cache_file_dir)
+
+        return np.load(cache_file_dir, mmap_mode = "r")
+
+    def _get_cache_file_dir(self, file_name_no_ext:str, representation:str, parameters:dict) -> str:
+
+        """
+        Name the cache file after the .npy file content and the representation parameters
+        """
+
+        key = json.dumps({"events": fast_file_hash(self._file_manager._get_events_file_dir(file_name_no_ext)), "representation": representation,
+                          "parameters": parameters, "width": self._WIDTH, "height": self._HEIGHT,
+                          "version": self._REPRESENTATION_VERSION}, sort_keys = True)
+        key_hash = hashlib.blake2b(key.encode(), digest_size = 8).hexdigest()
+
+        return os.path.join(self._CACHE_DIR, f"{os.path.basename(file_name_no_ext)}_{representation}_{key_hash}.npy")
+
+    # ------------ WINDOW METHODS ------------
+
+    def _get_windows(self, ts:np.ndarray, window_us:int, window_events:int) -> list[np.ndarray]:
+
+        """
+        Split the sorted ts column into fixed time windows from 0 us or into windows of window_events events
+        """
+
+        if (window_us is None) == (window_events is None):
+            raise ValueError("Choose either a window duration (window_us) or a window size (window_events)")
+        if len(ts) == 0:
+            return np.zeros(1, dtype = np.int64), np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64)
+
+        if window_us is not None:
+            if window_us < 1:
+                raise ValueError("The window duration must be at least 1 us")
+            t_start = np.arange(0, int(ts[-1]) // window_us + 1, dtype = np.int64) * window_us # Same bins as the time index
+            t_end = t_start + window_us
+            starts = np.searchsorted(ts, np.append(t_start, t_end[-1])).astype(np.int64)
+        else:
+            if window_events < 1:
+                raise ValueError("The window size must be at least 1 event")
+            starts = np.append(np.arange(0, len(ts), window_events, dtype = np.int64), len(ts))
+            t_start = np.asarray(ts[starts[:-1]], dtype = np.int64)
+            t_end = np.asarray(ts[starts[1:] - 1], dtype = np.int64) + 1
+
+        return starts, t_start, t_end
+
+    def _iter_chunks(self, starts:np.ndarray):
+
+        """
+        Yield (start, end, first window, last window) event chunks that cover whole or partial windows
+        """
+
+        n_events = int(starts[-1])
+        start = 0
+        while start < n_events:
+            end = min(start + self._CHUNK_EVENTS, n_events)
+            first_window = int(np.searchsorted(starts, start, "right")) - 1
+            last_window = int(np.searchsorted(starts, end - 1, "right")) - 1
+            if last_window - first_window >= self._CHUNK_WINDOWS:
+                last_window = first_window + self._CHUNK_WINDOWS - 1
+                end = int(starts[last_window + 1])
+            yield start, end, first_window, last_window
+            start = end
+
+    def _read_chunk(self, x:np.ndarray, y:np.ndarray, ts:np.ndarray, pol:np.ndarray, start:int, end:int) -> list[np.ndarray]:
+
+        """
+        Read x,y,ts,pol of one chunk and check the coordinates fit the sensor
+        """
+
+        x_chunk = np.asarray(x[start:end], dtype = np.int64)
+        y_chunk = np.asarray(y[start:end], dtype = np.int64)
+        if len(x_chunk) and (x_chunk.min() < 0 or x_chunk.max() >= self._WIDTH or y_chunk.min() < 0 or y_chunk.max() >= self._HEIGHT):
+            raise ValueError(f"Event coordinates outside the {self._WIDTH}x{self._HEIGHT} sensor")
+
+        return x_chunk, y_chunk, np.asarray(ts[start:end], dtype = np.int64), np.asarray(pol[start:end], dtype = np.int64)
+
+    # ------------ SCATTER METHODS ------------
+
+    def _scatter(self, representations:np.ndarray, first_window:int, last_window:int, window:np.ndarray, channel:np.ndarray,
+                 y:np.ndarray, x:np.ndarray, weights:np.ndarray) -> None:
+
+        """
+        Add the events of one chunk to their window, channel and pixel with a single bincount
+        """
+
+        n_windows = last_window - first_window + 1
+        shape = (n_windows,) + representations.shape[1:]
+        flat = np.ravel_multi_index((window, channel, y, x), shape)
+        counts = np.bincount(flat, weights = weights, minlength = int(np.prod(shape)))
+        representations[first_window:last_window+1] += counts.reshape(shape).astype(representations.dtype)
+
+    def _get_voxel_bins(self, ts:np.ndarray, window:np.ndarray, t_start:np.ndarray, t_end:np.ndarray, n_bins:int) -> np.ndarray:
+
+        """
+        Return the time bin of every event inside its window
+        """
+
+        bins = (ts - t_start[window]) * n_bins // (t_end[window] - t_start[window])
+
+        return np.clip(bins, 0, n_bins - 1)
+
+    def _add_time_surfaces(self, representations:np.ndarray, x:np.ndarray, y:np.ndarray, ts:np.ndarray, pol:np.ndarray,
+                           starts:np.ndarray, t_end:np.ndarray, tau_us:float) -> None:
+
+        """
+        Keep the last ts of every pixel and polarity and decay it at the end of each window
+        """
+
+        last_ts = np.full(representations.shape[1:], -np.inf) # exp(-inf) = 0 for pixels that never fired
+        for window in range(len(t_end)):
+            for start in range(int(starts[window]), int(starts[window+1]), self._CHUNK_EVENTS):
+                end = min(start + self._CHUNK_EVENTS, int(starts[window+1]))
+                x_chunk, y_chunk, ts_chunk, pol_chunk = self._read_chunk(x, y, ts, pol, start, end)
+                np.maximum.at(last_ts, (pol_chunk, y_chunk, x_chunk), ts_chunk)
+            representations[window] = np.exp((last_ts - t_end[window]) / tau_us) # Also decays windows without events
+
+# ------------ BUILD REPRESENTATIONS ------------
+
+if __name__ == "__main__":
+
+    OUTPUT_DIR = "test_data"
+    CACHE_DIR = os.path.join(OUTPUT_DIR, "representations") # Cached representations are reused on the next run
+    WINDOW_US = 50000 # Time (us) covered by each frame
+    N_BINS = 5 # Time bins of each voxel grid
+    TAU_US = 20000 # Time surface decay (us)
+
+    safe_io = SafeIO()
+    engine = RepresentationEngine(OUTPUT_DIR, cache_dir = CACHE_DIR)
+    for npy_file_dir in sorted(glob.glob(os.path.join(OUTPUT_DIR, "**", "*_events.npy"), recursive = True)):
+        file_name_no_ext = npy_file_dir[:len(npy_file_dir)-11] # Remove _events.npy from file name
+        start_time = time.perf_counter()
+        frames = engine.count_frames(file_name_no_ext, WINDOW_US)
+        voxels = engine.voxel_grids(file_name_no_ext, N_BINS, WINDOW_US)
+        surfaces = engine.time_surfaces(file_name_no_ext, TAU_US, WINDOW_US)
+        safe_io.print_info(f"{file_name_no_ext}: {len(frames)} windows in {time.perf_counter() - start_time:.2f} s")
@@ -1,5 +1,10 @@
+from aedat_formats import Aedat2Decoder, AedatHeaderParser
+from conversion_manifest import ConversionManifest, fast_file_hash
+from event_codec import CompressedEventReader, CompressedEventWriter
 from safe_io import SafeIO
 
+import concurrent.futures
+import json
 import numpy as np
 import os
 import shutil
@@ -12,59 +17,653 @@ class FileManager:
 
     Methods
     -------
-    aedat_to_npy(file_name_no_ext)
-        Read .aedat file and save event data into .npy file
-    decode_aedat_file(file_name_with_ext, only_first_event)
-        Read .aedat file and output event data as x,y,ts,pol
-    move_aedat_file(byte_string, file_name, user_number, current_attempt, primitive)
+    aedat_to_npy(file_name_no_ext, engine, streaming, chunk_events, n_workers, output_format, write_index, event_filter, manifest)
+        Read .aedat file, optionally denoise it, and save event data into .npy file (or chunked, compressed .evz file)
+    decode_aedat_file(file_name_with_ext, only_first_event, engine)
+        Read .aedat file (AEDAT 2.0, 3.1 or 4.0) and output event data as x,y,ts,pol
+    probe_aedat_file(file_name_with_ext)
+        Read header length, first and last raw timestamps and approximate event count of .aedat file
+    move_aedat_file(jaer_file_dir, task_name, current_attempt, primitive)
         Move .aedat file from jAER folder to recorded_data folder
-    read_npy_file(file_name_no_ext)
-        Read .npy file and output event data as x,y,ts,pol
+    read_npy_file(file_name_no_ext, lazy)
+        Read .npy (or .evz) file and output event data as x,y,ts,pol
+    iter_npy_file(file_name_no_ext, chunk_events)
+        Read .npy (or .evz) file in chunks and yield event data as x,y,ts,pol
+    read_npy_window(file_name_no_ext, t0, t1)
+        Read the events of .npy file with t0 <= ts < t1 as x,y,ts,pol
+    read_label_events(file_name_no_ext, label_row)
+        Read the events of one row of the _labels.csv file as x,y,ts,pol
+    write_index_file(file_name_no_ext, bin_us)
+        Write time index and label event ranges of .npy file to _index.npz file
     write_csv_file(final_times_list,first_ts,csv_file_dir,without_labels,mode)
         Write timestamps and labels to .csv file
+    write_take_report(report, json_file_dir)
+        Write timing report of a recorded take to .json file
     """
 
-    def __init__(self, output_dir):
+    def __init__(self, output_dir, safe_io = None, codec = "zlib"):
         
-        self._safe_io = SafeIO()
+        self._safe_io = safe_io or SafeIO()
         self._READ_MODE = ">II"
         self._N_BYTES = 8
         self._MASK = [0x003ff000,0x7fc00000,0x800,0]
         self._SHIFT = [12,22,11,31]
         self._OUTPUT_DIR = output_dir
+        self._ENGINES = ("numpy", "reference")
+        self._FIRST_EVENT_BLOCK = 4096 # Events read per block when looking for the first event
+        self._CHUNK_EVENTS = 1 << 20 # Events decoded per chunk in streaming mode (8 MB of .aedat data)
+        self._OUTPUT_FORMATS = ("matrix", "structured", "compressed")
+        self._CODEC = codec # Compression of "compressed" _events.evz files: "zlib", "lzma", "none", or "lz4"/"zstd" if installed
+        self._EVENT_DTYPE = np.dtype([("ts","<i4"),("x","<u2"),("y","<u2"),("p","u1")]) # 9 bytes per event instead of 16
+        self._MAX_TS = np.iinfo(np.int32).max # ts is int32 in every output format: recordings up to 2^31 us (~35.8 min)
+        self._INDEX_BIN_US = 1000 # Time between two entries of the time index (us)
+        self._DECODER_VERSION = 1 # Increase when a decoder change alters the content of _events.npy files
+        self._index_cache = {}
+        self._header_parser = AedatHeaderParser() # Detects AEDAT 2.0, 3.1 and 4.0 files
+        self._aedat2_decoder = Aedat2Decoder({"header_length": 0}) # Decodes buffers of 2.0 events
 
     # ------------ AEDAT TO NPY FILE METHOD ------------
 
-    def aedat_to_npy(self,file_name_no_ext:str) -> None:
+    def aedat_to_npy(self,file_name_no_ext:str, engine:str = "numpy", streaming:bool = False, chunk_events:int = None, n_workers:int = 1,
+                     output_format:str = "matrix", write_index:bool = False, event_filter = None, manifest:ConversionManifest = None) -> None:
         
         """
         Read .aedat file and save event data into .npy file
+
+        Timestamps are saved as int32 in every output format, so recordings longer than 2^31 us (~35.8 min) raise OSError
+        event_filter is an EventFilter whose kept events are saved. Its report is saved to the _filter.json file
+        The raw timestamp of the first event is saved to the _first_ts.json file, the origin of the _labels.csv times
+
+        Existing outputs are only reused if the conversion manifest shows they come from the current .aedat file,
+        decoder, output format and filter. manifest is a ConversionManifest that records the conversion and that the
+        caller saves. Default: the manifest of the output folder, saved by this call
         """
 
-        if not os.path.exists(f"{file_name_no_ext}_events.npy"):
-            try:
-                x,y,ts,pol = self.decode_aedat_file(f"{file_name_no_ext}.aedat",False)
-            except Exception: 
-                raise
-            
-            try:
-                array_events = np.array([x,y,ts,pol],dtype = 'int32') # If timestamp values are suposed to be > int32, change to int64
-            except Exception:
-                raise OSError("Corrupted file: Timestamp values surpass int32 limit.")
-            
-            try:    
-                np.save(f"{file_name_no_ext}_events.npy", array_events)
-            except Exception:
-                raise OSError(f"Unable to save data to {file_name_no_ext}_events.npy")
+        if output_format not in self._OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format {output_format}. Choose one of {self._OUTPUT_FORMATS}")
+
+        file_name_with_ext = f"{file_name_no_ext}.aedat"
+        is_own_manifest = manifest is None
+        if is_own_manifest:
+            manifest = ConversionManifest(self._OUTPUT_DIR if self._OUTPUT_DIR is not None else os.path.dirname(file_name_no_ext))
+        filter_parameters = event_filter.get_parameters() if event_filter is not None else None
+
+        if not self._is_conversion_up_to_date(file_name_with_ext, output_format, filter_parameters, manifest):
+            chunk_events = self._CHUNK_EVENTS if chunk_events is None else chunk_events
+            if output_format == "compressed":
+                self._save_aedat_to_evz(file_name_no_ext, engine, streaming, chunk_events, event_filter)
+            elif event_filter is not None and (streaming or n_workers > 1): # The filter runs in time order, so it is never sharded
+                self._stream_filtered_aedat_to_npy(file_name_no_ext, engine, chunk_events, output_format, event_filter)
+            elif streaming or n_workers > 1: # Shards are always written through the streaming path
+                self._stream_aedat_to_npy(file_name_no_ext, chunk_events, n_workers, output_format)
+            else:
+                self._save_aedat_to_npy(file_name_no_ext, engine, output_format, event_filter)
+            if event_filter is not None:
+                self._save_atomically(f"{file_name_no_ext}_filter.json",
+                                      lambda json_file: json_file.write(json.dumps(event_filter.get_report(), indent = 1).encode()))
+            self._save_first_raw_ts(file_name_no_ext)
+            manifest.set_entry(file_name_with_ext, self._new_manifest_entry(file_name_with_ext, output_format))
+        elif not os.path.exists(f"{file_name_no_ext}_first_ts.json") and os.path.exists(f"{file_name_no_ext}.aedat"): # Converted before it was saved
+            self._save_first_raw_ts(file_name_no_ext)
+
+        if is_own_manifest:
+            manifest.save()
+
+        if write_index and not os.path.exists(f"{file_name_no_ext}_index.npz"):
+            self.write_index_file(file_name_no_ext)
+
+    # ------------ CONVERSION MANIFEST METHODS ------------
+
+    def _is_conversion_up_to_date(self, file_name_with_ext: str, output_format: str, filter_parameters: dict, manifest: ConversionManifest) -> bool:
+
+        """
+        Check the manifest and remove outdated outputs of .aedat file that must be converted again
+        """
+
+        file_name_no_ext = file_name_with_ext[:len(file_name_with_ext)-6] # Remove .aedat from file name
+        events_file_dir = self._get_events_file_dir(file_name_no_ext, output_format)
+        if not os.path.exists(file_name_with_ext): # Nothing to convert again, the outputs are all that is left
+            return os.path.exists(events_file_dir)
+
+        file_stat = os.stat(file_name_with_ext)
+        entry = manifest.get_entry(file_name_with_ext)
+
+        is_up_to_date = False
+        if self._read_output_format(file_name_no_ext) == output_format and self._read_filter_parameters(file_name_no_ext) == filter_parameters:
+            if entry is None: # Converted before the manifest existed: only trusted if written after the .aedat file
+                if os.stat(events_file_dir).st_mtime_ns >= file_stat.st_mtime_ns:
+                    manifest.set_entry(file_name_with_ext, self._new_manifest_entry(file_name_with_ext, output_format))
+                    is_up_to_date = True
+            elif entry["decoder_version"] == self._DECODER_VERSION and entry["output_format"] == output_format:
+                if entry["size"] == file_stat.st_size and entry["mtime_ns"] == file_stat.st_mtime_ns:
+                    is_up_to_date = True
+                elif entry["size"] == file_stat.st_size and entry["hash"] == fast_file_hash(file_name_with_ext):
+                    manifest.set_entry(file_name_with_ext, self._new_manifest_entry(file_name_with_ext, output_format, entry["hash"])) # Only touched or copied
+                    is_up_to_date = True
+
+        if not is_up_to_date:
+            for output_file_dir in (f"{file_name_no_ext}_events.npy", f"{file_name_no_ext}_events.evz", f"{file_name_no_ext}_index.npz",
+                                    f"{file_name_no_ext}_filter.json", f"{file_name_no_ext}_first_ts.json"):
+                if os.path.exists(output_file_dir):
+                    os.remove(output_file_dir)
+
+        return is_up_to_date
+
+    def _read_output_format(self, file_name_no_ext: str) -> str:
+
+        """
+        Return the format of a readable _events.npy or _events.evz file, or None if both are missing or truncated
+        """
+
+        try:
+            event_data = np.load(f"{file_name_no_ext}_events.npy", mmap_mode = "r") # Fails if the file is shorter than its header says
+            return "structured" if event_data.dtype.names else "matrix"
+        except Exception:
+            pass
+
+        try:
+            CompressedEventReader(f"{file_name_no_ext}_events.evz") # Fails if the chunk index was never written
+            return "compressed"
+        except Exception:
+            return None
+
+    def _read_filter_parameters(self, file_name_no_ext: str) -> dict:
+
+        """
+        Return the filter parameters recorded in the _filter.json file, or None if the events were not filtered
+        """
+
+        try:
+            with open(f"{file_name_no_ext}_filter.json") as json_file:
+                return json.load(json_file)["parameters"]
+        except Exception:
+            return None
+
+    def _new_manifest_entry(self, file_name_with_ext: str, output_format: str, content_hash: str = None) -> dict:
+
+        """
+        Create the manifest entry of a converted .aedat file
+        """
+
+        file_stat = os.stat(file_name_with_ext)
+
+        return {"size": file_stat.st_size, "mtime_ns": file_stat.st_mtime_ns,
+                "hash": content_hash if content_hash is not None else fast_file_hash(file_name_with_ext),
+                "decoder_version": self._DECODER_VERSION, "output_format": output_format}
+
+    def _save_aedat_to_npy(self, file_name_no_ext: str, engine: str, output_format: str, event_filter = None) -> None:
+
+        """
+        Decode the whole .aedat file in memory and save it into .npy file
+        """
+
+        try:
+            x,y,ts,pol = self.decode_aedat_file(f"{file_name_no_ext}.aedat",False,engine)
+        except Exception: 
+            raise
+        
+        self._check_ts_limit(ts)
+        if event_filter is not None:
+            chunks = [(x,y,ts,pol)]
+            x,y,ts,pol = next(self._filter_chunks(lambda: chunks, event_filter))
+        try:
+            array_events = self._new_event_array(None, len(ts), output_format)
+            self._write_event_columns(array_events, 0, x, y, ts, pol)
+        except Exception as error:
+            raise OSError(f"Unable to build the event array of {file_name_no_ext}.aedat: {error}")
+        
+        self._save_atomically(f"{file_name_no_ext}_events.npy", lambda npy_file: np.save(npy_file, array_events))
+
+    def _get_events_file_dir(self, file_name_no_ext: str, output_format: str = None) -> str:
+
+        """
+        Return the _events.evz file of the compressed format and the _events.npy file of the others
+
+        Without output_format, return whichever of the two exists, .npy first
+        """
+
+        if output_format is None:
+            output_format = "compressed" if not os.path.exists(f"{file_name_no_ext}_events.npy") and os.path.exists(f"{file_name_no_ext}_events.evz") else "matrix"
+
+        return f"{file_name_no_ext}_events.evz" if output_format == "compressed" else f"{file_name_no_ext}_events.npy"
+
+    # ------------ COMPRESSED AEDAT TO EVZ METHOD ------------
+
+    def _save_aedat_to_evz(self, file_name_no_ext: str, engine: str, streaming: bool, chunk_events: int, event_filter = None) -> None:
+
+        """
+        Decode .aedat file and save event data into a chunked, compressed .evz file
+        """
+
+        get_chunks = lambda: self._iter_aedat_chunks(file_name_no_ext, engine, streaming, chunk_events)
+        if not streaming:
+            chunks = list(get_chunks()) # Decoded once, even if the filter needs two passes
+            get_chunks = lambda: chunks
+
+        with CompressedEventWriter(f"{file_name_no_ext}_events.evz", self._CODEC) as writer:
+            for x,y,ts,pol in (get_chunks() if event_filter is None else self._filter_chunks(get_chunks, event_filter)):
+                writer.append(x, y, ts, pol)
+
+    def _iter_aedat_chunks(self, file_name_no_ext: str, engine: str, streaming: bool, chunk_events: int):
+
+        """
+        Decode .aedat file and yield its events as x,y,ts,pol chunks with ts starting from 0
+
+        Only AEDAT 2.0 files are streamed, any other file is decoded in memory and yielded as a single chunk
+        """
+
+        if chunk_events < 1:
+            raise ValueError("The chunk size must be at least 1 event")
+
+        file_name_with_ext = f"{file_name_no_ext}.aedat"
+        try:
+            aer_file = open(file_name_with_ext, 'rb')
+        except OSError:
+            raise OSError("File not found.")
+        with aer_file:
+            header = self._header_parser.parse_header(aer_file)
+
+        if not streaming or header["version"] != "2.0":
+            x,y,ts,pol = self.decode_aedat_file(file_name_with_ext, False, engine)
+            self._check_ts_limit(ts)
+            yield x,y,ts,pol
+            return
+
+        # Decode the memory-mapped .aedat file chunk by chunk, so memory use does not grow with the file
+        self._safe_io.print_info(f"Processing file {file_name_with_ext}")
+        n_events = self._count_decoded_events(os.stat(file_name_with_ext).st_size - header["header_length"])
+        if n_events == 0:
+            raise IndexError("The .aedat file is empty")
+        raw_events = np.memmap(file_name_with_ext, dtype = ">u4", mode = "r", offset = header["header_length"], shape = (n_events, 2))
+
+        first_ts = None
+        for start in range(0, n_events, chunk_events):
+            x,y,ts,pol = self._decode_raw_events(raw_events[start:start+chunk_events])
+            if len(ts) == 0:
+                continue
+            first_ts = int(ts[0]) if first_ts is None else first_ts
+            ts -= first_ts # start ts array always from 0
+            self._check_ts_limit(ts)
+            yield x,y,ts,pol
+        if first_ts is None:
+            raise IndexError("The .aedat file is empty")
+
+    # ------------ FILTERED AEDAT TO NPY METHODS ------------
+
+    def _filter_chunks(self, get_chunks, event_filter):
+
+        """
+        Run both passes of event_filter over the chunks returned by get_chunks() and yield the kept events as x,y,ts,pol
+
+        ts keeps starting from the first decoded event, so the timestamps of the _labels.csv file still apply
+        """
+
+        event_filter.reset()
+        if event_filter.get_parameters()["hot_pixel_sigma"] is not None: # First pass: event count of every pixel
+            for x,y,ts,_ in get_chunks():
+                event_filter.add_to_pixel_counts(x, y, ts)
+            event_filter.find_hot_pixels()
+
+        for x,y,ts,pol in get_chunks():
+            yield event_filter.filter_events(x, y, ts, pol)
+
+    def _stream_filtered_aedat_to_npy(self, file_name_no_ext: str, engine: str, chunk_events: int, output_format: str, event_filter) -> None:
+
+        """
+        Decode and filter .aedat file in chunks, then copy the kept events into a memory-mapped .npy file
+        """
+
+        npy_file_dir = f"{file_name_no_ext}_events.npy"
+        tmp_file_dir = f"{npy_file_dir}.tmp" # Renamed to npy_file_dir once every event is copied
+        records_file_dir = f"{npy_file_dir}.records.tmp" # The number of kept events is only known at the end
+
+        try:
+            with open(records_file_dir, "wb") as records_file:
+                get_chunks = lambda: self._iter_aedat_chunks(file_name_no_ext, engine, True, chunk_events)
+                for x,y,ts,pol in self._filter_chunks(get_chunks, event_filter):
+                    records = np.empty(len(ts), dtype = self._EVENT_DTYPE)
+                    records["x"], records["y"], records["ts"], records["p"] = x, y, ts, pol
+                    records_file.write(records.tobytes())
+
+            n_kept = os.stat(records_file_dir).st_size // self._EVENT_DTYPE.itemsize
+            records = np.memmap(records_file_dir, dtype = self._EVENT_DTYPE, mode = "r") if n_kept else np.zeros(0, dtype = self._EVENT_DTYPE)
+            array_events = self._new_event_array(tmp_file_dir, n_kept, output_format)
+            for start in range(0, n_kept, chunk_events):
+                chunk = records[start:start+chunk_events]
+                self._write_event_columns(array_events, start, chunk["x"], chunk["y"], chunk["ts"], chunk["p"])
+            array_events.flush()
+            del array_events, records
+            os.replace(tmp_file_dir, npy_file_dir)
+        finally:
+            for file_dir in (records_file_dir, tmp_file_dir):
+                if os.path.exists(file_dir):
+                    os.remove(file_dir)
+
+    # ------------ STREAMING AEDAT TO NPY METHOD ------------
+
+    def _stream_aedat_to_npy(self, file_name_no_ext: str, chunk_events: int, n_workers: int, output_format: str) -> None:
+
+        """
+        Decode memory-mapped .aedat file in chunks straight into a memory-mapped .npy file
+        """
+
+        if chunk_events < 1:
+            raise ValueError("The chunk size must be at least 1 event")
+        if n_workers < 1:
+            raise ValueError("The number of workers must be at least 1")
+
+        file_name_with_ext = f"{file_name_no_ext}.aedat"
+        npy_file_dir = f"{file_name_no_ext}_events.npy"
+        tmp_file_dir = f"{npy_file_dir}.tmp" # Renamed to npy_file_dir once every shard is written
+
+        try:
+            aer_file = open(file_name_with_ext, 'rb')
+        except OSError:
+            raise OSError("File not found.")
+
+        with aer_file:
+            header = self._header_parser.parse_header(aer_file)
+        if header["version"] != "2.0": # Packets of newer formats are not aligned to fixed-size events
+            self._save_aedat_to_npy(file_name_no_ext, "numpy", output_format)
+            return
+
+        length_file = os.stat(file_name_with_ext).st_size
+        self._safe_io.print_info(f"Processing file {file_name_with_ext}")
+
+        header_length = header["header_length"]
+        n_events = self._count_decoded_events(length_file - header_length)
+        if n_events == 0:
+            raise IndexError("The .aedat file is empty")
+
+        shards = self._split_into_shards(n_events, n_workers)
+
+        # First pass: count polarity events and find the first timestamp of every shard
+        shard_counts = self._map_shards(_count_aedat_shard, [(file_name_with_ext, header_length, start, n_shard, chunk_events)
+                                                             for start, n_shard in shards], n_workers)
+        n_polarity = sum(n_shard_polarity for n_shard_polarity, _ in shard_counts)
+        if n_polarity == 0:
+            raise IndexError("The .aedat file is empty")
+        first_ts = next(shard_first_ts for _, shard_first_ts in shard_counts if shard_first_ts is not None) # Global first timestamp
+
+        # Second pass: decode every shard directly into its own range of the output file
+        try:
+            array_events = self._new_event_array(tmp_file_dir, n_polarity, output_format)
+            del array_events # Flush header and allocate file before the workers open it
+        except Exception:
+            raise OSError(f"Unable to save data to {npy_file_dir}")
+
+        out_starts = np.cumsum([0] + [n_shard_polarity for n_shard_polarity, _ in shard_counts[:-1]])
+        try:
+            self._map_shards(_write_aedat_shard, [(file_name_with_ext, header_length, start, n_shard, chunk_events, tmp_file_dir, int(out_start), first_ts)
+                                                  for (start, n_shard), out_start in zip(shards, out_starts)], n_workers)
+            last_ts = int(self._get_ts_column(np.load(tmp_file_dir, mmap_mode = "r"))[-1])
+            os.replace(tmp_file_dir, npy_file_dir)
+        except Exception:
+            os.remove(tmp_file_dir)
+            raise
+
+        print ("read %i (~ %.2fM) AE events, duration= %.2fs" % (n_polarity, n_polarity / float(10 ** 6), last_ts * 0.000001))
+
+    def _split_into_shards(self, n_events: int, n_shards: int) -> list[tuple[int,int]]:
+
+        """
+        Split the events of a payload into (first event, number of events) ranges aligned to 8 bytes
+        """
+
+        bounds = np.linspace(0, n_events, min(n_shards, n_events) + 1).astype(np.int64)
+
+        return [(int(start), int(end - start)) for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def _map_shards(self, function, list_arguments: list[tuple], n_workers: int) -> list:
+
+        """
+        Run function over the arguments of every shard, in a process pool if n_workers > 1
+        """
+
+        if n_workers == 1 or len(list_arguments) == 1:
+            return [function(*arguments) for arguments in list_arguments]
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers = min(n_workers, len(list_arguments))) as executor:
+            futures = [executor.submit(function, *arguments) for arguments in list_arguments]
+            return [future.result() for future in futures]
+
+    def _count_polarity_events(self, raw_events: np.ndarray, chunk_events: int) -> tuple[int,int]:
+
+        """
+        Count polarity events in chunks and return the count and the first raw timestamp
+        """
+
+        n_polarity = 0
+        first_ts = None
+        for start in range(0, len(raw_events), chunk_events):
+            address = raw_events[start:start+chunk_events, 0]
+            is_polarity_event = (address >> self._SHIFT[3]) == self._MASK[3]
+            if first_ts is None and is_polarity_event.any():
+                first_ts = int(raw_events[start + np.argmax(is_polarity_event), 1])
+            n_polarity += int(np.count_nonzero(is_polarity_event))
+
+        return n_polarity, first_ts
+
+    def _write_polarity_events(self, raw_events: np.ndarray, array_events: np.ndarray, out_pos: int, first_ts: int, chunk_events: int) -> None:
+
+        """
+        Decode chunks of raw events into array_events starting at column out_pos
+        """
+
+        for start in range(0, len(raw_events), chunk_events):
+            x,y,ts,pol = self._decode_raw_events(raw_events[start:start+chunk_events])
+            ts -= first_ts # start ts array always from 0
+            self._check_ts_limit(ts)
+            out_pos = self._write_event_columns(array_events, out_pos, x, y, ts, pol)
+
+    # ------------ ATOMIC SAVE METHOD ------------
+
+    def _save_atomically(self, file_dir: str, save_function) -> None:
+
+        """
+        Save file through a temporary file that is renamed, so file_dir is never left half-written
+        """
+
+        tmp_file_dir = f"{file_dir}.tmp"
+        try:
+            with open(tmp_file_dir, "wb") as tmp_file:
+                save_function(tmp_file)
+            os.replace(tmp_file_dir, file_dir)
+        except Exception:
+            if os.path.exists(tmp_file_dir):
+                os.remove(tmp_file_dir)
+            raise OSError(f"Unable to save data to {file_dir}")
+
+    # ------------ EVENT ARRAY FORMAT METHODS ------------
+
+    def _check_ts_limit(self, ts: np.ndarray) -> None:
+
+        """
+        Raise OSError if the timestamps (from 0) do not fit the int32 ts of the output formats
+        """
+
+        if len(ts) and np.max(ts) > self._MAX_TS:
+            raise OSError(f"Recording longer than 2^31 us (~{self._MAX_TS/60e6:.1f} min): its timestamps do not fit the int32 ts of _events files. Split the recording into shorter takes.")
+
+    def _new_event_array(self, npy_file_dir: str, n_events: int, output_format: str) -> np.ndarray:
+
+        """
+        Allocate an event array in the given format, memory-mapped to npy_file_dir if given
+        """
+
+        if output_format == "matrix":
+            dtype, shape = np.dtype("int32"), (4, n_events) # ts is int32, see _check_ts_limit
+        else:
+            dtype, shape = self._EVENT_DTYPE, (n_events,)
+
+        if npy_file_dir is None:
+            return np.empty(shape, dtype = dtype)
+        return np.lib.format.open_memmap(npy_file_dir, mode = "w+", dtype = dtype, shape = shape)
+
+    def _write_event_columns(self, array_events: np.ndarray, out_pos: int, x, y, ts, pol) -> int:
+
+        """
+        Write x,y,ts,pol into array_events starting at event out_pos and return the next position
+        """
+
+        end_pos = out_pos + len(ts)
+        if array_events.dtype.names: # Structured format
+            array_events["x"][out_pos:end_pos] = x
+            array_events["y"][out_pos:end_pos] = y
+            array_events["ts"][out_pos:end_pos] = ts
+            array_events["p"][out_pos:end_pos] = pol
+        else: # 4xN matrix format
+            array_events[0, out_pos:end_pos] = x
+            array_events[1, out_pos:end_pos] = y
+            array_events[2, out_pos:end_pos] = ts
+            array_events[3, out_pos:end_pos] = pol
+
+        return end_pos
+
+    def _get_event_columns(self, event_data: np.ndarray) -> list[np.ndarray]:
+
+        """
+        Return x,y,ts,pol views of an event array in either format
+        """
+
+        if event_data.dtype.names: # Structured format
+            return event_data["x"], event_data["y"], event_data["ts"], event_data["p"]
+
+        return event_data[0][:], event_data[1][:], event_data[2][:], event_data[3][:]
+
+    def _get_ts_column(self, event_data: np.ndarray) -> np.ndarray:
+
+        """
+        Return the ts view of an event array in either format
+        """
+
+        return self._get_event_columns(event_data)[2]
 
     # ------------ DECODE AEDAT FILE METHOD ------------
 
-    def decode_aedat_file(self, file_name_with_ext: str, only_first_event: bool) -> list[list[int]]:
+    def decode_aedat_file(self, file_name_with_ext: str, only_first_event: bool, engine: str = "numpy") -> list[list[int]]:
         
         """
         Read .aedat file and output event data as x,y,ts,pol
         """
 
+        if engine not in self._ENGINES:
+            raise ValueError(f"Unknown decoding engine {engine}. Choose one of {self._ENGINES}")
+
+        if engine == "numpy":
+            x,y,ts,pol = self._decode_aedat_numpy(file_name_with_ext, only_first_event)
+        else:
+            x,y,ts,pol = self._decode_aedat_reference(file_name_with_ext, only_first_event)
+
+        ts = np.subtract(ts,ts[0]) # start ts array always from 0
+
+        try:
+            print ("read %i (~ %.2fM) AE events, duration= %.2fs" % (len(ts), len(ts) / float(10 ** 6), (ts[-1] - ts[0]) * 0.000001))
+            n = 5
+            print ("showing first %i:" % (n))
+            print ("timestamps: %s \nX-addr: %s\nY-addr: %s\npolarity: %s" % (ts[0:n], x[0:n], y[0:n], pol[0:n]))
+        except:
+            print ("failed to print statistics")
+
+        return x,y,ts,pol
+
+    # ------------ PROBE AEDAT FILE METHOD ------------
+
+    def probe_aedat_file(self, file_name_with_ext: str) -> dict:
+
+        """
+        Read header length, first and last raw timestamps and approximate event count of .aedat file
+        """
+
+        try:
+            aer_file = open(file_name_with_ext, 'rb')
+        except OSError:
+            raise OSError("File not found.")
+
+        with aer_file:
+            header = self._header_parser.parse_header(aer_file)
+            header_length = header["header_length"]
+            if header["version"] == "2.0":
+                n_events = self._count_decoded_events(os.fstat(aer_file.fileno()).st_size - header_length)
+                first_ts = self._header_parser.get_decoder(header).decode(aer_file, True)[2]
+                last_ts = self._find_last_event(aer_file, header_length, n_events)[2]
+            else: # Packets have to be walked from the start
+                ts = self._header_parser.get_decoder(header).decode(aer_file, False)[2]
+                first_ts, last_ts, n_events = ts[:1], ts[-1:], len(ts)
+
+        return {"header_length": header_length,
+                "first_ts": int(first_ts[0]) if len(first_ts) else None, # Raw timestamps (us), None if there are no events
+                "last_ts": int(last_ts[0]) if len(last_ts) else None,
+                "n_events": n_events} # Including special events in AEDAT 2.0 files
+
+    # ------------ NUMPY DECODING ENGINE ------------
+
+    def _decode_aedat_numpy(self, file_name_with_ext: str, only_first_event: bool) -> list[np.ndarray]:
+
+        """
+        Decode the whole .aedat payload at once with array operations
+        """
+
+        try:
+            aer_file = open(file_name_with_ext, 'rb')
+        except OSError:
+            raise OSError("File not found.")
+
+        self._safe_io.print_info(f"Processing file {file_name_with_ext}")
+
+        with aer_file:
+            header = self._header_parser.parse_header(aer_file)
+            return self._header_parser.get_decoder(header).decode(aer_file, only_first_event)
+
+    def _find_last_event(self, aer_file, header_length: int, n_events: int) -> list[np.ndarray]:
+
+        """
+        Decode the last non-special event of an open .aedat file without normalizing ts
+        """
+
+        # Read small blocks backwards from the end until a non-special event shows up
+        while n_events > 0:
+            n_block = min(n_events, self._FIRST_EVENT_BLOCK)
+            n_events -= n_block
+            aer_file.seek(header_length + n_events * self._N_BYTES)
+            x,y,ts,pol = self._decode_events(aer_file.read(n_block * self._N_BYTES))
+            if len(ts):
+                return x[-1:],y[-1:],ts[-1:],pol[-1:]
+
+        return self._decode_events(b"")
+
+    def _count_decoded_events(self, payload_length: int) -> int:
+
+        """
+        Return the number of 8-byte events decoded from a payload of the given length
+        """
+
+        return self._aedat2_decoder.count_events(payload_length)
+
+    def _decode_events(self, aer_raw_data: bytes) -> list[np.ndarray]:
+
+        """
+        Decode a buffer of big-endian (address, timestamp) pairs into x,y,ts,pol
+        """
+
+        return self._aedat2_decoder.decode_buffer(aer_raw_data)
+
+    def _decode_raw_events(self, raw_events: np.ndarray) -> list[np.ndarray]:
+
+        """
+        Decode an array of (address, timestamp) rows into x,y,ts,pol
+        """
+
+        return self._aedat2_decoder.decode_raw_events(raw_events)
+
+    # ------------ REFERENCE DECODING ENGINE ------------
+
+    def _decode_aedat_reference(self, file_name_with_ext: str, only_first_event: bool) -> list[list[int]]:
+
+        """
+        Decode the .aedat payload one event at a time (reference implementation)
+        """
+
         x = []
         y = []
         ts = []
@@ -78,6 +677,11 @@ class FileManager:
         length_file = os.stat(file_name_with_ext).st_size 
         self._safe_io.print_info(f"Processing file {file_name_with_ext}")
 
+        if self._header_parser.parse_header(aer_file)["version"] != "2.0":
+            aer_file.close()
+            raise ValueError("The reference engine only decodes AEDAT 2.0 files")
+        aer_file.seek(0)
+
         bytes_pos = 0
         line = aer_file.readline()
         while line and line[0:1] == b'#': # Ignore ASCII header
@@ -105,59 +709,263 @@ class FileManager:
             aer_raw_data = aer_file.read(self._N_BYTES)
             bytes_pos += self._N_BYTES
 
-        ts = np.subtract(ts,ts[0]) # start ts array always from 0
-
-        try:
-            print ("read %i (~ %.2fM) AE events, duration= %.2fs" % (len(ts), len(ts) / float(10 ** 6), (ts[-1] - ts[0]) * 0.000001))
-            n = 5
-            print ("showing first %i:" % (n))
-            print ("timestamps: %s \nX-addr: %s\nY-addr: %s\npolarity: %s" % (ts[0:n], x[0:n], y[0:n], pol[0:n]))
-        except:
-            print ("failed to print statistics")
+        aer_file.close()
 
         return x,y,ts,pol
 
     # ------------ MOVE AEDAT FILE METHOD ------------
 
-    def move_aedat_file(self, byte_string:bytes, task_name:str, current_attempt:int, primitive:str) -> str:
+    def move_aedat_file(self, jaer_file_dir:str, task_name:str, current_attempt:int, primitive:str) -> str:
         
         """
         Move .aedat file from jAER folder to recorded_data folder
         """
 
-        out_file_dir = byte_string[0].rsplit(b"file ")
-        out_file_dir = out_file_dir[1].split(b"\n")
-        out_file_dir = out_file_dir[0].decode()
-        
         if primitive:
             aedat_file_dir = os.path.join(self._OUTPUT_DIR, primitive, f"{task_name}_{current_attempt}.aedat")
         else:
             aedat_file_dir = os.path.join(self._OUTPUT_DIR, f"{task_name}_{current_attempt}.aedat")
         
-        shutil.move(out_file_dir, aedat_file_dir)
+        shutil.move(jaer_file_dir, aedat_file_dir)
 
         return aedat_file_dir
 
     # ------------ READ FROM NPY FILE METHOD ------------
     
-    def read_npy_file(self,file_name_no_ext:str) -> list[list[int]]:
+    def read_npy_file(self,file_name_no_ext:str, lazy:bool = False) -> list[list[int]]:
 
         """
-        Read .npy file and output event data as x,y,ts,pol
+        Read .npy (or .evz) file and output event data as x,y,ts,pol
+
+        .evz files are always decoded in full, lazy only applies to .npy files
         """
-            
+
+        if self._get_events_file_dir(file_name_no_ext).endswith(".evz"):
+            return CompressedEventReader(f"{file_name_no_ext}_events.evz").read_events()
+
         try:
-            event_data = np.load(f"{file_name_no_ext}_events.npy")
+            event_data = np.load(f"{file_name_no_ext}_events.npy", mmap_mode = "r" if lazy else None) # Lazy: views on the memory-mapped file
         except Exception:
             raise OSError("File not found.")
 
-        x = event_data[0][:]
-        y = event_data[1][:]
-        ts = event_data[2][:]
-        pol = event_data[3][:]
+        x,y,ts,pol = self._get_event_columns(event_data) # Detects matrix or structured format
         
         return x,y,ts,pol
 
+    def iter_npy_file(self, file_name_no_ext:str, chunk_events:int = None):
+
+        """
+        Read .npy (or .evz) file in chunks and yield event data as x,y,ts,pol
+        """
+
+        chunk_events = self._CHUNK_EVENTS if chunk_events is None else chunk_events
+        if chunk_events < 1:
+            raise ValueError("The chunk size must be at least 1 event")
+
+        if self._get_events_file_dir(file_name_no_ext).endswith(".evz"): # Whole .evz chunks, so sizes are approximate
+            yield from CompressedEventReader(f"{file_name_no_ext}_events.evz").iter_events(chunk_events)
+            return
+
+        x,y,ts,pol = self.read_npy_file(file_name_no_ext, True)
+        for start in range(0, len(ts), chunk_events):
+            end = start + chunk_events
+            yield np.asarray(x[start:end]), np.asarray(y[start:end]), np.asarray(ts[start:end]), np.asarray(pol[start:end])
+
+    # ------------ READ TIME WINDOW FROM NPY FILE METHOD ------------
+
+    def read_npy_window(self, file_name_no_ext:str, t0:int, t1:int) -> list[np.ndarray]:
+
+        """
+        Read the events of .npy file with t0 <= ts < t1 as x,y,ts,pol
+        """
+
+        if self._get_events_file_dir(file_name_no_ext).endswith(".evz"): # Only the chunks that overlap the window are decoded
+            return CompressedEventReader(f"{file_name_no_ext}_events.evz").read_window(t0, t1)
+
+        x,y,ts,pol = self.read_npy_file(file_name_no_ext, True)
+        start, end = self._find_window(ts, t0, t1, self._load_index_file(file_name_no_ext))
+
+        return x[start:end], y[start:end], ts[start:end], pol[start:end]
+
+    def _find_window(self, ts:np.ndarray, t0:int, t1:int, index:dict = None) -> tuple[int,int]:
+
+        """
+        Binary search the sorted ts column for the event range [t0, t1)
+        """
+
+        lo, hi = self._get_index_bounds(index, t0, len(ts))
+        start = lo + int(np.searchsorted(ts[lo:hi], t0, side = "left"))
+        lo, hi = self._get_index_bounds(index, t1, len(ts))
+        end = lo + int(np.searchsorted(ts[lo:hi], t1, side = "left"))
+
+        return start, max(start, end)
+
+    # ------------ TIME INDEX METHODS ------------
+
+    def write_index_file(self, file_name_no_ext:str, bin_us:int = None) -> None:
+
+        """
+        Write time index and label event ranges of .npy file to _index.npz file
+
+        Without the first raw timestamp the label times cannot be placed, so label_ranges is left empty and
+        label_origin_known is False. The time index does not depend on it and is always written
+        """
+
+        bin_us = self._INDEX_BIN_US if bin_us is None else bin_us
+        if bin_us < 1:
+            raise ValueError("The index interval must be at least 1 us")
+
+        x,y,ts,pol = self.read_npy_file(file_name_no_ext, True)
+
+        # offsets[k] is the number of events with ts < k*bin_us, i.e. the index of the first event of bin k
+        counts = np.zeros(0, dtype = np.int64)
+        for start in range(0, len(ts), self._CHUNK_EVENTS):
+            chunk_counts = np.bincount(np.clip(ts[start:start+self._CHUNK_EVENTS], 0, None) // bin_us)
+            if len(chunk_counts) > len(counts):
+                counts = np.pad(counts, (0, len(chunk_counts) - len(counts)))
+            counts[:len(chunk_counts)] += chunk_counts
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+
+        label_ranges, first_ts = self._get_label_ranges(file_name_no_ext, ts, {"bin_us": bin_us, "offsets": offsets})
+        if first_ts is None:
+            self._safe_io.print_warning(f"First timestamp of {file_name_no_ext} not found. Its index is written without label ranges.")
+
+        self._save_atomically(f"{file_name_no_ext}_index.npz", lambda index_file: np.savez(index_file, bin_us = bin_us,
+                                                                                            first_ts = -1 if first_ts is None else first_ts,
+                                                                                            label_origin_known = first_ts is not None,
+                                                                                            offsets = offsets, label_ranges = label_ranges))
+        self._index_cache.pop(file_name_no_ext, None)
+
+    def read_label_events(self, file_name_no_ext:str, label_row:int) -> list[np.ndarray]:
+
+        """
+        Read the events of one row of the _labels.csv file as x,y,ts,pol
+        """
+
+        index = self._load_index_file(file_name_no_ext)
+        if index is None:
+            raise OSError(f"Index file {file_name_no_ext}_index.npz not found. Create it with write_index_file.")
+        if not index.get("label_origin_known", True): # Index files written before the flag always had a known origin
+            raise OSError(f"First timestamp of {file_name_no_ext} not found, so its labels cannot be aligned. "
+                          f"Convert its .aedat file again with aedat_to_npy.")
+        if not -len(index["label_ranges"]) <= label_row < len(index["label_ranges"]):
+            raise IndexError(f"Label row {label_row} out of range for {len(index['label_ranges'])} label(s)")
+
+        _, start, end = index["label_ranges"][label_row]
+        x,y,ts,pol = self.read_npy_file(file_name_no_ext, True)
+
+        return x[start:end], y[start:end], ts[start:end], pol[start:end]
+
+    def _get_label_ranges(self, file_name_no_ext:str, ts:np.ndarray, index:dict = None) -> tuple[np.ndarray,int]:
+
+        """
+        Return the label,start,end event ranges of the _labels.csv rows and the first raw timestamp
+
+        If the first raw timestamp is unknown, return no ranges and None
+        """
+
+        first_ts = self._get_first_raw_ts(file_name_no_ext)
+        label_ranges = []
+        if first_ts is None:
+            return np.zeros((0, 3), dtype = np.int64), None
+        for label, t0, t1 in self._read_labels(file_name_no_ext):
+            start, end = self._find_window(ts, t0 - first_ts, t1 - first_ts, index)
+            label_ranges.append([label, start, end])
+
+        return np.array(label_ranges, dtype = np.int64).reshape(-1, 3), first_ts
+
+    def _get_first_raw_ts(self, file_name_no_ext:str) -> int:
+
+        """
+        Return the raw .aedat timestamp of the first event, saved next to the events at conversion time
+
+        Return None if neither the _first_ts.json file nor the .aedat file exists
+        """
+
+        # Label times are raw .aedat timestamps, while the .npy ts column starts from 0
+        json_file_dir = f"{file_name_no_ext}_first_ts.json"
+        if os.path.exists(json_file_dir):
+            with open(json_file_dir) as json_file:
+                return int(json.load(json_file)["first_ts"])
+        if os.path.exists(f"{file_name_no_ext}.aedat"):
+            return self._read_first_raw_ts(f"{file_name_no_ext}.aedat")
+
+        return None
+
+    def _save_first_raw_ts(self, file_name_no_ext:str) -> None:
+
+        """
+        Save the raw timestamp of the first event of the .aedat file to the _first_ts.json file
+        """
+
+        first_ts = self._read_first_raw_ts(f"{file_name_no_ext}.aedat")
+        self._save_atomically(f"{file_name_no_ext}_first_ts.json", lambda json_file: json_file.write(json.dumps({"first_ts": first_ts}).encode()))
+
+    def _read_first_raw_ts(self, file_name_with_ext:str) -> int:
+
+        """
+        Decode only the first event of .aedat file and return its raw timestamp
+        """
+
+        try:
+            aer_file = open(file_name_with_ext, 'rb')
+        except OSError:
+            raise OSError("File not found.")
+
+        with aer_file:
+            header = self._header_parser.parse_header(aer_file)
+            ts = self._header_parser.get_decoder(header).decode(aer_file, True)[2]
+        if len(ts) == 0:
+            raise IndexError("The .aedat file is empty")
+
+        return int(ts[0])
+
+    def _load_index_file(self, file_name_no_ext:str) -> dict:
+
+        """
+        Load (and cache) the _index.npz file of .npy file, or return None if there is none
+        """
+
+        if file_name_no_ext not in self._index_cache:
+            if not os.path.exists(f"{file_name_no_ext}_index.npz"):
+                return None
+            with np.load(f"{file_name_no_ext}_index.npz") as index_file:
+                self._index_cache[file_name_no_ext] = {key: index_file[key] for key in index_file.files}
+
+        return self._index_cache[file_name_no_ext]
+
+    def _get_index_bounds(self, index:dict, t:int, n_events:int) -> tuple[int,int]:
+
+        """
+        Return the (lo, hi) event range that must contain the first event with ts >= t
+        """
+
+        if index is None:
+            return 0, n_events
+
+        offsets = index["offsets"]
+        k = int(min(max(t // int(index["bin_us"]), 0), len(offsets) - 1))
+        lo = int(offsets[k]) if t >= 0 else 0
+        hi = int(offsets[k+1]) if k + 1 < len(offsets) else n_events
+
+        return lo, hi
+
+    def _read_labels(self, file_name_no_ext:str) -> list[list[int]]:
+
+        """
+        Read the rows of the _labels.csv file as label,start,end (label is -1 for rows without label)
+        """
+
+        csv_file_dir = f"{file_name_no_ext}_labels.csv"
+        if not os.path.exists(csv_file_dir) or os.stat(csv_file_dir).st_size == 0:
+            return []
+
+        rows = np.atleast_2d(np.loadtxt(csv_file_dir, delimiter = ",", dtype = np.int64))
+        if rows.shape[1] == 2: # Primitive recordings only store start and end
+            rows = np.column_stack((np.full(len(rows), -1), rows))
+
+        return rows.tolist()
+
     # ------------ WRITE CSV FILE METHOD ------------    
 
     def write_csv_file(self,timestamp_list:list[int],first_ts:int,csv_file_dir:str,with_labels:bool) -> None:
@@ -184,4 +992,39 @@ class FileManager:
             for i in range(n_labels):
                 times_csv.append([labels[i],timestamp_list[2*i]*(10**6)+first_ts, timestamp_list[(2*i)+1]*(10**6)+first_ts])
             np.savetxt(csv_file_dir, times_csv, delimiter = ", ", fmt = ["%d","%d","%d"])
-        
+
+    # ------------ WRITE TAKE REPORT METHOD ------------
+
+    def write_take_report(self, report:dict, json_file_dir:str) -> None:
+
+        """
+        Write timing report of a recorded take to .json file
+        """
+
+        self._save_atomically(json_file_dir, lambda json_file: json_file.write(json.dumps(report, indent = 1).encode()))
+
+# ------------ SHARD WORKERS ------------
+
+def _count_aedat_shard(file_name_with_ext: str, header_length: int, start: int, n_events: int, chunk_events: int) -> tuple[int,int]:
+
+    """
+    Count polarity events of one shard of an .aedat file
+    """
+
+    file_manager = FileManager(None)
+    raw_events = np.memmap(file_name_with_ext, dtype = ">u4", mode = "r", offset = header_length + start*file_manager._N_BYTES, shape = (n_events, 2))
+
+    return file_manager._count_polarity_events(raw_events, chunk_events)
+
+def _write_aedat_shard(file_name_with_ext: str, header_length: int, start: int, n_events: int, chunk_events: int,
+                       npy_file_dir: str, out_start: int, first_ts: int) -> None:
+
+    """
+    Decode one shard of an .aedat file into its range of the .npy file
+    """
+
+    file_manager = FileManager(None)
+    raw_events = np.memmap(file_name_with_ext, dtype = ">u4", mode = "r", offset = header_length + start*file_manager._N_BYTES, shape = (n_events, 2))
+    array_events = np.load(npy_file_dir, mmap_mode = "r+")
+    file_manager._write_polarity_events(raw_events, array_events, out_start, first_ts, chunk_events)
+    array_events.flush()
@@ -0,0 +1,247 @@
+from button_source import SimulatedButtonSource
+from capture_system import CaptureSystem
+from jaer_client import JaerClient
+from jaer_stub import JaerStub
+from live_monitor import LiveMonitor
+from safe_io import SafeIO
+
+import glob
+import json
+import numpy as np
+import os
+import socket
+import tempfile
+import time
+
+class ScriptedIO(SafeIO):
+
+    """
+    Methods for answering input prompts from a list instead of the terminal
+
+    Methods
+    -------
+    safe_input(text)
+        Print text and return the next scripted answer
+    """
+
+    def __init__(self, answers):
+
+        super().__init__()
+        self._answers = list(answers)
+
+    def safe_input(self, text:str) -> str:
+
+        """
+        Print text and return the next scripted answer
+        """
+
+        if not self._answers:
+            raise OSError(f"No scripted answer for prompt: {text}")
+        answer = self._answers.pop(0)
+        self.safe_print("\033[93m {}\033[00m {}".format(text, answer))
+
+        return answer
+
+class HeadlessRunner:
+
+    """
+    Methods for running scripted capture sessions with a simulated Arduino and jAER
+
+    Methods
+    -------
+    run_session(takes, task_name)
+        Record takes with CaptureSystem.capture() and measure button-to-label timing
+    summary_to_text(summary)
+        Format the summary of a session as text
+    """
+
+    def __init__(self, output_dir, buffer_time = 0, take_gap = 0.5, event_rate = 20000, reply_delay = 0.0, drop_rate = 0.0,
+                 delivery_delay = 0.0, delivery_jitter = 0.0, live_preview = False):
+
+        self._OUTPUT_DIR = output_dir
+        self._BUFFER_TIME = buffer_time
+        self._TAKE_GAP = take_gap # Time (s) between the end of a take and the next pedal press
+        self._EVENT_RATE = event_rate # Events per second written by the fake jAER
+        self._REPLY_DELAY = reply_delay
+        self._DROP_RATE = drop_rate
+        self._DELIVERY_DELAY = delivery_delay
+        self._DELIVERY_JITTER = delivery_jitter
+        self._LIVE_PREVIEW = live_preview # Stream the fake jAER events to a LiveMonitor
+
+    # ------------ RUN SESSION METHOD ------------
+
+    def run_session(self, takes:list[dict], task_name:str = "headless") -> dict:
+
+        """
+        Record takes with CaptureSystem.capture() and measure button-to-label timing
+
+        takes is a list of {"duration": s, "labels": [s after the start pedal, ...]}
+        """
+
+        first_attempt = len(glob.glob(os.path.join(self._OUTPUT_DIR, f"{task_name}_*.aedat"))) + 1
+        answers = [task_name] + [",".join(str(label + 1) for label in range(len(take["labels"]) + 1)) for take in takes]
+
+        button_source = SimulatedButtonSource(self._build_script(takes), delivery_delay = self._DELIVERY_DELAY,
+                                              delivery_jitter = self._DELIVERY_JITTER)
+        stream_port = self._get_free_port() if self._LIVE_PREVIEW else None
+        live_monitor = LiveMonitor(port = stream_port) if self._LIVE_PREVIEW else None
+        jaer_stub = JaerStub(log_dir = tempfile.mkdtemp(), reply_delay = self._REPLY_DELAY, drop_rate = self._DROP_RATE,
+                             event_rate = self._EVENT_RATE, stream_address = ("localhost", stream_port) if self._LIVE_PREVIEW else None)
+        jaer_stub.start()
+        jaer_client = JaerClient(*jaer_stub.get_address())
+        capture_system = CaptureSystem("Simulated", self._OUTPUT_DIR, self._BUFFER_TIME, jaer_client = jaer_client,
+                                       button_source = button_source, safe_io = ScriptedIO(answers), live_monitor = live_monitor)
+
+        errors = []
+        start_time = time.perf_counter()
+        try:
+            capture_system.capture("2") # Continuous mode, so every label is timed
+        except OSError as e:
+            if str(e) != "Exit program.":
+                errors.append(f"{type(e).__name__}: {e}")
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+        finally:
+            elapsed = time.perf_counter() - start_time
+            jaer_client.close()
+            jaer_stub.stop()
+
+        summary = self._get_summary(takes, task_name, first_attempt, button_source.get_press_log(), jaer_stub.get_logging_log())
+        summary["elapsed"] = elapsed
+        summary["errors"] = errors
+
+        return summary
+
+    def _get_free_port(self) -> int:
+
+        """
+        Return a UDP port that is free on localhost
+        """
+
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.bind(("localhost", 0))
+            return s.getsockname()[1]
+
+    def _build_script(self, takes:list[dict]) -> list[tuple]:
+
+        """
+        Turn the takes into (delay, button) presses: pedal, white per label, pedal, then red or white to quit
+        """
+
+        script = []
+        for i, take in enumerate(takes):
+            script.append((self._TAKE_GAP, "pedal_high"))
+            previous_time = 0.0
+            for label_time in sorted(take["labels"]):
+                script.append((label_time - previous_time, "white"))
+                previous_time = label_time
+            script.append((take["duration"] - previous_time, "pedal_high"))
+            script.append((self._TAKE_GAP / 2, "red" if i < len(takes) - 1 else "white"))
+
+        return script
+
+    # ------------ SUMMARY METHODS ------------
+
+    def _get_summary(self, takes:list[dict], task_name:str, first_attempt:int, press_log:list[dict], logging_log:list[dict]) -> dict:
+
+        """
+        Compare the recorded take reports and labels with the scripted presses
+        """
+
+        pedal_to_state_ms = []
+        pedal_to_ack_ms = []
+        label_error_ms = []
+        n_takes = 0
+
+        i_press = 0
+        for i, take in enumerate(takes):
+            file_name_no_ext = os.path.join(self._OUTPUT_DIR, f"{task_name}_{first_attempt + i}")
+            n_presses = len(take["labels"]) + 2
+            if not os.path.exists(f"{file_name_no_ext}_take.json") or i >= len(logging_log):
+                break
+            presses = press_log[i_press:i_press + n_presses]
+            i_press += n_presses + 1 # Red or white press after the take
+
+            with open(f"{file_name_no_ext}_take.json") as json_file:
+                report = json.load(json_file)
+
+            # Pedal press to the state change in the serial thread
+            state_ns = {transition["to"]: transition["time_ns"] for transition in report["state_transitions"]}
+            pedal_to_state_ms.append((state_ns["recording"] - presses[0]["edge_ns"]) / 1e6)
+            pedal_to_state_ms.append((state_ns["stopped"] - presses[-1]["edge_ns"]) / 1e6)
+
+            # Pedal press to the jAER acknowledgement
+            ack_time = {metric["command"]: metric["ack_time"] for metric in report["jaer_commands"]}
+            pedal_to_ack_ms.append((ack_time["startlogging"] - presses[0]["edge_time"]) * 1e3)
+            pedal_to_ack_ms.append((ack_time["stoplogging"] - presses[-1]["edge_time"]) * 1e3)
+
+            # Every label ends at a white press, the last one at the stop pedal
+            labels = np.loadtxt(f"{file_name_no_ext}_labels.csv", delimiter = ",", ndmin = 2)
+            for label, press in zip(labels, presses[1:]):
+                true_ts = (press["edge_time"] - logging_log[i]["start_time"]) * 1e6
+                label_error_ms.append((label[2] - true_ts) / 1e3)
+
+            n_takes += 1
+
+        return {"n_takes": n_takes,
+                "n_presses": len(press_log),
+                "pedal_to_state_ms": self._get_statistics(pedal_to_state_ms),
+                "pedal_to_ack_ms": self._get_statistics(pedal_to_ack_ms),
+                "label_error_ms": self._get_statistics(label_error_ms)}
+
+    def _get_statistics(self, values:list[float]) -> dict:
+
+        """
+        Return the count, mean, median, 95th percentile and maximum of values
+        """
+
+        if not values:
+            return {"n": 0}
+
+        values = np.asarray(values)
+        return {"n": len(values),
+                "mean": float(np.mean(values)),
+                "p50": float(np.percentile(values, 50)),
+                "p95": float(np.percentile(values, 95)),
+                "max": float(np.max(np.abs(values)))}
+
+    def summary_to_text(self, summary:dict) -> str:
+
+        """
+        Format the summary of a session as text
+        """
+
+        elapsed = max(summary["elapsed"], 1e-9)
+        text = (f"Recorded {summary['n_takes']} take(s) with {summary['n_presses']} press(es) in {summary['elapsed']:.2f} s "
+                f"({summary['n_takes']/elapsed*60:.1f} takes/min)\n")
+        for key, name in (("pedal_to_state_ms", "Pedal to state change"), ("pedal_to_ack_ms", "Pedal to jAER ack"),
+                          ("label_error_ms", "Label error")):
+            statistics = summary[key]
+            if statistics["n"]:
+                text += (f"{name}: mean {statistics['mean']:.3f} ms, p50 {statistics['p50']:.3f} ms, "
+                         f"p95 {statistics['p95']:.3f} ms, max |{statistics['max']:.3f}| ms\n")
+        for error in summary["errors"]:
+            text += f"Failed: {error}\n"
+
+        return text
+
+# ------------ RUN HEADLESS SESSION ------------
+
+if __name__ == "__main__":
+
+    OUTPUT_DIR = tempfile.mkdtemp(prefix = "headless_") # Takes are written here, not to test_data
+    N_TAKES = 5
+    TAKE_DURATION = 2.0 # Time (sec) between the start and stop pedal presses
+    N_LABELS = 3 # White presses per take, evenly spaced
+    DELIVERY_JITTER = 0.002 # Maximum random serial delay (sec), removed by the clock synchronization
+
+    safe_io = SafeIO()
+    runner = HeadlessRunner(OUTPUT_DIR, delivery_jitter = DELIVERY_JITTER)
+    takes = [{"duration": TAKE_DURATION, "labels": [TAKE_DURATION * (j + 1) / (N_LABELS + 1) for j in range(N_LABELS)]}
+             for _ in range(N_TAKES)]
+    summary = runner.run_session(takes)
+
+    with open(os.path.join(OUTPUT_DIR, "headless_session.json"), "w") as json_file:
+        json.dump(summary, json_file, indent = 1)
+    safe_io.print_info(runner.summary_to_text(summary))
+    safe_io.print_success(f"Session files were written to {OUTPUT_DIR}")
@@ -0,0 +1,132 @@
+import socket
+import time
+
+class JaerClient:
+
+    """
+    Methods for sending remote-control commands to jAER over UDP
+
+    Methods
+    -------
+    send_command(command)
+        Send command to jAER, retrying with backoff until a reply arrives
+    parse_reply(reply)
+        Split a jAER reply into its text and the file path it mentions
+    get_metrics()
+        Return the timing metrics of the commands sent since the last reset
+    reset_metrics()
+        Forget the timing metrics of previous commands
+    close()
+        Close the UDP socket
+    """
+
+    def __init__(self, host = "localhost", port = 8997, timeout = 1.0, max_retries = 3, backoff = 0.1, command_timeouts = None):
+
+        self._ADDRESS = (host, port)
+        self._TIMEOUT = timeout # Default deadline (s) to receive the reply of one attempt
+        self._COMMAND_TIMEOUTS = command_timeouts or {} # Deadline per command name, e.g. {"startlogging": 2.0}
+        self._MAX_RETRIES = max_retries
+        self._BACKOFF = backoff # Wait (s) before the first retry, doubled on every retry
+        self._s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._metrics = []
+
+    # ------------ SEND COMMAND METHOD ------------
+
+    def send_command(self, command:bytes) -> tuple[bytes, tuple]:
+
+        """
+        Send command to jAER, retrying with backoff until a reply arrives
+
+        Returns (reply, address) like socket.recvfrom
+        """
+
+        command_name = command.split(b" ")[0].decode()
+        timeout = self._COMMAND_TIMEOUTS.get(command_name, self._TIMEOUT)
+        self._discard_stale_replies()
+
+        first_send_ns = None
+        first_send_time = None
+        for attempt in range(1, self._MAX_RETRIES + 2):
+            send_ns = time.monotonic_ns()
+            send_time = time.time()
+            if first_send_ns is None:
+                first_send_ns, first_send_time = send_ns, send_time
+
+            self._s.sendto(command, self._ADDRESS)
+            self._s.settimeout(timeout)
+            try:
+                data = self._s.recvfrom(3000)
+            except (socket.timeout, ConnectionRefusedError): # Lost packet or jAER not listening yet
+                if attempt <= self._MAX_RETRIES:
+                    time.sleep(self._BACKOFF * 2**(attempt - 1))
+                continue
+
+            ack_ns = time.monotonic_ns()
+            self._metrics.append({"command": command_name,
+                                  "send_time": first_send_time, # Host wall-clock time of the first attempt (s)
+                                  "ack_time": time.time(), # Host wall-clock time of the reply (s)
+                                  "rtt_ms": (ack_ns - send_ns) / 1e6, # Round trip of the answered attempt
+                                  "ack_delay_ms": (ack_ns - first_send_ns) / 1e6, # From the first attempt to the reply
+                                  "attempts": attempt,
+                                  "reply": data[0].decode(errors = "ignore").strip()})
+            return data
+
+        raise OSError(f"No reply from jAER to {command_name} after {self._MAX_RETRIES + 1} attempt(s)")
+
+    def _discard_stale_replies(self) -> None:
+
+        """
+        Drop late replies of previous commands so they are not taken as the next reply
+        """
+
+        self._s.setblocking(False)
+        try:
+            while True:
+                self._s.recvfrom(3000)
+        except (BlockingIOError, OSError):
+            pass
+        finally:
+            self._s.setblocking(True)
+
+    # ------------ PARSE REPLY METHOD ------------
+
+    def parse_reply(self, reply:bytes) -> dict:
+
+        """
+        Split a jAER reply into its text and the file path it mentions
+        """
+
+        text = reply.decode(errors = "ignore").strip()
+        file_dir = None
+        if "file " in text:
+            file_dir = text.rsplit("file ", 1)[1].split("\n")[0].strip()
+
+        return {"text": text, "file": file_dir}
+
+    # ------------ METRICS METHODS ------------
+
+    def get_metrics(self) -> list[dict]:
+
+        """
+        Return the timing metrics of the commands sent since the last reset
+        """
+
+        return [dict(metric) for metric in self._metrics]
+
+    def reset_metrics(self) -> None:
+
+        """
+        Forget the timing metrics of previous commands
+        """
+
+        self._metrics = []
+
+    # ------------ CLOSE METHOD ------------
+
+    def close(self) -> None:
+
+        """
+        Close the UDP socket
+        """
+
+        self._s.close()
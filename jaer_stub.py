@@ -0,0 +1,197 @@
+from aedat_generator import AedatGenerator
+
+import io
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+
+class JaerStub:
+
+    """
+    Methods for a local UDP server that answers remote-control commands like jAER, and optionally
+    streams events over UDP like its AEUnicastOutput
+
+    Methods
+    -------
+    start()
+        Start answering commands in a background thread
+    stop()
+        Stop the server and close its socket
+    get_address()
+        Return the (host, port) the server listens on
+    get_logging_log()
+        Return the host times at which every .aedat file started and stopped logging
+    """
+
+    def __init__(self, host = "localhost", port = 0, log_dir = None, reply_delay = 0.0, drop_rate = 0.0, event_rate = 1000,
+                 stream_address = None):
+
+        self._s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._s.bind((host, port)) # Port 0 picks a free port
+        self._s.settimeout(0.1)
+        self._LOG_DIR = log_dir or tempfile.gettempdir() # Folder where "recorded" .aedat files are written
+        self._REPLY_DELAY = reply_delay # Delay (s) before every reply, e.g. to mimic jAER opening the file
+        self._DROP_RATE = drop_rate # Fraction of commands that are ignored, to exercise retries
+        self._EVENT_RATE = event_rate # Events per second written to the .aedat file
+        self._aedat_generator = AedatGenerator()
+        self._STREAM_ADDRESS = stream_address # (host, port) receiving the event stream. Default: None (no stream)
+        self._STREAM_PERIOD = 0.01 # Time (s) between two bursts of stream packets
+        self._MAX_PACKET_EVENTS = 8000 # Events per packet, below the 64 kB UDP limit
+        self._stream_thread = None
+        self._is_running = False
+        self._thread = None
+        self._file_dir = None
+        self._start_logging_time = 0.0
+        self._logging_log = []
+
+    # ------------ START AND STOP METHODS ------------
+
+    def start(self) -> None:
+
+        """
+        Start answering commands in a background thread
+        """
+
+        self._is_running = True
+        self._thread = threading.Thread(target = self._serve, daemon = True)
+        self._thread.start()
+        if self._STREAM_ADDRESS is not None:
+            self._stream_thread = threading.Thread(target = self._stream_events, daemon = True)
+            self._stream_thread.start()
+
+    def stop(self) -> None:
+
+        """
+        Stop the server and close its socket
+        """
+
+        self._is_running = False
+        if self._thread is not None:
+            self._thread.join()
+        if self._stream_thread is not None:
+            self._stream_thread.join()
+        self._s.close()
+
+    def get_address(self) -> tuple[str, int]:
+
+        """
+        Return the (host, port) the server listens on
+        """
+
+        return self._s.getsockname()
+
+    def get_logging_log(self) -> list[dict]:
+
+        """
+        Return the host times at which every .aedat file started and stopped logging
+        """
+
+        return [dict(logging) for logging in self._logging_log]
+
+    # ------------ SERVER METHODS ------------
+
+    def _serve(self) -> None:
+
+        """
+        Answer commands until stop() is called
+        """
+
+        while self._is_running:
+            try:
+                command, address = self._s.recvfrom(3000)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+
+            if random.random() < self._DROP_RATE:
+                continue
+            time.sleep(self._REPLY_DELAY)
+            self._s.sendto(self._handle_command(command.decode(errors = "ignore").strip()), address)
+
+    def _handle_command(self, command:str) -> bytes:
+
+        """
+        Execute one command and return the reply jAER would send
+        """
+
+        fields = command.split(" ", 1)
+        if fields[0] == "startlogging":
+            file_name = fields[1] if len(fields) > 1 else "jaer_stub"
+            self._file_dir = os.path.join(self._LOG_DIR, f"{file_name}-{time.strftime('%Y-%m-%dT%H-%M-%S')}.aedat")
+            self._start_logging_time = time.time()
+            with open(self._file_dir, "wb") as aer_file:
+                aer_file.write(b"#!AER-DAT2.0\r\n# This is a raw AE data file created by JaerStub\r\n#End Of ASCII Header\r\n")
+            return f"starting logging to file {self._file_dir}\n".encode()
+
+        if fields[0] == "stoplogging":
+            if self._file_dir is None:
+                return b"not logging\n"
+            stop_logging_time = time.time()
+            n_events = self._write_events(stop_logging_time - self._start_logging_time)
+            self._logging_log.append({"file": os.path.basename(self._file_dir),
+                                      "start_time": self._start_logging_time, # Host wall-clock time of event timestamp 0 (s)
+                                      "stop_time": stop_logging_time,
+                                      "n_events": n_events})
+            file_dir, self._file_dir = self._file_dir, None
+            return f"stopped logging to file {file_dir}\n".encode()
+
+        return f"unknown command {fields[0]}\n".encode()
+
+    def _write_events(self, duration:float) -> int:
+
+        """
+        Append random polarity events covering the logging duration to the .aedat file
+        """
+
+        n_events = max(int(duration * self._EVENT_RATE), 1)
+        with open(self._file_dir, "ab") as aer_file:
+            self._aedat_generator.write_events(aer_file, n_events, max(int(duration * 1e6), 1))
+
+        return n_events
+
+    # ------------ STREAM EVENTS (THREAD) METHOD ------------
+
+    def _stream_events(self) -> None:
+
+        """
+        Send random events at the event rate as sequence-numbered packets of address/timestamp pairs
+        """
+
+        stream_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sequence_number = 0
+        n_sent = 0
+        start_ns = time.monotonic_ns()
+
+        with stream_socket:
+            while self._is_running:
+                time.sleep(self._STREAM_PERIOD)
+                now_us = (time.monotonic_ns() - start_ns) // 1000
+                n_events = int(now_us * self._EVENT_RATE / 1e6) - n_sent
+                sent_us = n_sent * 1e6 / self._EVENT_RATE
+
+                for start in range(0, n_events, self._MAX_PACKET_EVENTS):
+                    n_packet = min(self._MAX_PACKET_EVENTS, n_events - start)
+                    packet_us = int(sent_us + start * 1e6 / self._EVENT_RATE)
+                    packet = io.BytesIO()
+                    packet.write(sequence_number.to_bytes(4, "big"))
+                    self._aedat_generator.write_events(packet, n_packet, max(int(n_packet * 1e6 / self._EVENT_RATE), 1), start_us = packet_us)
+                    stream_socket.sendto(packet.getvalue(), self._STREAM_ADDRESS)
+                    sequence_number += 1
+                n_sent += max(n_events, 0)
+
+# ------------ RUN STUB SERVER ------------
+
+if __name__ == "__main__":
+
+    stub = JaerStub(port = 8997)
+    stub.start()
+    print(f"JaerStub listening on {stub.get_address()}. Press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stub.stop()
@@ -0,0 +1,211 @@
+from collections import deque
+
+import numpy as np
+import socket
+import threading
+import time
+
+class LiveMonitor:
+
+    """
+    Methods for watching the events jAER streams over UDP while recording
+
+    Methods
+    -------
+    start(report_function)
+        Listen to the event stream in a background thread
+    stop()
+        Stop listening and close the socket
+    get_address()
+        Return the (host, port) the monitor listens on
+    reset()
+        Forget the statistics of previous packets, e.g. at the start of a take
+    get_statistics()
+        Return the rolling event rate and polarity statistics
+    """
+
+    def __init__(self, host = "localhost", port = 8991, window = 1.0, report_period = 1.0, use_sequence_numbers = True):
+
+        self._ADDRESS = (host, port) # jAER AEUnicastOutput destination. Default port: 8991
+        self._MASK = [0x003ff000,0x7fc00000,0x800,0] # Same address layout as FileManager
+        self._SHIFT = [12,22,11,31]
+        self._WINDOW = window # Time (s) covered by the rolling statistics
+        self._BIN = 0.1 # Time (s) of one bin of the rolling statistics
+        self._REPORT_PERIOD = report_period # Time (s) between two calls of the report function
+        self._USE_SEQUENCE_NUMBERS = use_sequence_numbers # jAER prepends a 4-byte packet counter by default
+        self._RECEIVE_BUFFER = 8 << 20 # Socket buffer (bytes) absorbing bursts while a packet is decoded
+        self._MAX_PACKET = 65536
+        self._lock = threading.Lock()
+        self._is_running = False
+        self._thread = None
+        self._s = None
+        self._report_function = None
+        self.reset()
+
+    # ------------ START AND STOP METHODS ------------
+
+    def start(self, report_function = None) -> None:
+
+        """
+        Listen to the event stream in a background thread
+
+        report_function, if given, is called with get_statistics() every report period
+        """
+
+        self._s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self._RECEIVE_BUFFER)
+        try:
+            self._s.bind(self._ADDRESS)
+        except OSError as e:
+            self._s.close()
+            raise OSError(f"Unable to listen to the jAER event stream on port {self._ADDRESS[1]}: {e}")
+        self._s.settimeout(0.1)
+
+        self._report_function = report_function
+        self._is_running = True
+        self._thread = threading.Thread(target = self._receive_packets, daemon = True)
+        self._thread.start()
+
+    def stop(self) -> None:
+
+        """
+        Stop listening and close the socket
+        """
+
+        self._is_running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._s is not None:
+            self._s.close()
+            self._s = None
+
+    def get_address(self) -> tuple[str, int]:
+
+        """
+        Return the (host, port) the monitor listens on
+        """
+
+        return self._s.getsockname()
+
+    # ------------ STATISTICS METHODS ------------
+
+    def reset(self) -> None:
+
+        """
+        Forget the statistics of previous packets, e.g. at the start of a take
+        """
+
+        with self._lock:
+            self._bins = deque() # [bin number, polarity events, ON events]
+            self._n_events = 0
+            self._n_on = 0
+            self._n_special = 0
+            self._n_packets = 0
+            self._n_lost_packets = 0
+            self._last_sequence_number = None
+            self._last_ts = None
+            self._last_packet_time = None
+            self._reset_time = time.monotonic()
+
+    def get_statistics(self) -> dict:
+
+        """
+        Return the rolling event rate and polarity statistics
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            self._drop_old_bins(int(now / self._BIN))
+            n_window = sum(n_bin for _, n_bin, _ in self._bins)
+            n_window_on = sum(n_bin_on for _, _, n_bin_on in self._bins)
+            span = min(self._WINDOW, max(now - self._reset_time, self._BIN)) # Shorter right after a reset
+
+            return {"event_rate": n_window / span, # Polarity events per second over the window
+                    "on_ratio": n_window_on / n_window if n_window else None,
+                    "n_events": self._n_events, # Since the last reset
+                    "on_events": self._n_on,
+                    "special_events": self._n_special,
+                    "n_packets": self._n_packets,
+                    "lost_packets": self._n_lost_packets,
+                    "last_ts": self._last_ts,
+                    "seconds_since_last_packet": None if self._last_packet_time is None else now - self._last_packet_time}
+
+    def _drop_old_bins(self, current_bin:int) -> None:
+
+        """
+        Remove the bins that left the rolling window
+        """
+
+        first_bin = current_bin - int(round(self._WINDOW / self._BIN)) + 1
+        while self._bins and self._bins[0][0] < first_bin:
+            self._bins.popleft()
+
+    # ------------ RECEIVE PACKETS (THREAD) METHODS ------------
+
+    def _receive_packets(self) -> None:
+
+        """
+        Decode packets as they arrive and call the report function every report period
+        """
+
+        buffer = bytearray(self._MAX_PACKET)
+        next_report = time.monotonic() + self._REPORT_PERIOD
+
+        while self._is_running:
+            try:
+                n_bytes = self._s.recv_into(buffer)
+            except socket.timeout:
+                n_bytes = 0
+            except OSError:
+                return
+
+            if n_bytes:
+                self._add_packet(memoryview(buffer)[:n_bytes])
+
+            if self._report_function is not None and time.monotonic() >= next_report:
+                next_report += self._REPORT_PERIOD
+                self._report_function(self.get_statistics())
+
+    def _add_packet(self, packet:memoryview) -> None:
+
+        """
+        Count the polarity and ON events of one packet of big-endian address/timestamp pairs
+        """
+
+        sequence_number = None
+        if self._USE_SEQUENCE_NUMBERS:
+            sequence_number = int.from_bytes(packet[:4], "big", signed = True)
+            packet = packet[4:]
+
+        raw_events = np.frombuffer(packet, dtype = ">u4", count = (len(packet) // 8) * 2)
+        addresses = raw_events[0::2]
+
+        # Only the bits the statistics need, without building x, y and ts arrays
+        is_special = (addresses >> self._SHIFT[3]).astype(bool)
+        n_special = int(np.count_nonzero(is_special))
+        n_polarity = len(addresses) - n_special
+        n_on = int(np.count_nonzero((addresses & self._MASK[2]).astype(bool) & ~is_special))
+
+        now = time.monotonic()
+        current_bin = int(now / self._BIN)
+        with self._lock:
+            if self._bins and self._bins[-1][0] == current_bin:
+                self._bins[-1][1] += n_polarity
+                self._bins[-1][2] += n_on
+            else:
+                self._bins.append([current_bin, n_polarity, n_on])
+                self._drop_old_bins(current_bin)
+
+            if sequence_number is not None and self._last_sequence_number is not None and sequence_number > self._last_sequence_number + 1:
+                self._n_lost_packets += sequence_number - self._last_sequence_number - 1
+            if sequence_number is not None:
+                self._last_sequence_number = sequence_number
+
+            self._n_events += n_polarity
+            self._n_on += n_on
+            self._n_special += n_special
+            self._n_packets += 1
+            if len(raw_events):
+                self._last_ts = int(raw_events[-1])
+            self._last_packet_time = now
@@ -1,5 +1,8 @@
+from batch_converter import BatchConverter
 from capture_system import CaptureSystem
+from event_filter import EventFilter
 from file_manager import FileManager
+from live_monitor import LiveMonitor
 from safe_io import SafeIO
 
 import glob
@@ -46,17 +49,14 @@ def main(output_dir) -> None:
                 folder = input("Insert name of folder:")
 
             list_all_files = glob.glob(os.path.join(output_dir,folder,"*.aedat"))
-            for file in list_all_files:
-                file_dir_no_ext = file[:len(file)-6] # Remove .aedat from file name
-                file_manager.aedat_to_npy(file_dir_no_ext)
+            summary = batch_converter.convert(list_all_files)
+            safe_io.print_info(batch_converter.summary_to_text(summary))
 
         elif processing_mode == "2":
             
             list_all_files = glob.glob(os.path.join(output_dir,"**","*.aedat"),recursive=True)
-            
-            for file in list_all_files:
-                file_dir_no_ext = file[:len(file)-6] # Remove .aedat from file name
-                file_manager.aedat_to_npy(file_dir_no_ext)
+            summary = batch_converter.convert(list_all_files)
+            safe_io.print_info(batch_converter.summary_to_text(summary))
 
 # -----------------------------------------
                 
@@ -65,9 +65,23 @@ if __name__ == "__main__":
     OUTPUT_DIR = os.path.join(os.path.abspath(""),"test_data")
     ARDUINO_BOARD = "USB-SERIAL CH340"
     TIME_PRESS_BUTTON = 0 # Time (sec) to offset recording after pressing button. Default: 0
-
-    capture_system = CaptureSystem(ARDUINO_BOARD, OUTPUT_DIR, TIME_PRESS_BUTTON) 
+    N_WORKERS = None # Number of processes used to convert .aedat files. Default: None (one per CPU core)
+    OUTPUT_FORMAT = "matrix" # Layout of _events files: "matrix" (4xN int32 .npy), "structured" (ts,x,y,p records .npy) or "compressed" (.evz chunks)
+    WRITE_INDEX = False # Write _index.npz time index and label event ranges next to each _events.npy. Default: False
+    BACKGROUND_WINDOW_US = None # Remove events without a neighbour event in the last BACKGROUND_WINDOW_US (us). Default: None (disabled)
+    REFRACTORY_US = None # Remove events closer than REFRACTORY_US (us) to the previous event of their pixel. Default: None (disabled)
+    HOT_PIXEL_SIGMA = None # Remove pixels firing HOT_PIXEL_SIGMA standard deviations above the mean rate. Default: None (disabled)
+    N_CONVERSION_WORKERS = 0 # Threads converting each take to .npy while recording continues. Default: 0 (disabled)
+    LIVE_PREVIEW_PORT = None # Port of the jAER AE-over-UDP output (jAER default: 8991) printed while recording. Default: None (disabled)
+
+    live_monitor = LiveMonitor(port = LIVE_PREVIEW_PORT) if LIVE_PREVIEW_PORT else None
+    event_filter = None
+    if (BACKGROUND_WINDOW_US, REFRACTORY_US, HOT_PIXEL_SIGMA) != (None, None, None):
+        event_filter = EventFilter(background_window_us = BACKGROUND_WINDOW_US, refractory_us = REFRACTORY_US, hot_pixel_sigma = HOT_PIXEL_SIGMA)
+    capture_system = CaptureSystem(ARDUINO_BOARD, OUTPUT_DIR, TIME_PRESS_BUTTON, N_CONVERSION_WORKERS, output_format = OUTPUT_FORMAT,
+                                   live_monitor = live_monitor, event_filter = event_filter) 
     file_manager = FileManager(OUTPUT_DIR)
+    batch_converter = BatchConverter(OUTPUT_DIR, N_WORKERS, output_format = OUTPUT_FORMAT, write_index = WRITE_INDEX, event_filter = event_filter)
     safe_io = SafeIO()
 
     main(OUTPUT_DIR)
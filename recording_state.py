@@ -0,0 +1,155 @@
+import threading
+import time
+
+class RecordingState:
+
+    """
+    Names of the states of a recording take
+    """
+
+    IDLE = "idle" # Between takes
+    ARMED = "armed" # Waiting for the pedal to start recording
+    RECORDING = "recording" # jAER is logging
+    STOPPED = "stopped" # Pedal pressed again, the take is being saved
+    AWAITING_CONTINUE = "awaiting_continue" # Waiting for the Red (continue) or White (quit) button
+    EXITING = "exiting" # White button pressed after a take, or capture cancelled
+
+class RecordingStateMachine:
+
+    """
+    Methods for moving a recording take through its states atomically
+
+    Methods
+    -------
+    get_state()
+        Return the current state
+    transition(from_states, to_state)
+        Move to to_state if the current state is one of from_states
+    wait_for_state(states, timeout)
+        Block until the state is one of states or timeout ends
+    reset()
+        Go back to idle and forget previous transitions
+    get_transitions()
+        Return the transitions since the last reset with their times
+    """
+
+    _ALLOWED_TRANSITIONS = {RecordingState.IDLE: {RecordingState.ARMED, RecordingState.EXITING},
+                            RecordingState.ARMED: {RecordingState.RECORDING, RecordingState.EXITING},
+                            RecordingState.RECORDING: {RecordingState.STOPPED, RecordingState.EXITING},
+                            RecordingState.STOPPED: {RecordingState.AWAITING_CONTINUE, RecordingState.IDLE, RecordingState.EXITING},
+                            RecordingState.AWAITING_CONTINUE: {RecordingState.IDLE, RecordingState.EXITING},
+                            RecordingState.EXITING: set()}
+
+    def __init__(self):
+
+        self._changed = threading.Condition() # Notified on every transition
+        self._state = RecordingState.IDLE
+        self._transitions = []
+
+    # ------------ GET STATE METHOD ------------
+
+    def get_state(self) -> str:
+
+        """
+        Return the current state
+        """
+
+        return self._state # Reading one attribute is atomic, so readers never take the lock
+
+    # ------------ TRANSITION METHOD ------------
+
+    def transition(self, from_states:tuple, to_state:str) -> bool:
+
+        """
+        Move to to_state if the current state is one of from_states
+        """
+
+        with self._changed:
+            if self._state not in from_states:
+                return False
+            if to_state not in self._ALLOWED_TRANSITIONS[self._state]:
+                raise ValueError(f"Invalid transition from {self._state} to {to_state}")
+
+            self._transitions.append({"from": self._state, "to": to_state, "time_ns": time.monotonic_ns()})
+            self._state = to_state
+            self._changed.notify_all()
+
+        return True
+
+    # ------------ WAIT FOR STATE METHOD ------------
+
+    def wait_for_state(self, states:tuple, timeout:float) -> bool:
+
+        """
+        Block until the state is one of states or timeout ends
+        """
+
+        with self._changed:
+            return self._changed.wait_for(lambda: self._state in states, timeout = timeout)
+
+    # ------------ RESET METHOD ------------
+
+    def reset(self) -> None:
+
+        """
+        Go back to idle and forget previous transitions
+        """
+
+        with self._changed:
+            self._state = RecordingState.IDLE
+            self._transitions = []
+            self._changed.notify_all()
+
+    # ------------ GET TRANSITIONS METHOD ------------
+
+    def get_transitions(self) -> list[dict]:
+
+        """
+        Return the transitions since the last reset with their times
+        """
+
+        with self._changed:
+            return [dict(transition) for transition in self._transitions]
+
+class TimesBuffer:
+
+    """
+    Methods for an append-only buffer of label times
+
+    Methods
+    -------
+    append(value)
+        Add a time at the end of the buffer
+    snapshot()
+        Return an immutable copy of the times
+    clear()
+        Start a new empty buffer
+    """
+
+    def __init__(self):
+
+        self._values = []
+
+    def append(self, value:float) -> None:
+
+        """
+        Add a time at the end of the buffer
+        """
+
+        self._values.append(value) # list.append is atomic, so the serial thread never blocks here
+
+    def snapshot(self) -> tuple:
+
+        """
+        Return an immutable copy of the times
+        """
+
+        return tuple(self._values)
+
+    def clear(self) -> None:
+
+        """
+        Start a new empty buffer
+        """
+
+        self._values = [] # Snapshots taken before keep their values